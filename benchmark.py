@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Motores que se miden: nombre -> (módulo, clase)
+MOTORES = {
+    'ensamblador': ('ensamblador', 'EnsambladorIA32'),
+    'dos_pasadas': ('ensambladorDosPasadas', 'EnsambladorIA32'),
+    'paralelo': ('paralelo', 'EnsambladorParalelo'),
+}
+
+TAMANOS = {'10k': 10_000, '1M': 1_000_000, '10M': 10_000_000}
+
+REGISTROS = ('EAX', 'ECX', 'EDX', 'EBX')
+ALU = ('ADD', 'SUB', 'CMP')
+SALTOS = ('JMP', 'JE', 'JNE')
+
+
+def generar_programa(lineas, densidad_etiquetas=0.1, proporcion_saltos=0.15,
+                     proporcion_adelante=0.5, semilla=0):
+    # Genera `lineas` líneas con MOV/ADD/SUB/CMP/JMP/JE/JNE. Cada línea es
+    # etiqueta con probabilidad densidad_etiquetas y salto con probabilidad
+    # proporcion_saltos; de los saltos, proporcion_adelante van a etiquetas
+    # aún no definidas (cercanas, como en código real) y el resto a
+    # etiquetas recientes ya definidas. Al final se definen las etiquetas
+    # referenciadas que falten, así que el programa siempre ensambla sin errores.
+    aleatorio = random.Random(semilla)
+    definidas = 0
+    maxima_referida = -1
+    for _ in range(lineas):
+        r = aleatorio.random()
+        if r < densidad_etiquetas:
+            yield f"L{definidas}:\n"
+            definidas += 1
+        elif r < densidad_etiquetas + proporcion_saltos and (definidas or proporcion_adelante):
+            if definidas == 0 or aleatorio.random() < proporcion_adelante:
+                destino = definidas + aleatorio.randrange(8)
+                maxima_referida = max(maxima_referida, destino)
+            else:
+                destino = definidas - 1 - aleatorio.randrange(min(definidas, 16))
+            yield f"    {aleatorio.choice(SALTOS)} L{destino}\n"
+        elif r < 0.6:
+            destino, fuente = aleatorio.choice(REGISTROS), aleatorio.choice(REGISTROS)
+            if aleatorio.random() < 0.5:
+                yield f"    MOV {destino}, {fuente}\n"
+            else:
+                yield f"    MOV {destino}, {aleatorio.randrange(1 << 16):#x}\n"
+        else:
+            destino = aleatorio.choice(REGISTROS)
+            fuente = aleatorio.choice(REGISTROS) if aleatorio.random() < 0.5 else str(aleatorio.randrange(1000))
+            yield f"    {aleatorio.choice(ALU)} {destino}, {fuente}\n"
+    for etiqueta in range(definidas, maxima_referida + 1):
+        yield f"L{etiqueta}:\n"
+
+
+def escribir_programa(ruta, lineas, **opciones):
+    with open(ruta, 'w') as f:
+        bloque = []
+        for linea in generar_programa(lineas, **opciones):
+            bloque.append(linea)
+            if len(bloque) >= 65536:
+                f.writelines(bloque)
+                bloque.clear()
+        f.writelines(bloque)
+
+
+def medir(motor, archivo, lineas):
+    # Se ejecuta en un proceso hijo para que el pico de RSS sea sólo de esta medición
+    import importlib
+    modulo, clase = MOTORES[motor]
+    ensamblador = getattr(importlib.import_module(modulo), clase)()
+    with tempfile.TemporaryDirectory() as directorio:
+        inicio = time.perf_counter()
+        ensamblador.ensamblar(archivo, directorio_salida=directorio)
+        segundos = time.perf_counter() - inicio
+    return {
+        'motor': motor,
+        'lineas': lineas,
+        'bytes': len(ensamblador.codigo_hex),
+        'segundos': segundos,
+        'lineas_por_segundo': lineas / segundos,
+        'bytes_por_segundo': len(ensamblador.codigo_hex) / segundos,
+        'rss_pico_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'errores': len(ensamblador.diagnosticos.errores),
+    }
+
+
+def medir_en_proceso(motor, archivo, lineas):
+    resultado = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--medir', motor, archivo, str(lineas)],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(resultado.stdout)
+
+
+def comparar(resultados, base, tolerancia):
+    # Regresión: menos líneas/s o más memoria que la base, fuera de tolerancia
+    regresiones = []
+    for r in resultados:
+        clave = f"{r['motor']}/{r['lineas']}"
+        anterior = base.get(clave)
+        if anterior is None:
+            continue
+        if r['lineas_por_segundo'] < anterior['lineas_por_segundo'] * (1 - tolerancia):
+            regresiones.append(f"{clave}: {r['lineas_por_segundo']:.0f} líneas/s "
+                               f"(base {anterior['lineas_por_segundo']:.0f})")
+        if r['rss_pico_kb'] > anterior['rss_pico_kb'] * (1 + tolerancia):
+            regresiones.append(f"{clave}: {r['rss_pico_kb']} KB de RSS (base {anterior['rss_pico_kb']})")
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los ensambladores IA-32")
+    parser.add_argument('--tamanos', nargs='+', default=['10k', '1M'], choices=sorted(TAMANOS),
+                        help="tamaños de programa a generar")
+    parser.add_argument('--motores', nargs='+', default=sorted(MOTORES), choices=sorted(MOTORES))
+    parser.add_argument('--densidad-etiquetas', type=float, default=0.1)
+    parser.add_argument('--proporcion-saltos', type=float, default=0.15)
+    parser.add_argument('--proporcion-adelante', type=float, default=0.5)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--base', default='benchmark_base.json', help="resultados de referencia")
+    parser.add_argument('--guardar-base', action='store_true', help="guardar los resultados como nueva base")
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help="fracción de empeoramiento aceptada antes de fallar")
+    parser.add_argument('--medir', nargs=3, metavar=('MOTOR', 'ARCHIVO', 'LINEAS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.medir:
+        motor, archivo, lineas = args.medir
+        print(json.dumps(medir(motor, archivo, int(lineas))))
+        return 0
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for tamano in args.tamanos:
+            lineas = TAMANOS[tamano]
+            archivo = os.path.join(directorio, f"sintetico_{tamano}.asm")
+            escribir_programa(archivo, lineas, densidad_etiquetas=args.densidad_etiquetas,
+                              proporcion_saltos=args.proporcion_saltos,
+                              proporcion_adelante=args.proporcion_adelante, semilla=args.semilla)
+            for motor in args.motores:
+                r = medir_en_proceso(motor, archivo, lineas)
+                resultados.append(r)
+                print(f"{motor:12} {tamano:>4}: {r['lineas_por_segundo']:12,.0f} líneas/s "
+                      f"{r['bytes_por_segundo']:14,.0f} bytes/s {r['rss_pico_kb']:10,} KB RSS")
+
+    if args.guardar_base:
+        with open(args.base, 'w') as f:
+            json.dump({f"{r['motor']}/{r['lineas']}": r for r in resultados}, f, indent=2)
+        print(f"Base guardada en {args.base}")
+        return 0
+
+    if os.path.exists(args.base):
+        with open(args.base) as f:
+            regresiones = comparar(resultados, json.load(f), args.tolerancia)
+        for regresion in regresiones:
+            print(f"Regresión: {regresion}", file=sys.stderr)
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
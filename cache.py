@@ -0,0 +1,182 @@
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+import preprocesador
+import simbolos
+
+# Cambia si cambia el formato de las entradas guardadas
+VERSION_CACHE = 5
+
+VERSIONES = {}  # {clase: hash del código del ensamblador}
+CACHES = {}  # {(directorio, limite): CacheEnsamblado}, una por proceso
+
+
+def version_ensamblador(clase):
+    # Hash del código fuente de los módulos que definen la clase y sus bases,
+    # del preprocesador, de la mirilla, de la combinación en paralelo y de la
+    # tabla de símbolos: cualquier cambio en el ensamblador invalida las
+    # entradas anteriores
+    version = VERSIONES.get(clase)
+    if version is None:
+        h = hashlib.sha256(f"{VERSION_CACHE}:{clase.__module__}.{clase.__qualname__}".encode())
+        fuentes = [inspect.getsourcefile(base) for base in clase.__mro__[:-1]]
+        fuentes.append(inspect.getsourcefile(preprocesador))
+        fuentes.append(inspect.getsourcefile(simbolos))
+        # mirilla y paralelo importan ensamblador, que importa este módulo: se
+        # ubican por ruta (paralelo ya está si la clase es EnsambladorParalelo)
+        for modulo in ('mirilla.py', 'paralelo.py'):
+            fuente = os.path.join(os.path.dirname(fuentes[-1]), modulo)
+            if fuente not in fuentes:
+                fuentes.append(fuente)
+        for fuente in fuentes:
+            with open(fuente, 'rb') as f:
+                h.update(f.read())
+        version = VERSIONES[clase] = h.hexdigest()
+    return version
+
+
+class CacheEnsamblado:
+    # Cache en disco de resultados por archivo: código, tabla de símbolos,
+    # referencias/fixups y errores, con clave = hash(versión + fuente). Cada
+    # entrada es un archivo; al pasar de `limite_bytes` se expulsan las menos
+    # usadas recientemente (el orden se toma de la fecha de modificación).
+    def __init__(self, directorio, limite_bytes=256 * 1024 * 1024):
+        self.directorio = directorio
+        self.limite_bytes = limite_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsados = 0
+        os.makedirs(directorio, exist_ok=True)
+
+        entradas = []
+        for nombre in os.listdir(directorio):
+            if nombre.endswith('.pkl'):
+                info = os.stat(os.path.join(directorio, nombre))
+                entradas.append((info.st_mtime, nombre[:-4], info.st_size))
+        self.indice = OrderedDict()  # {clave: tamaño}, de la menos a la más reciente
+        for _, clave, tamano in sorted(entradas):
+            self.indice[clave] = tamano
+        self.total = sum(self.indice.values())
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave + '.pkl')
+
+    def clave(self, clase, archivo, variante=''):
+        # `variante` distingue opciones que cambian el resultado (optimizar)
+        h = hashlib.sha256(f"{version_ensamblador(clase)}:{variante}".encode())
+        with open(archivo, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+        return h.hexdigest()
+
+    def obtener(self, clave):
+        try:
+            with open(self.ruta(clave), 'rb') as f:
+                datos = pickle.load(f)
+            os.utime(self.ruta(clave))
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        if clave in self.indice:
+            self.indice.move_to_end(clave)
+        return datos
+
+    def guardar(self, clave, ensamblador, referencias=''):
+        # `referencias` es el texto de referencias.txt: en una pasada las
+        # referencias ya resueltas no quedan en el ensamblador
+        datos = {
+            'codigo': bytes(ensamblador.codigo_hex),
+            'tabla_simbolos': ensamblador.tabla_simbolos,
+            'referencias_pendientes': dict(ensamblador.referencias_pendientes),
+            'absolutos_pendientes': dict(ensamblador.absolutos_pendientes),
+            'reubicaciones': ensamblador.reubicaciones,
+            'fixups': list(getattr(ensamblador, 'fixups', ())),
+            'errores': list(ensamblador.diagnosticos.errores),
+            'incluidos': dict(getattr(ensamblador, 'incluidos', {})),
+            'referencias': referencias,
+        }
+        # Se escribe a un temporal y se renombra para que otro proceso nunca
+        # lea una entrada a medias
+        fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tamano = f.tell()
+        os.replace(temporal, self.ruta(clave))
+
+        self.total += tamano - self.indice.pop(clave, 0)
+        self.indice[clave] = tamano
+        self.expulsar()
+
+    def expulsar(self):
+        while self.total > self.limite_bytes and len(self.indice) > 1:
+            clave, tamano = self.indice.popitem(last=False)
+            self.total -= tamano
+            self.expulsados += 1
+            try:
+                os.remove(self.ruta(clave))
+            except OSError:
+                pass  # Otro proceso ya la expulsó
+
+    def estadisticas(self):
+        return {
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'expulsados': self.expulsados,
+            'entradas': len(self.indice),
+            'bytes': self.total,
+        }
+
+
+def obtener_cache(directorio, limite_bytes=256 * 1024 * 1024):
+    # Una instancia por proceso y directorio, para no reescanear en cada trabajo
+    cache = CACHES.get((directorio, limite_bytes))
+    if cache is None:
+        cache = CACHES[(directorio, limite_bytes)] = CacheEnsamblado(directorio, limite_bytes)
+    return cache
+
+
+def incluidos_vigentes(incluidos):
+    for ruta, firma in incluidos.items():
+        try:
+            if preprocesador.firma(ruta) != firma:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def ensamblar_con_cache(cache, ensamblador, archivo, directorio_salida='.'):
+    # Devuelve True si el resultado salió de la cache. En ese caso no se
+    # tokeniza ni se codifica nada: sólo se restauran los datos y se
+    # regeneran los reportes.
+    clave = cache.clave(type(ensamblador), archivo, 'optimizar' if ensamblador.optimizar else '')
+    datos = cache.obtener(clave)
+    if datos is not None and not incluidos_vigentes(datos['incluidos']):
+        datos = None  # Cambió algún %include: la clave sólo cubre el archivo principal
+        cache.aciertos -= 1
+        cache.fallos += 1
+    if datos is None:
+        ensamblador.ensamblar(archivo, directorio_salida=directorio_salida)
+        with open(os.path.join(directorio_salida, 'referencias.txt')) as f:
+            cache.guardar(clave, ensamblador, f.read())
+        return False
+
+    ensamblador.codigo_hex = bytearray(datos['codigo'])
+    ensamblador.contador_posicion = len(ensamblador.codigo_hex)
+    ensamblador.tabla_simbolos = datos['tabla_simbolos']
+    ensamblador.referencias_pendientes = datos['referencias_pendientes']
+    ensamblador.absolutos_pendientes = datos['absolutos_pendientes']
+    ensamblador.reubicaciones = datos['reubicaciones']
+    if hasattr(ensamblador, 'fixups'):
+        ensamblador.fixups = datos['fixups']
+    ensamblador.diagnosticos.errores.extend(datos['errores'])
+    ensamblador.exportar_simbolos(directorio_salida)
+    with open(os.path.join(directorio_salida, 'referencias.txt'), 'w') as f:
+        f.write(datos['referencias'])
+    ensamblador.diagnosticos.vaciar()
+    return True
@@ -0,0 +1,154 @@
+import json
+import os
+import socket
+import struct
+import sys
+from collections import namedtuple
+
+# Protocolo con servidor.py sobre un socket Unix. Cada mensaje es un marco:
+#   cabecera '>II' (largo de meta, largo de datos) + meta JSON UTF-8 + datos
+# Pedidos (meta['tipo']):
+#   'texto':    datos = fuente UTF-8; meta opcional: motor, origen
+#               -> meta {simbolos, fixups, errores}, datos = código
+#   'archivos': meta {entradas, directorio, formato, salida, motor}, como la
+#               línea de comandos de ensamblador.py -> meta {resultados}
+#   'estado':   -> meta con contadores del servidor
+# Una respuesta con meta['error'] indica que el pedido no se pudo atender.
+CABECERA = struct.Struct('>II')
+MAXIMO_MARCO = 1 << 28  # Un marco más grande se toma como basura en el socket
+
+SOCKET = os.environ.get('ENSAMBLADOR_SOCKET') or os.path.join(
+    os.environ.get('TMPDIR', '/tmp'), f"ensamblador-{os.getuid()}.sock")
+
+# Mismos campos que ensamblador.Resultado, sin importar el ensamblador
+Resultado = namedtuple('Resultado', 'codigo simbolos fixups errores')
+
+
+def marco(meta, datos=b''):
+    meta = json.dumps(meta, ensure_ascii=False, separators=(',', ':')).encode()
+    return b''.join((CABECERA.pack(len(meta), len(datos)), meta, datos))
+
+
+def largos(cabecera):
+    largo_meta, largo_datos = CABECERA.unpack(cabecera)
+    if largo_meta + largo_datos > MAXIMO_MARCO:
+        raise ValueError(f"marco de {largo_meta + largo_datos} bytes, demasiado grande")
+    return largo_meta, largo_datos
+
+
+class ErrorServidor(Exception):
+    pass
+
+
+class Cliente:
+    # Conexión persistente: cada pedido cuesta un viaje de ida y vuelta por el
+    # socket, sin arrancar el intérprete ni armar un ensamblador
+    def __init__(self, ruta=SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(ruta)
+        except OSError:
+            self.socket.close()
+            raise
+        self.archivo = self.socket.makefile('rb')
+
+    def cerrar(self):
+        self.archivo.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excepcion):
+        self.cerrar()
+
+    def pedir(self, meta, datos=b''):
+        self.socket.sendall(marco(meta, datos))
+        cabecera = self.archivo.read(CABECERA.size)
+        if len(cabecera) < CABECERA.size:
+            raise ConnectionError("el servidor cerró la conexión")
+        largo_meta, largo_datos = largos(cabecera)
+        respuesta = json.loads(self.archivo.read(largo_meta))
+        datos = self.archivo.read(largo_datos)
+        if 'error' in respuesta:
+            raise ErrorServidor(respuesta['error'])
+        return respuesta, datos
+
+    def ensamblar_texto(self, fuente, motor='ensamblador', origen=None):
+        meta = {'tipo': 'texto', 'motor': motor}
+        if origen is not None:
+            meta['origen'] = os.path.abspath(origen)
+        respuesta, codigo = self.pedir(meta, fuente.encode())
+        return Resultado(codigo, respuesta['simbolos'], [tuple(f) for f in respuesta['fixups']],
+                         [tuple(e) for e in respuesta['errores']])
+
+    def ensamblar_archivos(self, entradas, directorio='.', formato='hex', salida=None, motor='ensamblador'):
+        # Las rutas van absolutas: el servidor no comparte el directorio actual
+        respuesta, _ = self.pedir({
+            'tipo': 'archivos',
+            'motor': motor,
+            'entradas': [os.path.abspath(entrada) for entrada in entradas],
+            'directorio': os.path.abspath(directorio),
+            'formato': formato,
+            'salida': os.path.abspath(salida) if salida else None,
+        })
+        return respuesta['resultados']
+
+    def estado(self):
+        return self.pedir({'tipo': 'estado'})[0]
+
+
+def mostrar(ruta):
+    # Las rutas vuelven absolutas; las que están bajo el directorio actual se
+    # muestran relativas, como las escribiría ensamblador.py
+    actual = os.getcwd() + os.sep
+    return ruta[len(actual):] if ruta.startswith(actual) else ruta
+
+
+def main(argv=None):
+    # Reemplazo de `python ensamblador.py` para scripts que lo invocan muchas
+    # veces: el trabajo lo hace servidor.py. Si no hay servidor escuchando se
+    # ensambla aquí mismo, con el mismo resultado.
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cliente del servidor de ensamblado IA-32")
+    parser.add_argument('entradas', nargs='*', default=['programa.asm'],
+                        help="archivos .asm, directorios o patrones glob")
+    parser.add_argument('-f', '--formato', choices=('bin', 'elf', 'hex'), default='hex',
+                        help="formato de salida (por defecto Intel HEX)")
+    parser.add_argument('-d', '--directorio', default='.',
+                        help="directorio base; cada archivo se escribe en <directorio>/<nombre>/")
+    parser.add_argument('-o', '--salida', help="archivo de salida (sólo con una entrada)")
+    parser.add_argument('--motor', choices=('dos_pasadas', 'ensamblador'), default='ensamblador')
+    parser.add_argument('--socket', default=SOCKET, help="socket del servidor")
+    args = parser.parse_args(argv)
+
+    try:
+        cliente = Cliente(args.socket)
+    except OSError:
+        import ensamblador
+        import ensambladorDosPasadas
+        clase = ensambladorDosPasadas.EnsambladorIA32 if args.motor == 'dos_pasadas' else None
+        return ensamblador.main(args.entradas + ['-f', args.formato, '-d', args.directorio]
+                                + (['-o', args.salida] if args.salida else []), clase=clase)
+
+    with cliente:
+        try:
+            resultados = cliente.ensamblar_archivos(args.entradas, args.directorio, args.formato,
+                                                    args.salida, args.motor)
+        except ErrorServidor as e:
+            parser.exit(2, f"{parser.prog}: error: {e}\n")
+
+    fallidos = 0
+    for archivo, ruta, tamano, errores in resultados:
+        archivo, ruta = mostrar(archivo), mostrar(ruta)
+        for linea, mensaje in errores:
+            donde = f":{linea}" if linea is not None else ""
+            print(f"{archivo}{donde}: error: {mensaje}", file=sys.stderr)
+        fallidos += bool(errores)
+        print(f"{archivo}: {tamano} bytes -> {ruta}")
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,524 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ensamblador
+import ensambladorDosPasadas
+
+# Prueba diferencial de los codificadores: genera flujos aleatorios de
+# instrucciones válidas, los ensambla y compara cada instrucción con la
+# codificación que sale de codificaciones.json, una tabla en la notación del
+# manual de Intel ("83 /0 ib", "B8+rd id", "0F 84 cd") que no depende del
+# código del ensamblador. La referencia elige, entre las formas de la tabla
+# que admiten los operandos, la más corta (la primera de la tabla si hay
+# empate), y ubica los saltos con la misma regla que cada motor.
+
+MOTORES = {
+    'ensamblador': ensamblador.EnsambladorIA32,
+    'dos_pasadas': ensambladorDosPasadas.EnsambladorIA32,
+}
+
+TABLA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codificaciones.json')
+
+# Registros por tamaño en el orden de su número, según el manual
+REGISTROS = {
+    32: ('EAX', 'ECX', 'EDX', 'EBX', 'ESP', 'EBP', 'ESI', 'EDI'),
+    16: ('AX', 'CX', 'DX', 'BX', 'SP', 'BP', 'SI', 'DI'),
+    8: ('AL', 'CL', 'DL', 'BL', 'AH', 'CH', 'DH', 'BH'),
+}
+ACUMULADORES = {'AL': 8, 'AX': 16, 'EAX': 32}
+PALABRAS_TAMANO = {8: 'BYTE', 16: 'WORD', 32: 'DWORD'}
+ANCHOS_INMEDIATO = {'ib': 1, 'iw': 2, 'id': 4}
+ESP, EBP = 4, 5
+
+# Valores que cruzan los límites de cada forma (imm8 con signo, 16 y 32 bits)
+INMEDIATOS_BORDE = (0, 1, -1, 2, 127, 128, -128, -129, 255, 256, 0x7FFF, 0x8000, -0x8000,
+                    0xFFFF, 0x10000, 0x7FFFFFFF, 0x80000000, -0x80000000, 0xFFFFFFFF)
+# Los que caben con o sin signo en cada tamaño de operando: los demás son un
+# error del ensamblador
+INMEDIATOS_POR_BITS = {bits: tuple(v for v in INMEDIATOS_BORDE if -(1 << (bits - 1)) <= v < 1 << bits)
+                       for bits in (8, 16, 32)}
+DESPLAZAMIENTOS_BORDE = (0, 1, -1, 4, 127, 128, -128, -129, 0x1000, -0x1000, 0x7FFFFFFF, -0x80000000)
+
+LOTES_POR_TAREA = 8  # Ensamblados por tarea del pool: amortiza el envío entre procesos
+
+
+def con_signo(valor, bits):
+    mitad = 1 << (bits - 1)
+    return ((valor + mitad) & ((1 << bits) - 1)) - mitad
+
+
+# Operandos de la referencia:
+#   ('reg', bits, numero)
+#   ('mem', bits o None, base, indice, escala, desplazamiento, etiqueta)
+#   ('imm', valor)
+#   ('etq', nombre)
+
+def cargar_tabla(ruta=TABLA):
+    # {mnemonico: [(patrones, codificacion)]} en el orden del archivo y los
+    # ejemplos [(fuente, hex)]
+    with open(ruta) as f:
+        datos = json.load(f)
+    formas = {}
+    for mnemonico, operandos, codificacion in datos['formas']:
+        patrones = tuple(patron.strip() for patron in operandos.split(','))
+        formas.setdefault(mnemonico, []).append((patrones, codificacion.split()))
+    return formas, datos['ejemplos']
+
+
+def tamano_operacion(operandos):
+    # Lo da un registro o una memoria con BYTE/WORD/DWORD; si no, 32 bits
+    for operando in operandos:
+        if operando[0] in ('reg', 'mem') and operando[1] is not None:
+            return operando[1]
+    return 32
+
+
+def encaja(patron, operando, bits):
+    tipo = operando[0]
+    if patron in ACUMULADORES:
+        return tipo == 'reg' and operando[1] == ACUMULADORES[patron] and operando[2] == 0
+    if patron.startswith('r/m'):
+        return int(patron[3:]) == bits and (tipo == 'mem' or (tipo == 'reg' and operando[1] == bits))
+    if patron.startswith('imm'):
+        if tipo != 'imm':
+            return False
+        # imm8 en una operación más ancha se extiende de signo: tiene que caber
+        return int(patron[3:]) == bits or -128 <= con_signo(operando[1], bits) <= 127
+    if patron.startswith('rel'):
+        return tipo == 'etq'
+    return tipo == 'reg' and operando[1] == int(patron[1:])
+
+
+def modrm(reg, operando):
+    # ModR/M (y SIB y desplazamiento) para r/m; con etiqueta devuelve además
+    # la posición del disp32 dentro de estos bytes
+    if operando[0] == 'reg':
+        return bytes((0xC0 | (reg << 3) | operando[2],)), None
+    _, _, base, indice, escala, desplazamiento, etiqueta = operando
+    if etiqueta is not None or base is None:
+        ancho = 4
+    elif desplazamiento == 0 and base != EBP:  # [EBP] sin desplazamiento no existe
+        ancho = 0
+    elif -128 <= desplazamiento <= 127:
+        ancho = 1
+    else:
+        ancho = 4
+    mod = 0 if base is None else {0: 0, 1: 1, 4: 2}[ancho]
+    if base is None and indice is None:
+        codigo = bytes(((reg << 3) | EBP,))
+    elif indice is None and base != ESP:
+        codigo = bytes(((mod << 6) | (reg << 3) | base,))
+    else:
+        sib = ({1: 0, 2: 1, 4: 2, 8: 3}[escala] << 6) | ((ESP if indice is None else indice) << 3)
+        sib |= EBP if base is None else base
+        codigo = bytes(((mod << 6) | (reg << 3) | ESP, sib))
+    campo = len(codigo) if etiqueta is not None else None
+    return codigo + desplazamiento.to_bytes(ancho, 'little', signed=True), campo
+
+
+def codificar_forma(patrones, codificacion, operandos):
+    # Bytes de una fila de la tabla y la reubicación (posición, etiqueta,
+    # sumando) si un operando es [etiqueta + n]
+    registro = memoria = inmediato = None
+    for patron, operando in zip(patrones, operandos):
+        if patron.startswith('r/m'):
+            memoria = operando
+        elif operando[0] == 'reg':
+            registro = operando
+        elif operando[0] == 'imm':
+            inmediato = operando[1]
+    codigo = bytearray()
+    absoluto = None
+    for token in codificacion:
+        if token[0] == '/':
+            reg = registro[2] if token == '/r' else int(token[1:])
+            bytes_modrm, campo = modrm(reg, memoria)
+            if campo is not None:
+                absoluto = (len(codigo) + campo, memoria[6], memoria[5])
+            codigo += bytes_modrm
+        elif '+r' in token:
+            codigo.append(int(token[:2], 16) + registro[2])
+        elif token in ANCHOS_INMEDIATO:
+            ancho = ANCHOS_INMEDIATO[token]
+            codigo += (inmediato & ((1 << (8 * ancho)) - 1)).to_bytes(ancho, 'little')
+        else:
+            codigo += bytes.fromhex(token)
+    return bytes(codigo), absoluto
+
+
+def codificar(formas, mnemonico, operandos):
+    bits = tamano_operacion(operandos)
+    mejor = None
+    for patrones, codificacion in formas.get(mnemonico, ()):
+        if len(patrones) == len(operandos) and all(encaja(p, o, bits) for p, o in zip(patrones, operandos)):
+            candidata = codificar_forma(patrones, codificacion, operandos)
+            if mejor is None or len(candidata[0]) < len(mejor[0]):
+                mejor = candidata
+    if mejor is None:
+        raise ValueError(f"sin forma en la tabla para {mnemonico} {operandos}")
+    return mejor
+
+
+def formas_salto(formas, mnemonico):
+    # {8: prefijo rel8, 32: prefijo rel32}
+    salto = {}
+    for patrones, codificacion in formas[mnemonico]:
+        if patrones[0].startswith('rel'):
+            salto[int(patrones[0][3:])] = bytes.fromhex(''.join(t for t in codificacion if t not in ('cb', 'cd')))
+    return salto
+
+
+def ubicar(formas, elementos, motor):
+    # Código esperado del programa y (inicio, fin) de cada instrucción.
+    # `elementos`: ('etq', nombre), ('ins', codigo, absoluto) o ('salto',
+    # mnemonico, etiqueta). En una pasada un salto es corto sólo si su
+    # etiqueta ya está definida y alcanza; con dos pasadas todos empiezan
+    # cortos y se agrandan los que no alcanzan hasta que nada cambia.
+    saltos = {e[1]: formas_salto(formas, e[1]) for e in elementos if e[0] == 'salto'}
+    largos = [len(saltos[e[1]][32]) + 4 if e[0] == 'salto' else 0 for e in elementos]
+    tamanos = [2 if e[0] == 'salto' else len(e[1]) if e[0] == 'ins' else 0 for e in elementos]
+
+    def direcciones():
+        posicion, etiquetas, inicios = 0, {}, []
+        for elemento, tamano in zip(elementos, tamanos):
+            inicios.append(posicion)
+            if elemento[0] == 'etq':
+                etiquetas[elemento[1]] = posicion
+            posicion += tamano
+        return etiquetas, inicios
+
+    if motor == 'ensamblador':
+        posicion, definidas = 0, {}
+        for k, elemento in enumerate(elementos):
+            if elemento[0] == 'etq':
+                definidas[elemento[1]] = posicion
+            elif elemento[0] == 'salto':
+                destino = definidas.get(elemento[2])
+                if destino is None or not -128 <= destino - (posicion + 2) <= 127:
+                    tamanos[k] = largos[k]
+            posicion += tamanos[k]
+        etiquetas, inicios = direcciones()
+    else:
+        while True:
+            etiquetas, inicios = direcciones()
+            crecieron = False
+            for k, elemento in enumerate(elementos):
+                if elemento[0] == 'salto' and tamanos[k] == 2:
+                    if not -128 <= etiquetas[elemento[2]] - (inicios[k] + 2) <= 127:
+                        tamanos[k] = largos[k]
+                        crecieron = True
+            if not crecieron:
+                break
+
+    codigo = bytearray()
+    limites = []
+    for elemento, tamano, inicio in zip(elementos, tamanos, inicios):
+        if elemento[0] == 'etq':
+            continue
+        if elemento[0] == 'ins':
+            _, bytes_ins, absoluto = elemento
+            if absoluto is not None:
+                campo, etiqueta, sumando = absoluto
+                valor = (etiquetas[etiqueta] + sumando) & 0xFFFFFFFF
+                bytes_ins = bytes_ins[:campo] + valor.to_bytes(4, 'little') + bytes_ins[campo + 4:]
+            codigo += bytes_ins
+        else:
+            ancho = 8 if tamano == 2 else 32
+            desplazamiento = etiquetas[elemento[2]] - (inicio + tamano)
+            codigo += saltos[elemento[1]][ancho] + desplazamiento.to_bytes(ancho // 8, 'little', signed=True)
+        limites.append((inicio, inicio + tamano))
+    return bytes(codigo), limites
+
+
+class Generador:
+    # Flujos aleatorios de instrucciones válidas: MOV y el grupo ALU con
+    # todas las combinaciones de registro, memoria e inmediato en 8, 16 y 32
+    # bits, saltos hacia atrás y hacia adelante y etiquetas. Todas las
+    # etiquetas referidas se definen antes del final del flujo. Con
+    # memoria=False sólo hay registros e inmediatos.
+    def __init__(self, aleatorio, formas, mnemonicos, memoria=True):
+        self.aleatorio = aleatorio
+        self.formas = formas
+        self.formas_operandos = 5 if memoria else 2
+        self.datos = [m for m in mnemonicos if not formas_salto(formas, m)]
+        self.saltos = [m for m in mnemonicos if formas_salto(formas, m)]
+
+    def texto_registro(self, operando):
+        nombre = REGISTROS[operando[1]][operando[2]]
+        return nombre.lower() if self.aleatorio.random() < 0.1 else nombre
+
+    def registro(self, bits):
+        return ('reg', bits, self.aleatorio.randrange(8))
+
+    def inmediato(self, bits):
+        a = self.aleatorio
+        if a.random() < 0.5:
+            valor = a.choice(INMEDIATOS_POR_BITS[bits])
+        else:
+            valor = a.randrange(-(1 << (bits - 1)), 1 << bits)
+        if valor < 0:
+            return ('imm', valor), str(valor)
+        return ('imm', valor), f"{valor:#x}" if a.random() < 0.5 else str(valor)
+
+    def memoria(self, bits, etiqueta):
+        # bits None: sin BYTE/WORD/DWORD, el tamaño lo da el otro operando
+        a = self.aleatorio
+        base = a.randrange(8) if a.random() < 0.85 else None
+        indice = a.choice((0, 1, 2, 3, 5, 6, 7)) if a.random() < 0.4 else None
+        escala = a.choice((1, 2, 4, 8)) if indice is not None else 1
+        if a.random() < 0.5:
+            desplazamiento = a.choice(DESPLAZAMIENTOS_BORDE)
+        else:
+            desplazamiento = a.randrange(-300, 300)
+        etiqueta = etiqueta() if a.random() < 0.1 else None
+        if base is None and indice is None and etiqueta is None and desplazamiento < 0:
+            desplazamiento = -desplazamiento  # [-4] se leería como un signo suelto
+        terminos = []
+        if base is not None:
+            terminos.append(REGISTROS[32][base])
+        if indice is not None:
+            if escala == 1 and base is not None and a.random() < 0.5:
+                terminos.append(REGISTROS[32][indice])
+            elif a.random() < 0.5:
+                terminos.append(f"{REGISTROS[32][indice]}*{escala}")
+            else:
+                terminos.append(f"{escala}*{REGISTROS[32][indice]}")
+        if etiqueta is not None:
+            terminos.append(etiqueta)
+        if desplazamiento or not terminos:
+            terminos.append(str(desplazamiento))
+        texto = terminos[0]
+        separador = ' ' if a.random() < 0.2 else ''
+        for termino in terminos[1:]:
+            if termino.startswith('-'):
+                texto += f"{separador}-{separador}{termino[1:]}"
+            else:
+                texto += f"{separador}+{separador}{termino}"
+        prefijo = f"{PALABRAS_TAMANO[bits]} " if bits is not None else ''
+        memoria = ('mem', bits, base, indice, escala, con_signo(desplazamiento, 32), etiqueta)
+        return memoria, f"{prefijo}[{texto}]"
+
+    def flujo(self, instrucciones):
+        # Devuelve (líneas del fuente, elementos para ubicar, cantidad de
+        # instrucciones). Las etiquetas hacia adelante se eligen entre las
+        # próximas para que los saltos crucen el límite de rel8
+        a = self.aleatorio
+        lineas, elementos = [], []
+        definidas = 0
+        maxima = -1
+
+        def etiqueta():
+            nonlocal maxima
+            if definidas and a.random() < 0.5:
+                numero = definidas - 1 - a.randrange(min(definidas, 32))
+            else:
+                numero = definidas + a.randrange(4)
+                maxima = max(maxima, numero)
+            return f"L{numero}"
+
+        emitidas = 0
+        while emitidas < instrucciones:
+            r = a.random()
+            if r < 0.06:
+                elementos.append(('etq', f"L{definidas}"))
+                lineas.append(f"L{definidas}:")
+                definidas += 1
+                continue
+            emitidas += 1
+            if r < 0.16:
+                mnemonico, destino = a.choice(self.saltos), etiqueta()
+                elementos.append(('salto', mnemonico, destino))
+                lineas.append(f"    {mnemonico} {destino}")
+                continue
+            mnemonico = a.choice(self.datos)
+            bits = a.choice((32, 32, 16, 8))
+            forma = a.randrange(self.formas_operandos)
+            if forma == 0:
+                operandos = (self.registro(bits), self.registro(bits))
+                textos = [self.texto_registro(o) for o in operandos]
+            elif forma == 1:
+                inmediato, texto = self.inmediato(bits)
+                operandos = (self.registro(bits), inmediato)
+                textos = [self.texto_registro(operandos[0]), texto]
+            elif forma == 4:  # Memoria e inmediato: sin tamaño explícito es de 32 bits
+                explicito = bits if bits != 32 or a.random() < 0.5 else None
+                memoria, texto = self.memoria(explicito, etiqueta)
+                inmediato, texto_inmediato = self.inmediato(bits)
+                operandos = (memoria, inmediato)
+                textos = [texto, texto_inmediato]
+            else:
+                registro = self.registro(bits)
+                memoria, texto = self.memoria(bits if a.random() < 0.3 else None, etiqueta)
+                operandos = (registro, memoria) if forma == 2 else (memoria, registro)
+                textos = [self.texto_registro(registro), texto]
+                if forma == 3:
+                    textos.reverse()
+            codigo, absoluto = codificar(self.formas, mnemonico, operandos)
+            elementos.append(('ins', codigo, absoluto))
+            if a.random() < 0.1:
+                mnemonico = mnemonico.lower()
+            lineas.append(f"    {mnemonico} {', '.join(textos)}")
+        for numero in range(definidas, maxima + 1):
+            elementos.append(('etq', f"L{numero}"))
+            lineas.append(f"L{numero}:")
+        return lineas, elementos, emitidas
+
+
+TABLAS = {}  # {ruta: (formas, ejemplos)}, una por proceso
+INSTANCIAS = {}  # {motor: ensamblador}, una por proceso
+
+
+def tabla(ruta):
+    if ruta not in TABLAS:
+        TABLAS[ruta] = cargar_tabla(ruta)
+    return TABLAS[ruta]
+
+
+def instancia(motor):
+    if motor not in INSTANCIAS:
+        INSTANCIAS[motor] = MOTORES[motor]()
+    return INSTANCIAS[motor]
+
+
+def primer_fallo(lineas, limites, esperado, obtenido):
+    # Línea del fuente de la primera instrucción distinta y sus bytes
+    k = 0
+    for linea in lineas:
+        if linea.endswith(':'):
+            continue
+        inicio, fin = limites[k]
+        if obtenido[inicio:fin] != esperado[inicio:fin]:
+            return linea.strip(), f"esperado {esperado[inicio:fin].hex(' ')}, obtenido {obtenido[inicio:fin].hex(' ')}"
+        k += 1
+    return '(fin del código)', f"esperado {len(esperado)} bytes, obtenido {len(obtenido)}"
+
+
+def verificar_tarea(motor, ruta_tabla, semilla, tarea, lotes, instrucciones):
+    # Una tarea del pool: `lotes` ensamblados de `instrucciones` cada uno.
+    # Sólo se mide el tiempo de ensamblar_texto; generar y calcular la
+    # referencia queda fuera
+    formas, _ = tabla(ruta_tabla)
+    ensamblador_motor = instancia(motor)
+    # Cada motor con sus propios flujos: con los mismos, el segundo encontraría
+    # los operandos ya clasificados en CACHE_OPERANDOS y mediría de más
+    aleatorio = random.Random(f"{semilla}:{motor}:{tarea}")
+    generador = Generador(aleatorio, formas, sorted(ensamblador.OPERANDOS_REQUERIDOS))
+    casos = total_bytes = 0
+    segundos = 0.0
+    fallos = []
+    for lote in range(lotes):
+        lineas, elementos, emitidas = generador.flujo(instrucciones)
+        esperado, limites = ubicar(formas, elementos, motor)
+        fuente = "\n".join(lineas)
+        inicio = time.perf_counter()
+        try:
+            resultado = ensamblador_motor.ensamblar_texto(fuente)
+        except Exception as e:  # Un codificador roto también es un fallo, con su línea
+            linea = ensamblador_motor.numero_linea
+            fallos.append((tarea, lote, lineas[linea - 1].strip() if linea else '',
+                           f"excepción {type(e).__name__}: {e}"))
+            continue
+        segundos += time.perf_counter() - inicio
+        casos += emitidas
+        total_bytes += len(resultado.codigo)
+        if resultado.errores or resultado.codigo != esperado:
+            if resultado.errores:
+                linea, mensaje = resultado.errores[0]
+                fallos.append((tarea, lote, lineas[linea - 1].strip() if linea else '', f"error: {mensaje}"))
+            else:
+                fallos.append((tarea, lote) + primer_fallo(lineas, limites, esperado, resultado.codigo))
+    return casos, total_bytes, segundos, fallos
+
+
+def verificar_ejemplos(ejemplos, formas):
+    # Los ejemplos de la tabla (verificados con un ensamblador externo) se
+    # comparan con cada motor y con la propia referencia
+    fallos = []
+    for motor in MOTORES:
+        for fuente, codigo in ejemplos:
+            resultado = instancia(motor).ensamblar_texto(fuente)
+            if resultado.errores or resultado.codigo.hex(' ') != codigo.lower():
+                fallos.append(f"{motor}: {fuente}: esperado {codigo.lower()}, obtenido "
+                              f"{resultado.codigo.hex(' ') or resultado.errores}")
+    for fuente, codigo in ejemplos:
+        mnemonico, _, campo = fuente.strip().partition(' ')
+        operandos = tuple(operando_referencia(ensamblador.clasificar_operando(texto.strip()))
+                          for texto in campo.split(','))
+        esperado = codificar(formas, mnemonico.upper(), operandos)[0]
+        if esperado.hex(' ') != codigo.lower():
+            fallos.append(f"referencia: {fuente}: esperado {codigo.lower()}, obtenido {esperado.hex(' ')}")
+    return fallos
+
+
+def operando_referencia(operando):
+    # Operando ya interpretado por el ensamblador -> operando de la
+    # referencia. Sólo se usa para los ejemplos (la lectura del texto es
+    # común; la codificación no)
+    tipo, valor = operando
+    if tipo in (ensamblador.REG, ensamblador.REG16, ensamblador.REG8):
+        return ('reg', ensamblador.BITS_OPERANDO[tipo], valor)
+    if tipo in (ensamblador.MEM, ensamblador.MEM32, ensamblador.MEM16, ensamblador.MEM8):
+        return ('mem', ensamblador.BITS_OPERANDO.get(tipo), valor.base, valor.indice, valor.escala,
+                valor.desplazamiento, valor.etiqueta)
+    if tipo == ensamblador.IMM:
+        return ('imm', valor)
+    raise ValueError(f"operando no soportado en los ejemplos: {operando}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba diferencial y de rendimiento de los codificadores")
+    parser.add_argument('-n', '--casos', type=int, default=1_000_000, help="instrucciones a verificar por motor")
+    parser.add_argument('-j', '--procesos', type=int, default=os.cpu_count())
+    parser.add_argument('--motores', nargs='+', default=['ensamblador'], choices=sorted(MOTORES))
+    parser.add_argument('--lote', type=int, default=1000, help="instrucciones por ensamblado")
+    parser.add_argument('--semilla', default='0')
+    parser.add_argument('--tabla', default=TABLA, help="tabla de codificaciones de referencia")
+    parser.add_argument('--tarea', type=int, help="repetir sólo esta tarea (para reproducir un fallo)")
+    parser.add_argument('--mostrar', type=int, default=10, help="fallos a mostrar")
+    args = parser.parse_args(argv)
+
+    formas, ejemplos = tabla(args.tabla)
+    sin_tabla = sorted(set(ensamblador.OPERANDOS_REQUERIDOS) - set(formas))
+    if sin_tabla:
+        print(f"Sin codificación de referencia: {', '.join(sin_tabla)}", file=sys.stderr)
+        return 1
+    fallos_ejemplos = verificar_ejemplos(ejemplos, formas)
+    for fallo in fallos_ejemplos:
+        print(f"Ejemplo: {fallo}", file=sys.stderr)
+    print(f"{len(ejemplos)} ejemplos, {len(fallos_ejemplos)} fallos")
+
+    por_tarea = LOTES_POR_TAREA * args.lote
+    tareas = [args.tarea] if args.tarea is not None else range(-(-args.casos // por_tarea))
+    total_fallos = len(fallos_ejemplos)
+    for motor in args.motores:
+        inicio = time.perf_counter()
+        parametros = (motor, args.tabla, args.semilla)
+        if args.procesos > 1 and len(tareas) > 1:
+            with ProcessPoolExecutor(max_workers=args.procesos) as ejecutor:
+                resultados = list(ejecutor.map(verificar_tarea, *zip(*(
+                    parametros + (tarea, LOTES_POR_TAREA, args.lote) for tarea in tareas))))
+        else:
+            resultados = [verificar_tarea(*parametros, tarea, LOTES_POR_TAREA, args.lote) for tarea in tareas]
+        pared = time.perf_counter() - inicio
+
+        casos = sum(r[0] for r in resultados)
+        total_bytes = sum(r[1] for r in resultados)
+        segundos = sum(r[2] for r in resultados) or float('inf')  # Todo falló antes de medir
+        fallos = [fallo for r in resultados for fallo in r[3]]
+        total_fallos += len(fallos)
+        for tarea, lote, fuente, detalle in fallos[:args.mostrar]:
+            print(f"{motor}: tarea {tarea}, lote {lote}: {fuente}: {detalle}", file=sys.stderr)
+        print(f"{motor}: {casos:,} casos, {len(fallos)} lotes con fallos, {total_bytes:,} bytes")
+        print(f"{motor}: codificación {casos / segundos:,.0f} instr/s y {total_bytes / segundos:,.0f} bytes/s "
+              f"por proceso; {casos / pared:,.0f} casos/s verificados con {args.procesos} procesos "
+              f"({pared:.1f} s)")
+    return 1 if total_fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+import sys
+from array import array
+from itertools import repeat
+
+import ensamblador
+from ensamblador import GRUPO_ALU, REGISTROS_32, SALTOS
+
+REGISTROS = ('EAX', 'ECX', 'EDX', 'EBX', 'ESP', 'EBP', 'ESI', 'EDI')
+MASCARA = 0xFFFFFFFF
+
+# Tipos de instrucción decodificada. Las del grupo ALU llevan el /digit
+# sumado: ALU_RR + 5 es SUB r, r; ALU_RI + 7 es CMP r, imm
+MOV_RR = 0
+MOV_RI = 1
+ALU_RR = 8
+ALU_RI = 16
+JMP = 24
+JE = 25
+JNE = 26
+
+NOMBRES = {MOV_RR: 'MOV', MOV_RI: 'MOV', JMP: 'JMP', JE: 'JE', JNE: 'JNE'}
+for _mnemonico, _digit in GRUPO_ALU.items():
+    NOMBRES[ALU_RR + _digit] = NOMBRES[ALU_RI + _digit] = _mnemonico
+del _mnemonico, _digit
+
+# Estimación de ciclos: un ciclo por instrucción simple (MOV, ALU, saltos,
+# como en un núcleo en orden con todo en registros) y uno más por cada salto
+# tomado, por redirigir la búsqueda de instrucciones
+CICLOS = dict.fromkeys(NOMBRES, 1)
+CICLOS_SALTO_TOMADO = 1
+
+SALTO_INVALIDO = -1  # Destino fuera del código o en medio de una instrucción
+
+
+# Operaciones del grupo ALU por /digit: (a, b, acarreo) -> (resultado, acarreo)
+def _add(a, b, c):
+    t = a + b
+    return t & MASCARA, t > MASCARA
+
+
+def _or(a, b, c):
+    return a | b, False
+
+
+def _adc(a, b, c):
+    t = a + b + c
+    return t & MASCARA, t > MASCARA
+
+
+def _sbb(a, b, c):
+    t = a - b - c
+    return t & MASCARA, t < 0
+
+
+def _and(a, b, c):
+    return a & b, False
+
+
+def _sub(a, b, c):
+    return (a - b) & MASCARA, a < b
+
+
+def _xor(a, b, c):
+    return a ^ b, False
+
+
+OPERACIONES_ALU = (_add, _or, _adc, _sbb, _and, _sub, _xor, _sub)  # CMP = SUB sin guardar
+DIGIT_CMP = GRUPO_ALU['CMP']
+
+# Opcodes de la forma r/m32, r32 del grupo ALU y de la forma del acumulador
+ALU_RM_R = {(digit << 3) | 0x01: digit for digit in GRUPO_ALU.values()}
+ALU_ACUMULADOR = {(digit << 3) | 0x05: digit for digit in GRUPO_ALU.values()}
+TIPOS_SALTO = {'JMP': JMP, 'JE': JE, 'JNE': JNE}
+SALTOS_CORTOS = {corto: TIPOS_SALTO[mnemonico] for mnemonico, (corto, _) in SALTOS.items()}
+SALTOS_CERCANOS = {cercano: SALTOS_CORTOS[corto] for corto, cercano in SALTOS.values()}
+
+
+def con_signo(valor, bits):
+    return valor - (1 << bits) if valor >> (bits - 1) else valor
+
+
+def decodificar(codigo):
+    # Decodifica una vez todo el código a arreglos compactos paralelos:
+    # tipo, operandos a/b, dirección y longitud de cada instrucción. En los
+    # saltos, b es el índice de la instrucción destino (len = fin del programa)
+    codigo = bytes(codigo)
+    tipos, a, b = array('B'), array('B'), array('q')
+    direcciones, longitudes = array('I'), array('B')
+    pos = 0
+    while pos < len(codigo):
+        op = codigo[pos]
+        inicio = pos
+        if op == 0x89 or op in ALU_RM_R:
+            modrm = leer(codigo, pos + 1, 1, inicio)
+            if modrm >> 6 != 0b11:
+                raise ValueError(f"operando en memoria no soportado en {inicio:04X}")
+            tipo = MOV_RR if op == 0x89 else ALU_RR + ALU_RM_R[op]
+            operandos = (modrm & 7, (modrm >> 3) & 7)
+            pos += 2
+        elif op in (0x81, 0x83):
+            modrm = leer(codigo, pos + 1, 1, inicio)
+            if modrm >> 6 != 0b11:
+                raise ValueError(f"operando en memoria no soportado en {inicio:04X}")
+            if op == 0x81:
+                inmediato = leer(codigo, pos + 2, 4, inicio)
+                pos += 6
+            else:
+                inmediato = con_signo(leer(codigo, pos + 2, 1, inicio), 8) & MASCARA
+                pos += 3
+            tipo = ALU_RI + ((modrm >> 3) & 7)
+            operandos = (modrm & 7, inmediato)
+        elif op in ALU_ACUMULADOR:
+            tipo = ALU_RI + ALU_ACUMULADOR[op]
+            operandos = (REGISTROS_32['EAX'], leer(codigo, pos + 1, 4, inicio))
+            pos += 5
+        elif 0xB8 <= op <= 0xBF:
+            tipo = MOV_RI
+            operandos = (op - 0xB8, leer(codigo, pos + 1, 4, inicio))
+            pos += 5
+        elif op in SALTOS_CORTOS:
+            tipo = SALTOS_CORTOS[op]
+            pos += 2
+            operandos = (0, pos + con_signo(leer(codigo, inicio + 1, 1, inicio), 8))
+        elif codigo[pos:pos + 1] in SALTOS_CERCANOS:
+            tipo = SALTOS_CERCANOS[codigo[pos:pos + 1]]
+            pos += 5
+            operandos = (0, pos + con_signo(leer(codigo, inicio + 1, 4, inicio), 32))
+        elif codigo[pos:pos + 2] in SALTOS_CERCANOS:
+            tipo = SALTOS_CERCANOS[codigo[pos:pos + 2]]
+            pos += 6
+            operandos = (0, pos + con_signo(leer(codigo, inicio + 2, 4, inicio), 32))
+        else:
+            raise ValueError(f"opcode {op:02X} no soportado en {inicio:04X}")
+        tipos.append(tipo)
+        a.append(operandos[0])
+        b.append(operandos[1])
+        direcciones.append(inicio)
+        longitudes.append(pos - inicio)
+
+    # Direcciones de destino -> índices de instrucción
+    indices = {direccion: i for i, direccion in enumerate(direcciones)}
+    indices[len(codigo)] = len(tipos)
+    for i, tipo in enumerate(tipos):
+        if tipo >= JMP:
+            b[i] = indices.get(b[i], SALTO_INVALIDO)
+    return tipos, a, b, direcciones, longitudes
+
+
+def leer(codigo, pos, ancho, inicio):
+    if pos + ancho > len(codigo):
+        raise ValueError(f"instrucción truncada en {inicio:04X}")
+    return int.from_bytes(codigo[pos:pos + ancho], 'little')
+
+
+# Tabla de despacho: tipo -> constructor del manejador de una instrucción.
+# Cada manejador es una clausura sin argumentos que ejecuta la instrucción
+# y devuelve el índice de la siguiente; ejecutar() sólo encadena llamadas.
+def manejador_mov_rr(emulador, i, d, s):
+    r, sig = emulador.registros, i + 1
+
+    def mov():
+        r[d] = r[s]
+        return sig
+    return mov
+
+
+def manejador_mov_ri(emulador, i, d, valor):
+    r, sig = emulador.registros, i + 1
+
+    def mov():
+        r[d] = valor
+        return sig
+    return mov
+
+
+def manejador_alu_rr(emulador, i, d, s, digit):
+    r, estado, calcular, sig = emulador.registros, emulador.estado, OPERACIONES_ALU[digit], i + 1
+    if digit == DIGIT_CMP:
+        def alu():
+            x, y = r[d], r[s]
+            estado[0] = (*calcular(x, y, 0), digit, x, y)
+            return sig
+    else:
+        def alu():
+            x, y = r[d], r[s]
+            resultado, acarreo = calcular(x, y, estado[0][1])
+            r[d] = resultado
+            estado[0] = (resultado, acarreo, digit, x, y)
+            return sig
+    return alu
+
+
+def manejador_alu_ri(emulador, i, d, y, digit):
+    r, estado, calcular, sig = emulador.registros, emulador.estado, OPERACIONES_ALU[digit], i + 1
+    if digit == DIGIT_CMP:
+        def alu():
+            x = r[d]
+            estado[0] = (*calcular(x, y, 0), digit, x, y)
+            return sig
+    else:
+        def alu():
+            x = r[d]
+            resultado, acarreo = calcular(x, y, estado[0][1])
+            r[d] = resultado
+            estado[0] = (resultado, acarreo, digit, x, y)
+            return sig
+    return alu
+
+
+def manejador_salto(emulador, i, tipo, destino):
+    estado, tomados, sig = emulador.estado, emulador.tomados, i + 1
+    if tipo == JMP:
+        def salto():
+            tomados[i] += 1
+            return destino
+    elif tipo == JE:
+        def salto():
+            if estado[0][0] == 0:
+                tomados[i] += 1
+                return destino
+            return sig
+    else:
+        def salto():
+            if estado[0][0] != 0:
+                tomados[i] += 1
+                return destino
+            return sig
+    if destino != SALTO_INVALIDO:
+        return salto
+
+    # Destino fuera del código decodificado: sólo es un error si se toma
+    direccion = emulador.direcciones[i]
+
+    def salto_invalido():
+        if salto() == SALTO_INVALIDO:
+            raise ValueError(f"salto en {direccion:04X} a una dirección que no es una instrucción")
+        return sig
+    return salto_invalido
+
+
+def construir(emulador, i, tipo, a, b):
+    if tipo == MOV_RR:
+        return manejador_mov_rr(emulador, i, a, b)
+    if tipo == MOV_RI:
+        return manejador_mov_ri(emulador, i, a, b)
+    if ALU_RR <= tipo < ALU_RI:
+        return manejador_alu_rr(emulador, i, a, b, tipo - ALU_RR)
+    if ALU_RI <= tipo < JMP:
+        return manejador_alu_ri(emulador, i, a, b, tipo - ALU_RI)
+    return manejador_salto(emulador, i, tipo, b)
+
+
+class Emulador:
+    # Ejecuta las codificaciones del ensamblador sobre registros de 32 bits
+    # (MOV, grupo ALU, JMP/JE/JNE); los operandos de 8 y 16 bits y los de
+    # memoria se rechazan al decodificar con ValueError. El código se
+    # decodifica una sola vez (decodificar) y cada instrucción se convierte
+    # en un manejador ya ligado a sus operandos, así el ciclo de ejecución
+    # no vuelve a mirar bytes. Las banderas se guardan como
+    # (resultado, CF, digit, a, b) de la última operación ALU: ZF y CF se
+    # leen directo y SF/OF se calculan sólo si se piden.
+    def __init__(self, codigo):
+        self.tipos, self.a, self.b, self.direcciones, self.longitudes = decodificar(codigo)
+        self.registros = [0] * len(REGISTROS)
+        self.estado = [(1, False, None, 0, 0)]  # ZF = 0 al empezar
+        self.conteo = [0] * len(self.tipos)  # Ejecuciones de cada instrucción
+        self.tomados = [0] * len(self.tipos)  # Veces que se tomó cada salto
+        self.pc = 0  # Índice de la siguiente instrucción
+        self.programa = [construir(self, i, tipo, a, b)
+                         for i, (tipo, a, b) in enumerate(zip(self.tipos, self.a, self.b))]
+
+    @property
+    def eip(self):
+        return self.direcciones[self.pc] if self.pc < len(self.direcciones) else sum(self.longitudes)
+
+    @property
+    def terminado(self):
+        return self.pc >= len(self.programa)
+
+    def ejecutar(self, limite=None):
+        # Ejecuta hasta salir del código o hasta `limite` instrucciones.
+        # Devuelve cuántas se ejecutaron en esta llamada.
+        programa, conteo, pc = self.programa, self.conteo, self.pc
+        antes = sum(conteo)
+        try:
+            for _ in (repeat(None) if limite is None else range(limite)):
+                conteo[pc] += 1
+                pc = programa[pc]()
+        except IndexError:
+            if pc != len(programa):  # Sólo se sale del ciclo al pasar del final
+                raise
+        self.pc = pc
+        return sum(conteo) - antes
+
+    def registro(self, nombre):
+        return self.registros[REGISTROS.index(nombre.upper())]
+
+    def asignar(self, nombre, valor):
+        self.registros[REGISTROS.index(nombre.upper())] = valor & MASCARA
+
+    def banderas(self):
+        resultado, acarreo, digit, a, b = self.estado[0]
+        desborde = False
+        if digit in (GRUPO_ALU['ADD'], GRUPO_ALU['ADC']):
+            desborde = bool(((a ^ resultado) & (b ^ resultado)) >> 31)
+        elif digit in (GRUPO_ALU['SUB'], GRUPO_ALU['SBB'], GRUPO_ALU['CMP']):
+            desborde = bool(((a ^ b) & (a ^ resultado)) >> 31)
+        return {'ZF': resultado == 0, 'SF': bool(resultado >> 31), 'CF': bool(acarreo), 'OF': desborde}
+
+    def estadisticas(self):
+        # Instrucciones ejecutadas en total y por mnemónico, y ciclos estimados
+        por_mnemonico = {}
+        ciclos = 0
+        for tipo, veces, tomados in zip(self.tipos, self.conteo, self.tomados):
+            if veces:
+                nombre = NOMBRES[tipo]
+                por_mnemonico[nombre] = por_mnemonico.get(nombre, 0) + veces
+                ciclos += veces * CICLOS[tipo] + tomados * CICLOS_SALTO_TOMADO
+        return {
+            'instrucciones': sum(self.conteo),
+            'por_mnemonico': por_mnemonico,
+            'saltos_tomados': sum(self.tomados),
+            'ciclos': ciclos,
+        }
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ensambla y ejecuta un programa IA-32")
+    parser.add_argument('entrada', nargs='?', default='programa.asm')
+    parser.add_argument('-r', '--registro', action='append', default=[], metavar='REG=VALOR',
+                        help="valor inicial de un registro (por ejemplo -r ECX=10)")
+    parser.add_argument('-n', '--limite', type=int, help="máximo de instrucciones a ejecutar")
+    args = parser.parse_args(argv)
+
+    with open(args.entrada) as f:
+        resultado = ensamblador.EnsambladorIA32().ensamblar_texto(f.read(), origen=args.entrada)
+    for linea, mensaje in resultado.errores:
+        donde = f":{linea}" if linea is not None else ""
+        print(f"{args.entrada}{donde}: error: {mensaje}", file=sys.stderr)
+    if resultado.errores:
+        return 1
+
+    try:
+        emulador = Emulador(resultado.codigo)
+    except ValueError as e:  # Codificación fuera del subconjunto que se emula
+        print(f"{args.entrada}: error: {e}", file=sys.stderr)
+        return 1
+    for asignacion in args.registro:
+        nombre, _, valor = asignacion.partition('=')
+        emulador.asignar(nombre, int(valor, 0))
+    emulador.ejecutar(args.limite)
+
+    for nombre, valor in zip(REGISTROS, emulador.registros):
+        print(f"{nombre} = {valor:08X}")
+    print(" ".join(f"{bandera}={int(valor)}" for bandera, valor in emulador.banderas().items()))
+    estadisticas = emulador.estadisticas()
+    print(f"{estadisticas['instrucciones']} instrucciones, {estadisticas['ciclos']} ciclos estimados"
+          f"{'' if emulador.terminado else f' (detenido en {emulador.eip:04X})'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,306 +1,1215 @@
+import glob
+import json
+import mmap
+import os
 import re
+import struct
+import sys
+import tempfile
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
-REGISTROS_32 = {
-    'EAX': 0b000,
-    'ECX': 0b001,
-    'EDX': 0b010,
-    'EBX': 0b011,
+import cache
+import perfil
+import salida
+from preprocesador import Preprocesador
+import simbolos
+from simbolos import TablaSimbolos
+
+# Tipos de operando. Los registros y la memoria llevan el tamaño en el tipo,
+# así el despacho por (mnemonico, tipos) elige la codificación sin preguntar
+REG = 'reg'  # Registro de 32 bits
+REG16 = 'reg16'
+REG8 = 'reg8'
+IMM = 'imm'
+ETQ = 'etq'
+MEM = 'mem'  # [...] sin tamaño: lo da el registro, o 32 bits con un inmediato
+MEM32 = 'mem32'  # DWORD [...]
+MEM16 = 'mem16'  # WORD [...]
+MEM8 = 'mem8'  # BYTE [...]
+MEM_INVALIDA = 'mem_invalida'  # [...] que no se pudo interpretar; el valor es el texto
+
+# Registros de propósito general de cada tamaño, en el orden de su número
+NOMBRES_REGISTROS = {
+    REG: ('EAX', 'ECX', 'EDX', 'EBX', 'ESP', 'EBP', 'ESI', 'EDI'),
+    REG16: ('AX', 'CX', 'DX', 'BX', 'SP', 'BP', 'SI', 'DI'),
+    REG8: ('AL', 'CL', 'DL', 'BL', 'AH', 'CH', 'DH', 'BH'),
+}
+# Nombre -> operando ya clasificado (tipo, número)
+REGISTROS = {nombre: (tipo, numero) for tipo, nombres in NOMBRES_REGISTROS.items()
+             for numero, nombre in enumerate(nombres)}
+REGISTROS_32 = {nombre: numero for numero, nombre in enumerate(NOMBRES_REGISTROS[REG])}
+
+# Prefijo de tamaño en operandos de memoria
+TAMANOS_MEMORIA = {'': MEM, 'DWORD': MEM32, 'WORD': MEM16, 'BYTE': MEM8}
+
+# Tipos de fixup: desplazamiento relativo al final del campo que se parcha,
+# o dirección absoluta del símbolo sumada a lo que ya tiene el campo
+REL8 = 'rel8'
+REL32 = 'rel32'
+ABS32 = 'abs32'
+
+# Resultado de ensamblar_texto: código, tabla de símbolos, fixups que siguen
+# sin resolver [(posicion, ancho, tipo, simbolo)] y errores [(linea, mensaje)]
+Resultado = namedtuple('Resultado', 'codigo simbolos fixups errores')
+
+# Grupo ALU: mnemónico -> extensión /digit del ModR/M para la forma 81 /digit.
+# El opcode de la forma r/m32, r32 es (digit << 3) | 0x01 (01 ADD, 29 SUB, ...);
+# con el bit w apagado es la de 8 bits (00 ADD, 28 SUB, ...)
+GRUPO_ALU = {
+    'ADD': 0b000,
+    'OR': 0b001,
+    'ADC': 0b010,
+    'SBB': 0b011,
+    'AND': 0b100,
+    'SUB': 0b101,
+    'XOR': 0b110,
+    'CMP': 0b111,
+}
+
+# Saltos: mnemónico -> (opcode de la forma corta rel8, prefijo de la forma rel32)
+SALTOS = {
+    'JMP': (0xEB, b'\xE9'),
+    'JE': (0x74, b'\x0F\x84'),
+    'JNE': (0x75, b'\x0F\x85'),
+}
+FORMA_CERCANA = {corto: cercano for corto, cercano in SALTOS.values()}
+
+OPCODES_REG_REG = {'MOV': 0x89}
+OPCODES_REG_REG.update({mnemonico: (digit << 3) | 0x01 for mnemonico, digit in GRUPO_ALU.items()})
+# Forma r32, r/m32 (destino registro, fuente en memoria): 8B MOV, 03 ADD, 2B SUB...
+OPCODES_REG_MEM = {mnemonico: opcode | 0x02 for mnemonico, opcode in OPCODES_REG_REG.items()}
+
+# Operando de memoria [base + indice*escala + desplazamiento] o [etiqueta + ...],
+# interpretado una sola vez (ver clasificar_operando). modrm trae mod y r/m
+# (el campo reg se agrega al codificar) y cola el SIB y el desplazamiento ya
+# codificados; si hay etiqueta, el desplazamiento es de 32 bits y empieza en
+# el byte `campo` contando desde el ModR/M.
+Memoria = namedtuple('Memoria', 'base indice escala desplazamiento etiqueta modrm cola campo')
+
+RM_SIB = 0b100  # r/m = 100: sigue un byte SIB; como base, ESP
+RM_DISP32 = 0b101  # r/m = 101 con mod 00: sólo disp32; como base, EBP
+ESCALAS = {1: 0b00, 2: 0b01, 4: 0b10, 8: 0b11}
+MODOS_DESPLAZAMIENTO = {0: 0b00, 1: 0b01, 4: 0b10}  # Ancho del desplazamiento -> mod
+
+
+def forma_memoria(base, indice, escala, ancho):
+    # (ModR/M sin el campo reg, byte SIB o b'') para una combinación de base,
+    # índice (None si no hay) y ancho de desplazamiento
+    if base is None:  # Sin base: siempre disp32 con mod 00
+        if indice is None:
+            return RM_DISP32, b''
+        return RM_SIB, bytes(((ESCALAS[escala] << 6) | (indice << 3) | RM_DISP32,))
+    modo = MODOS_DESPLAZAMIENTO[ancho] << 6
+    if indice is None and base != RM_SIB:
+        return modo | base, b''
+    indice = RM_SIB if indice is None else indice  # Índice 100: sin índice
+    return modo | RM_SIB, bytes(((ESCALAS[escala] << 6) | (indice << 3) | base,))
+
+
+# Todas las combinaciones válidas, calculadas al importar. ESP no puede ser
+# índice, y EBP como base no tiene forma sin desplazamiento (mod 00 + 101
+# significa disp32 sin base), así que usa disp8 = 0
+FORMAS_MEMORIA = {}
+for _base in (None, *range(8)):
+    for _indice in (None, *(r for r in range(8) if r != RM_SIB)):
+        for _escala in (ESCALAS if _indice is not None else (1,)):
+            for _ancho in ((4,) if _base is None else (1, 4) if _base == RM_DISP32 else (0, 1, 4)):
+                FORMAS_MEMORIA[(_base, _indice, _escala, _ancho)] = forma_memoria(_base, _indice, _escala, _ancho)
+del _base, _indice, _escala, _ancho
+
+# Un término de [...]: signo opcional y registro, registro*escala, número o etiqueta
+TERMINO_MEMORIA = re.compile(r'\s*([+-]?)\s*([^+\-\s*]+)(?:\s*\*\s*([^+\-\s*]+))?\s*')
+
+
+# Inmediatos en little endian, truncados igual que el CPU
+def imm8(valor):
+    return bytes((valor & 0xFF,))
+
+
+def imm16(valor):
+    return struct.pack('<H', valor & 0xFFFF)
+
+
+def imm32(valor):
+    return struct.pack('<I', valor & 0xFFFFFFFF)
+
+
+# Tamaño de operando: tipo de registro -> (prefijo, bit w del opcode, tipo de
+# memoria con ese tamaño, bits del inmediato, codificador del inmediato).
+# 16 bits es la forma de 32 con el prefijo 66; 8 bits apaga el bit w
+# (88 MOV, 00 ADD, 80 /digit, C6 /0) o el bit 3 en MOV r, imm (B0+r)
+TAMANOS = {
+    REG: (b'', 1, MEM32, 32, imm32),
+    REG16: (b'\x66', 1, MEM16, 16, imm16),
+    REG8: (b'', 0, MEM8, 8, imm8),
 }
 
+
+def plantillas_reg_reg(opcode, prefijo=b''):
+    # Las 64 combinaciones ya codificadas, indexadas por (destino << 3) | fuente
+    return tuple(prefijo + bytes((opcode, 0xC0 | (fuente << 3) | destino))
+                 for destino in range(8) for fuente in range(8))
+
+
+def formas_alu_imm(digit, tamano=REG):
+    # Prefijos ya codificados por registro destino para las formas con
+    # inmediato: 83 /digit ib, 81 /digit id y la forma corta del acumulador
+    # (05, 2D, 3D...), más cómo llevar el inmediato al tamaño del operando.
+    # En 8 bits todo inmediato cabe en la forma corta: 80 /digit ib, o la
+    # del acumulador (04, 2C, 3C...) para AL, que ocupa un byte menos
+    prefijo, w, _, bits, inmediato = TAMANOS[tamano]
+    acumulador = prefijo + bytes(((digit << 3) | 0x04 | w,))
+    largo = tuple(prefijo + bytes((0x81, 0xC0 | (digit << 3) | registro)) for registro in range(8))
+    if w:
+        corto = tuple(prefijo + bytes((0x83, 0xC0 | (digit << 3) | registro)) for registro in range(8))
+    else:
+        corto = (acumulador,) + tuple(bytes((0x80, 0xC0 | (digit << 3) | registro)) for registro in range(1, 8))
+    return corto, largo, acumulador, 1 << (bits - 1), (1 << bits) - 1, inmediato
+
+
+def formas_mem_imm(opcode_corto, opcode_largo, digit, tamano):
+    # (forma ib o None, forma de tamaño completo, /digit, mitad, máscara,
+    # codificador del inmediato) para r/m, imm con memoria
+    prefijo, w, _, bits, inmediato = TAMANOS[tamano]
+    if not w:  # 8 bits: el inmediato siempre cabe en la forma de un byte
+        opcode_corto, opcode_largo = opcode_largo & ~1, opcode_largo & ~1
+    corto = prefijo + bytes((opcode_corto,)) if opcode_corto is not None else None
+    return corto, prefijo + bytes((opcode_largo,)), digit, 1 << (bits - 1), (1 << bits) - 1, inmediato
+
+
+# Tabla de instrucciones: (mnemonico, tipos de operandos) -> (método, argumento).
+# Se genera al importar para cada tamaño de operando; los generadores sólo
+# concatenan lo que ya viene codificado aquí
+TABLA_INSTRUCCIONES = {}
+for _tamano, (_prefijo, _w, _memoria, _bits, _inmediato) in TAMANOS.items():
+    for _mnemonico, _opcode in OPCODES_REG_REG.items():
+        _opcode = _opcode & ~1 | _w
+        TABLA_INSTRUCCIONES[(_mnemonico, (_tamano, _tamano))] = (
+            'generar_reg_reg', plantillas_reg_reg(_opcode, _prefijo))
+        for _tipo_memoria in (MEM, _memoria):
+            TABLA_INSTRUCCIONES[(_mnemonico, (_tipo_memoria, _tamano))] = (
+                'generar_mem_reg', _prefijo + bytes((_opcode,)))
+            TABLA_INSTRUCCIONES[(_mnemonico, (_tamano, _tipo_memoria))] = (
+                'generar_reg_mem', _prefijo + bytes((_opcode | 0x02,)))
+    TABLA_INSTRUCCIONES[('MOV', (_tamano, IMM))] = (
+        'generar_mov_imm', (tuple(_prefijo + bytes((0xB0 | (_w << 3) | registro,)) for registro in range(8)),
+                            1 << (_bits - 1), (1 << _bits) - 1, _inmediato))
+    for _mnemonico, _digit in GRUPO_ALU.items():
+        TABLA_INSTRUCCIONES[(_mnemonico, (_tamano, IMM))] = ('generar_alu_imm', formas_alu_imm(_digit, _tamano))
+    # Memoria, inmediato; sin tamaño explícito es de 32 bits
+    for _tipo_memoria in ((MEM, _memoria) if _tamano == REG else (_memoria,)):
+        TABLA_INSTRUCCIONES[('MOV', (_tipo_memoria, IMM))] = (
+            'generar_mem_imm', formas_mem_imm(None, 0xC7, 0, _tamano))
+        for _mnemonico, _digit in GRUPO_ALU.items():
+            TABLA_INSTRUCCIONES[(_mnemonico, (_tipo_memoria, IMM))] = (
+                'generar_mem_imm', formas_mem_imm(0x83, 0x81, _digit, _tamano))
+for _mnemonico, _formas in SALTOS.items():
+    TABLA_INSTRUCCIONES[(_mnemonico, (ETQ,))] = ('generar_salto', _formas)
+del _tamano, _prefijo, _w, _memoria, _bits, _inmediato, _mnemonico, _opcode, _digit, _tipo_memoria, _formas
+
+# Bits de cada tipo de operando con tamaño, para explicar los errores
+BITS_OPERANDO = {REG: 32, REG16: 16, REG8: 8, MEM32: 32, MEM16: 16, MEM8: 8}
+
+# Número de operandos de cada mnemónico conocido
+OPERANDOS_REQUERIDOS = {mnemonico: len(tipos) for mnemonico, tipos in TABLA_INSTRUCCIONES}
+
+
+# Toda la línea en una sola coincidencia: [etiqueta:] [mnemónico [operandos]] [; comentario].
+# El campo de operandos es codicioso (termina en el último carácter que no
+# es espacio), así que el final de la línea no se reintenta carácter por
+# carácter. Las clases de cada parte no se solapan con lo que las sigue, de
+# modo que el retroceso nunca encuentra otra partición de la línea.
+LINEA = re.compile(r'\s*(?:([^\s:;,]+)\s*:)?\s*(?:([A-Za-z]\w*)(?:[ \t]+([^;\s](?:[^;]*[^;\s])?)?)?)?'
+                   r'\s*(?:;.*)?$')
+# La misma expresión sobre bytes, para tokenizar directamente el archivo mapeado
+LINEA_BYTES = re.compile(LINEA.pattern.encode())
+# Alguna línea que empieza con '%' (directiva del preprocesador). Sin ninguna
+# el preprocesador no cambia nada: un '%' en un comentario u operando no cuenta
+LINEA_DIRECTIVA = re.compile(r'^[^\S\n]*%', re.MULTILINE)
+LINEA_DIRECTIVA_BYTES = re.compile(LINEA_DIRECTIVA.pattern.encode(), re.MULTILINE)
+
+# Mnemónico tal como aparece en el archivo mapeado -> str en mayúsculas. Los
+# válidos son pocos; el límite es para fuentes con basura
+CACHE_MNEMONICOS = {}
+LIMITE_CACHE_MNEMONICOS = 1 << 10
+
+# Campo de operandos -> (operandos clasificados, tipos). Se vacía al llenarse
+# para que millones de inmediatos o etiquetas distintos no crezcan sin límite
+CACHE_OPERANDOS = {}
+LIMITE_CACHE_OPERANDOS = 1 << 16
+
+
+def clasificar_operando(operando):
+    # Devuelve (tipo, valor): código de registro, entero o nombre de etiqueta.
+    # Los registros no distinguen mayúsculas; las etiquetas conservan su nombre
+    registro = REGISTROS.get(operando.upper())
+    if registro is not None:
+        return registro
+    if operando.endswith(']') and '[' in operando:
+        corchete = operando.index('[')
+        tipo = TAMANOS_MEMORIA.get(operando[:corchete].rstrip().upper())
+        memoria = interpretar_memoria(operando[corchete + 1:-1]) if tipo is not None else None
+        return (tipo, memoria) if memoria is not None else (MEM_INVALIDA, operando)
+    try:
+        return (IMM, int(operando, 0))
+    except ValueError:
+        return (ETQ, sys.intern(operando))
+
+
+def interpretar_memoria(texto):
+    # [base + indice*escala + desplazamiento], en cualquier orden, con una
+    # etiqueta opcional en lugar de (o además de) el desplazamiento numérico.
+    # Devuelve Memoria, o None si la expresión no es válida
+    base = indice = etiqueta = None
+    escala = 1
+    desplazamiento = 0
+    posicion = 0
+    while posicion < len(texto):
+        termino = TERMINO_MEMORIA.match(texto, posicion)
+        if termino is None or termino.end() == posicion:
+            return None
+        posicion = termino.end()
+        signo, valor, factor = termino.groups()
+        if factor is not None:  # registro*escala o escala*registro
+            registro = REGISTROS_32.get(valor.upper())
+            if registro is None:
+                registro, valor = REGISTROS_32.get(factor.upper()), valor
+            else:
+                valor = factor
+            try:
+                factor = int(valor, 0)
+            except ValueError:
+                return None
+            if registro is None or signo == '-' or indice is not None or factor not in ESCALAS:
+                return None
+            indice, escala = registro, factor
+            continue
+        registro = REGISTROS_32.get(valor.upper())
+        if registro is not None:
+            if signo == '-':
+                return None
+            if base is None:
+                base = registro
+            elif indice is None:
+                indice = registro
+            else:
+                return None
+            continue
+        try:
+            numero = int(valor, 0)
+        except ValueError:
+            if signo == '-' or etiqueta is not None or valor.upper() in REGISTROS:
+                return None  # Incluye [AX] o [BL]: sólo hay direcciones de 32 bits
+            etiqueta = sys.intern(valor)
+            continue
+        desplazamiento += -numero if signo == '-' else numero
+    if posicion == 0:  # []
+        return None
+    if indice == RM_SIB:  # ESP no puede ser índice: si está con escala 1, se usa como base
+        if escala != 1 or base == RM_SIB:
+            return None
+        base, indice = indice, base
+    desplazamiento = ((desplazamiento + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+    if etiqueta is not None or base is None:
+        ancho = 4
+    elif desplazamiento == 0 and base != RM_DISP32:
+        ancho = 0
+    elif -128 <= desplazamiento <= 127:
+        ancho = 1
+    else:
+        ancho = 4
+    modrm, sib = FORMAS_MEMORIA[(base, indice, escala, ancho)]
+    cola = sib + (desplazamiento.to_bytes(ancho, 'little', signed=True) if ancho else b'')
+    return Memoria(base, indice, escala, desplazamiento, etiqueta, modrm, cola, 1 + len(sib))
+
+
+def clasificar_operandos(texto):
+    # `texto` puede ser str o bytes (entrada mapeada); los bytes sólo se
+    # decodifican cuando no están en la cache
+    resultado = CACHE_OPERANDOS.get(texto)
+    if resultado is None:
+        campo = texto.decode() if isinstance(texto, bytes) else texto
+        operandos = tuple(clasificar_operando(op.strip()) for op in campo.split(','))
+        resultado = (operandos, tuple(tipo for tipo, _ in operandos))
+        if len(CACHE_OPERANDOS) >= LIMITE_CACHE_OPERANDOS:
+            CACHE_OPERANDOS.clear()
+        CACHE_OPERANDOS[texto] = resultado
+    return resultado
+
+
+class BufferCodigo:
+    # Buffer de salida que vive en memoria hasta `limite` bytes y después se
+    # vuelca a un archivo temporal, así el tamaño del programa no limita la RAM.
+    # Implementa lo que el ensamblador usa de un bytearray: extend, len,
+    # lectura/escritura por índice o rebanada (para el backpatching) y bytes();
+    # bloques() lo recorre por partes para copiarlo o escribir la salida.
+    def __init__(self, limite=64 * 1024 * 1024):
+        self.archivo = tempfile.SpooledTemporaryFile(max_size=limite)
+        self.tamano = 0
+
+    def __len__(self):
+        return self.tamano
+
+    def extend(self, datos):
+        self.archivo.write(datos)
+        self.tamano += len(datos)
+
+    def append(self, byte):
+        self.extend(bytes((byte,)))
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            inicio, fin, _ = indice.indices(self.tamano)
+            self.archivo.seek(inicio)
+            datos = self.archivo.read(max(0, fin - inicio))
+        else:
+            if indice < 0:
+                indice += self.tamano
+            self.archivo.seek(indice)
+            datos = self.archivo.read(1)
+            if not datos:
+                raise IndexError(indice)
+            datos = datos[0]
+        self.archivo.seek(0, 2)
+        return datos
+
+    def __setitem__(self, indice, datos):
+        if isinstance(indice, slice):
+            inicio = indice.indices(self.tamano)[0]
+        else:
+            inicio, datos = indice, bytes((datos,))
+        self.archivo.seek(inicio)
+        self.archivo.write(datos)
+        self.archivo.seek(0, 2)
+
+    def __iter__(self):
+        self.archivo.seek(0)
+        while True:
+            bloque = self.archivo.read(1 << 16)
+            if not bloque:
+                break
+            yield from bloque
+        self.archivo.seek(0, 2)
+
+    def bloques(self, inicio=0, fin=None, tamano=1 << 20):
+        # Recorre [inicio, fin) de a `tamano` bytes sin leerlo entero; entre
+        # bloque y bloque el archivo queda al final, listo para extend
+        fin = self.tamano if fin is None else fin
+        for desde in range(inicio, fin, tamano):
+            self.archivo.seek(desde)
+            bloque = self.archivo.read(min(tamano, fin - desde))
+            self.archivo.seek(0, 2)
+            yield bloque
+
+    def __bytes__(self):
+        return self[:]
+
+    def cerrar(self):
+        self.archivo.close()
+
+
+BYTES_POR_FILA = 8  # Bytes de código por fila del listado; el resto sigue en otra fila
+
+# Niveles de diagnóstico
+SILENCIO = 0
+ERROR = 1
+INFO = 2
+
+
+class Diagnosticos:
+    # Destino de los mensajes del ensamblador. Por defecto es silencioso: los
+    # errores sólo se acumulan en `errores` y los eventos por instrucción no se
+    # formatean salvo que se pida nivel INFO o un archivo JSONL (`detallado`).
+    def __init__(self, nivel=SILENCIO, salida=None, jsonl=None, tam_bloque=1024):
+        self.nivel = nivel
+        self.salida = salida if salida is not None else sys.stdout
+        self.jsonl = jsonl  # Archivo abierto donde se escribe un evento por línea
+        self.detallado = nivel >= INFO or jsonl is not None
+        self.errores = []  # [(numero de linea, mensaje)]
+        self.tam_bloque = tam_bloque
+        self.bloque = []
+
+    def registrar(self, evento):
+        self.bloque.append(json.dumps(evento, ensure_ascii=False))
+        if len(self.bloque) >= self.tam_bloque:
+            self.vaciar()
+
+    def vaciar(self):
+        if self.jsonl is not None and self.bloque:
+            self.jsonl.write("\n".join(self.bloque) + "\n")
+        self.bloque.clear()
+
+    def error(self, linea, mensaje):
+        self.errores.append((linea, mensaje))
+        if self.nivel >= ERROR:
+            donde = f" (línea {linea})" if linea is not None else ""
+            print(f"Error{donde}: {mensaje}", file=self.salida)
+        if self.jsonl is not None:
+            self.registrar({"evento": "error", "linea": linea, "mensaje": mensaje})
+
+    def instruccion(self, linea, direccion, mnemonico, codigo):
+        if self.nivel >= INFO:
+            print(f"Generado {mnemonico} en {direccion:04X}: {bytes(codigo).hex(' ').upper()}", file=self.salida)
+        if self.jsonl is not None:
+            self.registrar({"evento": "instruccion", "linea": linea, "direccion": direccion,
+                            "mnemonico": mnemonico, "bytes": bytes(codigo).hex()})
+
+    def etiqueta(self, linea, etiqueta, direccion):
+        if self.nivel >= INFO:
+            print(f"Etiqueta '{etiqueta}' definida en {direccion:04X}", file=self.salida)
+        if self.jsonl is not None:
+            self.registrar({"evento": "etiqueta", "linea": linea, "etiqueta": etiqueta, "direccion": direccion})
+
+    def resuelto(self, etiqueta, direccion, posiciones):
+        if self.nivel >= INFO:
+            print(f"Resuelto salto a '{etiqueta}' con dirección {direccion:04X}", file=self.salida)
+        if self.jsonl is not None:
+            self.registrar({"evento": "resuelto", "etiqueta": etiqueta, "direccion": direccion,
+                            "posiciones": list(posiciones)})
+
+
 class EnsambladorIA32:
-    def __init__(self):
-        self.tabla_simbolos = {}  # {simbolo: direccion}
-        self.referencias_pendientes = {}  # {simbolo: [lista de posiciones donde se usa]}
-        self.codigo_hex = []  # Lista de bytes en hexadecimal
+    def __init__(self, diagnosticos=None, perfilador=None):
+        self.diagnosticos = diagnosticos if diagnosticos is not None else Diagnosticos()
+        self.detallado = self.diagnosticos.detallado
+        self.entrada_mapeada = True  # Leer el fuente con mmap y tokenizar sobre bytes
+        self.preprocesar = True  # %include, %macro y %define (sólo si alguna línea empieza con '%')
+        self.listado = False  # Anotar dónde empieza cada línea, para generar_listado
+        self.formato_simbolos = 'texto'  # Formato de la tabla de símbolos (simbolos.ARCHIVOS)
+        self.ordenar_simbolos = False  # Tabla de símbolos por dirección en vez de por definición
+        self.mirilla = None  # mirilla.Mirilla si se optimiza (ver optimizar)
+        # Despacho O(1): la tabla se liga a los métodos de esta instancia para
+        # que las subclases puedan redefinir los generadores
+        self.despacho = {clave: (getattr(self, metodo), argumento)
+                         for clave, (metodo, argumento) in TABLA_INSTRUCCIONES.items()}
+        self.reiniciar()
+        # Medición por fases (perfil.Perfilador); sin perfilador no se toca nada
+        self.perfilador = perfilador
+        if perfilador is not None:
+            perfilador.instrumentar(self)
+
+    def reiniciar(self):
+        # Estado de un ensamblado. Llamarlo entre fuentes permite reutilizar la
+        # instancia sin volver a armar el despacho; la configuración se conserva
+        self.tabla_simbolos = TablaSimbolos()  # {simbolo: direccion}
+        self.referencias_pendientes = {}  # {simbolo: array('I') de posiciones aún sin resolver}
+        self.absolutos_pendientes = {}  # {simbolo: array('I') de campos disp32 de [etiqueta] sin resolver}
+        self.lineas_pendientes = {}  # {simbolo pendiente: línea de su primera referencia}
+        self.ruta_referencias = None  # referencias.txt mientras se ensambla, ver abrir_referencias
+        self.reporte_referencias = None  # y el archivo, abierto con la primera entrada resuelta
+        self.reubicaciones = array('I')  # Campos con una dirección absoluta de .text (R_386_32 en ELF)
+        self.codigo_hex = bytearray()  # Bytes del código máquina
         self.contador_posicion = 0  # Contador de posición (location counter)
+        self.numero_linea = 0  # Línea del fuente en proceso, para los diagnósticos
+        self.bloques = {}  # {clave de un %include: código}, ver procesar_inclusion
+        self.bloque_reubicable = True  # Se apaga con etiquetas, saltos o [etiqueta]
+        self.incluidos = {}  # {ruta: firma} de los archivos incluidos con %include
+        self.listado_lineas = array('I')  # Con listado: número de cada línea anotada
+        self.listado_posiciones = array('I')  # y contador de posición al empezarla
+        if self.mirilla is not None:
+            self.mirilla.reiniciar()
+        self.diagnosticos.vaciar()
+        self.diagnosticos.errores = []  # Lista nueva: un Resultado anterior conserva la suya
 
-    def ensamblar(self, archivo_entrada):
-        with open(archivo_entrada, 'r') as f:
-            lineas = f.readlines()
+    # En una pasada la mirilla también elimina los saltos a la etiqueta siguiente
+    mirilla_saltos = True
+
+    @property
+    def optimizar(self):
+        return self.mirilla is not None
+
+    @optimizar.setter
+    def optimizar(self, valor):
+        # Optimización de mirilla entre la tokenización y los generadores
+        if valor and self.mirilla is None:
+            from mirilla import Mirilla
+            self.mirilla = Mirilla(self, self.mirilla_saltos)
+        elif not valor:
+            self.mirilla = None
+
+    def ensamblar(self, archivo_entrada, limite_memoria=None, directorio_salida='.'):
+        # Con limite_memoria el código se acumula en un BufferCodigo que se
+        # vuelca a disco al rebasar ese tamaño (modo streaming)
+        if limite_memoria is not None:
+            self.codigo_hex = BufferCodigo(limite_memoria)
+        self.abrir_referencias(directorio_salida)
 
-        # Procesamos todo en una sola pasada
-        for linea in lineas:
-            self.procesar_linea(linea)
+        # Procesamos todo en una sola pasada, leyendo el archivo línea por
+        # línea sin cargarlo completo en memoria
+        self.procesar_fuente(archivo_entrada)
 
         # Resolver las referencias pendientes después de procesar todo el código
-        self.resolver_referencias_pendientes()
+        self.finalizar()
 
         # Generar los archivos de salida
-        self.generar_tabla_simbolos()
-        self.generar_referencias_pendientes()
+        self.generar_reportes(directorio_salida)
 
-    def procesar_linea(self, linea):
-        # Eliminar comentarios y espacios
-        linea = re.sub(r';.*', '', linea).strip()  
-        if not linea:
+    def ensamblar_texto(self, fuente, directorio_salida=None, origen='<texto>'):
+        # Ensambla desde memoria: `fuente` es un str o un iterable de líneas.
+        # Empieza con reiniciar(), así que la misma instancia sirve para muchos
+        # fragmentos seguidos. No escribe nada salvo que se pida directorio_salida.
+        # `origen` es la ruta del fuente: los %include se buscan junto a ella.
+        self.reiniciar()
+        preprocesar = self.preprocesar
+        if isinstance(fuente, str):
+            preprocesar = preprocesar and LINEA_DIRECTIVA.search(fuente) is not None
+            fuente = fuente.splitlines()
+        if directorio_salida is not None:
+            self.abrir_referencias(directorio_salida)
+        self.procesar_lineas(fuente, origen, preprocesar)
+        self.finalizar()
+        if directorio_salida is not None:
+            self.generar_reportes(directorio_salida)
+        else:
+            self.diagnosticos.vaciar()  # Los eventos JSONL pendientes no esperan a un reporte
+        return Resultado(bytes(self.codigo_hex), self.tabla_simbolos, self.fixups_pendientes(),
+                         self.diagnosticos.errores)
+
+    def finalizar(self, limite_memoria=None):
+        # Lo que sigue a la lectura del fuente. En una pasada sólo quedan las
+        # referencias a etiquetas nunca definidas; limite_memoria ya se
+        # aplicó al empezar
+        if self.mirilla is not None:
+            self.mirilla.vaciar()
+        self.resolver_referencias_pendientes()
+
+    def procesar_fuente(self, archivo_entrada):
+        # Con entrada_mapeada el archivo se mapea y cada línea se tokeniza en
+        # su lugar: no se crea un str por línea y sólo se decodifican las
+        # etiquetas y los operandos que no están en la cache. Si no se puede
+        # mapear (tubería, dispositivo) se lee como texto. Un fuente con alguna
+        # línea que empieza con '%' pasa por el preprocesador, que trabaja
+        # sobre texto.
+        datos = None
+        if self.entrada_mapeada:
+            with open(archivo_entrada, 'rb') as f:
+                try:
+                    datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:  # Archivo vacío: no hay nada que ensamblar
+                    return
+                except OSError:
+                    pass
+        if datos is not None:
+            with datos:
+                if not self.preprocesar or LINEA_DIRECTIVA_BYTES.search(datos) is None:
+                    anotar = self.anotar_linea if self.listado else None
+                    for inicio, fin in self.leer_lineas_mapeadas(datos):
+                        self.numero_linea += 1
+                        if anotar is not None:
+                            anotar()
+                        self.procesar_linea_bytes(datos, inicio, fin)
+                    return
+
+        self.procesar_lineas(self.leer_lineas(archivo_entrada), archivo_entrada, self.preprocesar)
+
+    def procesar_lineas(self, lineas, origen, preprocesar):
+        # Líneas de texto, de un archivo o de memoria; los %include se
+        # resuelven relativos a `origen`
+        anotar = self.anotar_linea if self.listado else None
+        if not preprocesar:
+            for linea in lineas:
+                self.numero_linea += 1
+                if anotar is not None:
+                    anotar()
+                self.procesar_linea(linea)
             return
-        if linea.endswith(':'):  # Si es una etiqueta, registrarla
-            etiqueta = linea[:-1].strip()
-            self.procesar_etiqueta(etiqueta)
+        preprocesador = Preprocesador(self.diagnosticos.error)
+        self.incluidos = preprocesador.incluidos
+        for self.numero_linea, linea in preprocesador.expandir(lineas, origen):
+            if anotar is not None:
+                anotar()
+            if linea.__class__ is str:
+                self.procesar_linea(linea)
+            else:
+                self.procesar_inclusion(linea)
+
+    def procesar_inclusion(self, inclusion):
+        # Un %include cuyo código no depende de la posición (sin etiquetas ni
+        # saltos, sin errores y sin cambiar el estado del preprocesador) se
+        # codifica una vez; las siguientes inclusiones emiten esos bytes
+        if self.mirilla is not None:  # Lo pendiente no es parte del bloque
+            self.mirilla.vaciar()
+        codigo = self.bloques.get(inclusion.clave)
+        if codigo is not None:
+            self.emitir(codigo)
             return
-        # Sino, es instrucción
-        self.procesar_instruccion(linea)
+        reubicable, self.bloque_reubicable = self.bloque_reubicable, True
+        errores = len(self.diagnosticos.errores)
+        inicio = len(self.codigo_hex)
+        for linea in inclusion.lineas():
+            if linea.__class__ is str:
+                self.procesar_linea(linea)
+            else:
+                self.procesar_inclusion(linea)
+        if self.mirilla is not None:
+            self.mirilla.vaciar()
+        if (self.bloque_reubicable and inclusion.puro and not self.detallado
+                and len(self.diagnosticos.errores) == errores):
+            self.bloques[inclusion.clave] = bytes(self.codigo_hex[inicio:])
+        self.bloque_reubicable = reubicable and self.bloque_reubicable
 
-    def procesar_etiqueta(self, etiqueta):
-        if etiqueta in self.tabla_simbolos:
-            print(f"Error: etiqueta duplicada '{etiqueta}'")
+    def leer_lineas(self, archivo_entrada):
+        with open(archivo_entrada, 'r') as f:
+            yield from f
+
+    def leer_lineas_mapeadas(self, datos, inicio=0, total=None):
+        # (inicio, fin) de cada línea sin el salto de línea, sin copiar nada;
+        # con inicio/total sólo las líneas de ese tramo
+        if total is None:
+            total = len(datos)
+        buscar = datos.find
+        while inicio < total:
+            fin = buscar(b'\n', inicio, total)
+            if fin < 0:
+                fin = total
+            yield inicio, fin
+            inicio = fin + 1
+
+    def anotar_linea(self):
+        # Sólo con listado. Si la mirilla retiene instrucciones, la línea
+        # empieza después de ellas: se anota cuando las emita
+        if self.mirilla is not None and self.mirilla.pendientes:
+            self.mirilla.lineas_diferidas.append(self.numero_linea)
         else:
-            self.tabla_simbolos[etiqueta] = self.contador_posicion
-            print(f"Etiqueta '{etiqueta}' definida en {self.contador_posicion:04X}")
+            self.anotar(self.numero_linea)
+
+    def anotar(self, numero):
+        # Una línea que se expande en varias (macro, %include) se anota una
+        # vez: todo su código es contiguo
+        if not self.listado_lineas or self.listado_lineas[-1] != numero:
+            self.listado_lineas.append(numero)
+            self.listado_posiciones.append(self.contador_posicion)
 
-    def procesar_instruccion(self, instruccion):
-        partes = instruccion.split(None, 1)
-        if len(partes) != 2:
-            print(f"Error: instrucción mal formada '{instruccion}'")
+    def direcciones_listado(self):
+        # Dirección final de cada línea anotada; en una pasada el código no se mueve
+        return self.listado_posiciones
+
+    def procesar_linea(self, linea):
+        # Etiqueta, mnemónico y operandos salen de una sola coincidencia; los
+        # comentarios y espacios quedan fuera de los grupos
+        partes = LINEA.match(linea)
+        if partes is None:
+            self.error(f"instrucción mal formada '{linea.strip()}'")
             return
-        mnemonico = partes[0].upper()
-        operandos = partes[1].split(',')
-        operandos = [op.strip().upper() for op in operandos]
-
-        if mnemonico == 'MOV':
-            self.generar_mov(operandos)
-        elif mnemonico == 'ADD':
-            self.generar_add(operandos)
-        elif mnemonico == 'SUB':
-            self.generar_sub(operandos)
-        elif mnemonico == 'CMP':
-            self.generar_cmp(operandos)
-        elif mnemonico == 'JMP':
-            self.generar_jmp(operandos[0])
-        elif mnemonico == 'JE':
-            self.generar_je(operandos[0])
-        elif mnemonico == 'JNE':
-            self.generar_jne(operandos[0])
+        etiqueta, mnemonico, operandos = partes.groups()
+        mirilla = self.mirilla
+        if etiqueta is not None:  # Si hay etiqueta, registrarla
+            if mirilla is None:
+                self.procesar_etiqueta(etiqueta)
+            else:
+                mirilla.etiqueta(etiqueta)
+        if mnemonico is None:
+            return
+        if not operandos:
+            self.error(f"instrucción mal formada '{mnemonico}'")
+            return
+        if mirilla is None:
+            self.procesar_instruccion(mnemonico.upper(), *clasificar_operandos(operandos))
         else:
-            print(f"Instrucción '{mnemonico}' no implementada aún")
-            self.contador_posicion += 2
+            mirilla.instruccion(mnemonico.upper(), *clasificar_operandos(operandos))
 
-    def generar_mov(self, operandos):
-        if len(operandos) != 2:
-            print("Error: MOV requiere 2 operandos")
+    def procesar_linea_bytes(self, datos, inicio, fin):
+        # Igual que procesar_linea, pero la coincidencia se hace sobre el
+        # buffer mapeado entre inicio y fin; los grupos son bytes pequeños
+        partes = LINEA_BYTES.match(datos, inicio, fin)
+        if partes is None:
+            self.error(f"instrucción mal formada '{datos[inicio:fin].decode(errors='replace').strip()}'")
             return
-        dest, src = operandos
-
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x89
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado MOV reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
+        etiqueta, mnemonico, operandos = partes.groups()
+        mirilla = self.mirilla
+        if etiqueta is not None:
+            if mirilla is None:
+                self.procesar_etiqueta(etiqueta.decode())
+            else:
+                mirilla.etiqueta(etiqueta.decode())
+        if mnemonico is None:
             return
-
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0xB8 + REGISTROS_32[dest]
-            self.codigo_hex.append(opcode)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado MOV reg,imm: opcode {opcode:02X} imm {valor_inmediato}")
-            self.contador_posicion += 5
+        if not operandos:
+            self.error(f"instrucción mal formada '{mnemonico.decode()}'")
             return
+        nombre = CACHE_MNEMONICOS.get(mnemonico)
+        if nombre is None:
+            nombre = mnemonico.decode().upper()
+            if len(CACHE_MNEMONICOS) >= LIMITE_CACHE_MNEMONICOS:
+                CACHE_MNEMONICOS.clear()
+            CACHE_MNEMONICOS[mnemonico] = nombre
+        if mirilla is None:
+            self.procesar_instruccion(nombre, *clasificar_operandos(operandos))
+        else:
+            mirilla.instruccion(nombre, *clasificar_operandos(operandos))
 
-        print("Error: modo de direccionamiento no soportado o mal operandos")
+    def procesar_etiqueta(self, etiqueta):
+        self.bloque_reubicable = False
+        if etiqueta in self.tabla_simbolos:
+            self.error(f"etiqueta duplicada '{etiqueta}'")
+        else:
+            self.tabla_simbolos[etiqueta] = self.contador_posicion
+            if self.detallado:
+                self.diagnosticos.etiqueta(self.numero_linea, etiqueta, self.contador_posicion)
+            # Los saltos que ya esperaban esta etiqueta se parchan ahora y su
+            # entrada se libera: sólo ocupa memoria lo que sigue pendiente
+            posiciones = self.referencias_pendientes.pop(etiqueta, None)
+            if posiciones is not None:
+                self.parchar_referencias(etiqueta, self.contador_posicion, posiciones)
+                if self.ruta_referencias is not None:
+                    self.escribir_resuelta(etiqueta, posiciones)
+            campos = self.absolutos_pendientes.pop(etiqueta, None)
+            if campos is not None:
+                self.parchar_absolutos(self.contador_posicion, campos)
+            self.lineas_pendientes.pop(etiqueta, None)
 
-    def generar_add(self, operandos):
-        if len(operandos) != 2:
-            print("Error: ADD requiere 2 operandos")
+    def procesar_instruccion(self, mnemonico, operandos, tipos):
+        entrada = self.despacho.get((mnemonico, tipos))
+        if entrada is not None:
+            metodo, argumento = entrada
+            if self.detallado:
+                inicio = self.contador_posicion
+                metodo(mnemonico, argumento, operandos)
+                self.instruccion_generada(mnemonico, inicio)
+            else:
+                metodo(mnemonico, argumento, operandos)
             return
 
-        dest, src = operandos
+        requeridos = OPERANDOS_REQUERIDOS.get(mnemonico)
+        if requeridos is None:
+            self.error(f"instrucción '{mnemonico}' no implementada aún")
+            # Se reservan 2 bytes como antes, pero emitidos: así el código y
+            # el contador de posición no se desfasan
+            self.emitir(bytes(2))
+        elif requeridos != len(operandos):
+            self.error(f"{mnemonico} requiere {requeridos} operando{'s' if requeridos > 1 else ''}")
+        elif MEM_INVALIDA in tipos:
+            self.error(f"operando de memoria inválido '{operandos[tipos.index(MEM_INVALIDA)][1]}'")
+        elif len(tipos) == 2 and tipos[1] == ETQ:
+            self.error(f"valor inmediato inválido '{operandos[1][1]}'")
+        elif len({BITS_OPERANDO[tipo] for tipo in tipos if tipo in BITS_OPERANDO}) > 1:
+            self.error("los operandos no tienen el mismo tamaño")
+        else:
+            self.error("modo de direccionamiento no soportado o mal operandos")
 
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x01
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
+    def error(self, mensaje):
+        self.diagnosticos.error(self.numero_linea, mensaje)
 
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado ADD reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
+    def instruccion_generada(self, mnemonico, inicio):
+        # Sólo se llama en modo detallado
+        self.diagnosticos.instruccion(self.numero_linea, inicio, mnemonico, self.codigo_hex[inicio:])
 
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0x81
-            mod = 0b11
-            reg = 0b000
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado ADD reg,imm: opcode {opcode:02X} modrm {modrm:02X} imm {valor_inmediato}")
-            self.contador_posicion += 6
-            return
+    def emitir(self, codigo):
+        self.codigo_hex.extend(codigo)
+        self.contador_posicion += len(codigo)
 
-        print("Error: modo de direccionamiento no soportado o mal operandos")
+    def generar_reg_reg(self, mnemonico, plantillas, operandos):
+        self.emitir(plantillas[(operandos[0][1] << 3) | operandos[1][1]])
 
-    def generar_sub(self, operandos):
-        if len(operandos) != 2:
-            print("Error: SUB requiere 2 operandos")
-            return
+    def inmediato_fuera_de_rango(self, valor, mascara):
+        # Cabe lo que se puede escribir con o sin signo en el tamaño del
+        # operando (-128..255 en 8 bits). Igual se emite truncado, para que
+        # las direcciones que siguen no se corran
+        self.error(f"inmediato {valor} fuera de rango para {mascara.bit_length()} bits")
 
-        dest, src = operandos
+    def generar_mov_imm(self, mnemonico, formas, operandos):
+        opcodes, mitad, mascara, inmediato = formas
+        valor = operandos[1][1]
+        if not -mitad <= valor <= mascara:
+            self.inmediato_fuera_de_rango(valor, mascara)
+        self.emitir(opcodes[operandos[0][1]] + inmediato(valor))
 
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x29
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
+    def generar_alu_imm(self, mnemonico, formas, operandos):
+        corto, largo, acumulador, mitad, mascara, inmediato = formas
+        registro = operandos[0][1]
+        valor = operandos[1][1]
+        if not -mitad <= valor <= mascara:
+            self.inmediato_fuera_de_rango(valor, mascara)
+        # El inmediato se interpreta con signo en el tamaño del operando
+        # (0xFFFFFFFF es -1 en 32 bits, 0xFF es -1 en 8)
+        valor = ((valor + mitad) & mascara) - mitad
+        if -128 <= valor <= 127:  # Cabe extendido de signo: 83 /digit ib, 3 bytes
+            self.emitir(corto[registro] + bytes((valor & 0xFF,)))
+        elif registro == 0:  # EAX: forma del acumulador, 5 bytes
+            self.emitir(acumulador + inmediato(valor))
+        else:  # 81 /digit id, 6 bytes
+            self.emitir(largo[registro] + inmediato(valor))
 
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado SUB reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
+    def emitir_memoria(self, opcode, registro, memoria, inmediato=b''):
+        # Única codificación de operandos de memoria: opcode, ModR/M con
+        # `registro` (o /digit) en el campo reg, SIB y desplazamiento ya
+        # preparados en `memoria`, y el inmediato si lo hay
+        cola = memoria.cola
+        if memoria.etiqueta is not None:
+            cola = self.registrar_absoluto(self.contador_posicion + len(opcode) + memoria.campo, memoria)
+        self.emitir(opcode + bytes((memoria.modrm | (registro << 3),)) + cola + inmediato)
 
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0x81
-            mod = 0b11
-            reg = 0b101
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado SUB reg,imm: opcode {opcode:02X} modrm {modrm:02X} imm {valor_inmediato}")
-            self.contador_posicion += 6
-            return
+    def generar_mem_reg(self, mnemonico, opcode, operandos):
+        self.emitir_memoria(opcode, operandos[1][1], operandos[0][1])
 
-        print("Error: modo de direccionamiento no soportado o mal operandos")
-
-    def generar_cmp(self, operandos):
-        if len(operandos) != 2:
-            print("Error: CMP requiere 2 operandos")
-            return
+    def generar_reg_mem(self, mnemonico, opcode, operandos):
+        self.emitir_memoria(opcode, operandos[0][1], operandos[1][1])
 
-        dest, src = operandos
+    def generar_mem_imm(self, mnemonico, formas, operandos):
+        corto, largo, digit, mitad, mascara, inmediato = formas
+        valor = operandos[1][1]
+        if not -mitad <= valor <= mascara:
+            self.inmediato_fuera_de_rango(valor, mascara)
+        valor = ((valor + mitad) & mascara) - mitad
+        if corto is not None and -128 <= valor <= 127:  # 83 /digit ib
+            self.emitir_memoria(corto, digit, operandos[0][1], bytes((valor & 0xFF,)))
+        else:  # C7 /0 id o 81 /digit id
+            self.emitir_memoria(largo, digit, operandos[0][1], inmediato(valor))
 
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x39
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
+    def registrar_absoluto(self, campo, memoria):
+        # [etiqueta + n]: el campo disp32 lleva la dirección de la etiqueta más
+        # n. Si la etiqueta aún no está definida queda n y se suma al definirla.
+        # Devuelve la cola (SIB y desplazamiento) a emitir.
+        self.bloque_reubicable = False
+        self.reubicaciones.append(campo)
+        destino = self.tabla_simbolos.get(memoria.etiqueta)
+        if destino is None:
+            campos = self.absolutos_pendientes.get(memoria.etiqueta)
+            if campos is None:
+                campos = self.absolutos_pendientes[memoria.etiqueta] = array('I')
+                self.lineas_pendientes.setdefault(memoria.etiqueta, self.numero_linea)
+            campos.append(campo)
+            return memoria.cola
+        return memoria.cola[:memoria.campo - 1] + imm32(destino + memoria.desplazamiento)
 
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado CMP reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
+    def parchar_absolutos(self, direccion_etiqueta, campos):
+        codigo = self.codigo_hex
+        for campo in campos:
+            valor = int.from_bytes(codigo[campo:campo + 4], 'little')
+            codigo[campo:campo + 4] = imm32(valor + direccion_etiqueta)
 
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0x81
-            mod = 0b11
-            reg = 0b111  # /7 en ModR/M para CMP
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado CMP reg,imm: opcode {opcode:02X} modrm {modrm:02X} imm {valor_inmediato}")
-            self.contador_posicion += 6
+    def generar_salto(self, mnemonico, formas, operandos):
+        corto, cercano = formas
+        etiqueta = operandos[0][1]
+        self.bloque_reubicable = False
+        destino = self.tabla_simbolos.get(etiqueta)
+        if destino is None:
+            # Referencia hacia adelante: en una sola pasada no se conoce la
+            # distancia, así que se usa la forma rel32 (siempre válida) con
+            # desplazamiento 0 y se corrige en resolver_referencias_pendientes
+            self.registrar_referencia(etiqueta)
+            self.emitir(cercano + imm32(0))
             return
 
-        print("Error: modo de direccionamiento no soportado o mal operandos")
+        # Hacia atrás la distancia ya se conoce: forma corta si cabe en rel8
+        desplazamiento = destino - self.contador_posicion - 2
+        if -128 <= desplazamiento <= 127:
+            self.emitir(bytes((corto, desplazamiento & 0xFF)))
+        else:
+            desplazamiento = destino - self.contador_posicion - len(cercano) - 4
+            self.emitir(cercano + imm32(desplazamiento))
 
     def generar_jmp(self, etiqueta):
-        if etiqueta not in self.tabla_simbolos:
-            print(f"Error: Etiqueta '{etiqueta}' no definida.")
-            self.referencias_pendientes[etiqueta] = self.referencias_pendientes.get(etiqueta, [])
-            self.referencias_pendientes[etiqueta].append(self.contador_posicion)
-            return
-
-        desplazamiento = self.tabla_simbolos[etiqueta] - self.contador_posicion - 5
-        self.codigo_hex.append(0xE9)
-        for i in range(4):
-            self.codigo_hex.append((desplazamiento >> (8 * i)) & 0xFF)
-    
-        print(f"Generado JMP a {etiqueta} con desplazamiento {desplazamiento}")
-        self.contador_posicion += 5
+        self.generar_salto('JMP', SALTOS['JMP'], ((ETQ, etiqueta),))
 
     def generar_je(self, etiqueta):
-        self.generar_condicional(0x74, etiqueta)
+        self.generar_salto('JE', SALTOS['JE'], ((ETQ, etiqueta),))
 
     def generar_jne(self, etiqueta):
-        self.generar_condicional(0x75, etiqueta)
-
-    def generar_condicional(self, opcode, etiqueta):
-        if etiqueta not in self.tabla_simbolos:
-            print(f"Error: Etiqueta '{etiqueta}' no definida.")
-            self.referencias_pendientes[etiqueta] = self.referencias_pendientes.get(etiqueta, [])
-            self.referencias_pendientes[etiqueta].append(self.contador_posicion)
-            return
+        self.generar_salto('JNE', SALTOS['JNE'], ((ETQ, etiqueta),))
 
-        desplazamiento = self.tabla_simbolos[etiqueta] - self.contador_posicion - 2
-        self.codigo_hex.append(opcode)
-        self.codigo_hex.append(desplazamiento & 0xFF)
+    def registrar_referencia(self, etiqueta):
+        posiciones = self.referencias_pendientes.get(etiqueta)
+        if posiciones is None:
+            posiciones = self.referencias_pendientes[etiqueta] = array('I')
+            self.lineas_pendientes.setdefault(etiqueta, self.numero_linea)
+        posiciones.append(self.contador_posicion)
 
-        print(f"Generado salto condicional {hex(opcode)} a {etiqueta} con desplazamiento {desplazamiento}")
-        self.contador_posicion += 2
+    def parchar_referencias(self, simbolo, direccion_etiqueta, posiciones):
+        for pos in posiciones:
+            # Los primeros bytes del salto indican la forma usada
+            if self.codigo_hex[pos] == 0x0F:  # Jcc rel32: 0F 8x + 4 bytes
+                desplazamiento = direccion_etiqueta - pos - 6
+                self.codigo_hex[pos + 2:pos + 6] = imm32(desplazamiento)
+            elif self.codigo_hex[pos] == 0xE9:  # JMP rel32: E9 + 4 bytes
+                desplazamiento = direccion_etiqueta - pos - 5
+                self.codigo_hex[pos + 1:pos + 5] = imm32(desplazamiento)
+            else:  # Forma corta: opcode + 1 byte
+                desplazamiento = direccion_etiqueta - pos - 2
+                if not -128 <= desplazamiento <= 127:
+                    self.error(f"salto a '{simbolo}' fuera de rango rel8 ({desplazamiento})")
+                self.codigo_hex[pos + 1] = desplazamiento & 0xFF
+        if self.detallado:
+            self.diagnosticos.resuelto(simbolo, direccion_etiqueta, posiciones)
 
     def resolver_referencias_pendientes(self):
-        for simbolo, direcciones in self.referencias_pendientes.items():
+        # Las referencias se resuelven al definirse cada etiqueta; lo que queda
+        # aquí apunta a etiquetas que nunca se definieron. El error se reporta
+        # en la línea de la primera referencia, como en dos pasadas
+        for simbolo, posiciones in self.referencias_pendientes.items():
             if simbolo in self.tabla_simbolos:
-                direccion_etiqueta = self.tabla_simbolos[simbolo]
-                for pos in direcciones:
-                    desplazamiento = direccion_etiqueta - pos - 5  # 1 byte de opcode + 4 bytes de desplazamiento
-                    self.codigo_hex[pos + 1] = desplazamiento & 0xFF
-                print(f"Resuelto salto a '{simbolo}' con dirección {direccion_etiqueta:04X}")
+                self.parchar_referencias(simbolo, self.tabla_simbolos[simbolo], posiciones)
             else:
-                print(f"Error: La etiqueta '{simbolo}' no está definida.")
+                self.etiqueta_no_definida(simbolo)
+        for simbolo, campos in self.absolutos_pendientes.items():
+            if simbolo in self.tabla_simbolos:
+                self.parchar_absolutos(self.tabla_simbolos[simbolo], campos)
+            elif simbolo not in self.referencias_pendientes:  # Ya reportada con los saltos
+                self.etiqueta_no_definida(simbolo)
 
-    def generar_tabla_simbolos(self):
-        with open('simbolos.txt', 'w') as f:
-            for simbolo, direccion in self.tabla_simbolos.items():
-                f.write(f"{simbolo}: {direccion:04X}\n")
+    def etiqueta_no_definida(self, simbolo):
+        self.diagnosticos.error(self.lineas_pendientes.get(simbolo),
+                                f"la etiqueta '{simbolo}' no está definida")
 
-    def generar_referencias_pendientes(self):
-        with open('referencias.txt', 'w') as f:
-            for simbolo, direcciones in self.referencias_pendientes.items():
-                f.write(f"{simbolo}: {', '.join(hex(d) for d in direcciones)}\n")
+    def fixups_pendientes(self):
+        # Desplazamientos que apuntan a etiquetas no definidas, como fixups.
+        # En una pasada toda referencia hacia adelante usa la forma rel32
+        fixups = []
+        for simbolo, posiciones in self.referencias_pendientes.items():
+            if simbolo not in self.tabla_simbolos:
+                for posicion in posiciones:
+                    campo = posicion + (2 if self.codigo_hex[posicion] == 0x0F else 1)
+                    fixups.append((campo, 4, REL32, simbolo))
+        for simbolo, campos in self.absolutos_pendientes.items():
+            if simbolo not in self.tabla_simbolos:
+                fixups.extend((campo, 4, ABS32, simbolo) for campo in campos)
+        return fixups
 
+    def generar_reportes(self, directorio_salida):
+        self.exportar_simbolos(directorio_salida)
+        self.generar_referencias_pendientes(os.path.join(directorio_salida, 'referencias.txt'))
+        self.diagnosticos.vaciar()
 
-if __name__ == "__main__":
-    ensamblador = EnsambladorIA32()
-    ensamblador.ensamblar("programa.asm")
+    def exportar_simbolos(self, directorio_salida):
+        formato = self.formato_simbolos
+        self.generar_tabla_simbolos(os.path.join(directorio_salida, simbolos.ARCHIVOS[formato]),
+                                    formato, self.ordenar_simbolos)
+
+    def generar_tabla_simbolos(self, ruta='simbolos.txt', formato='texto', ordenar=False):
+        self.tabla_simbolos.exportar(ruta, formato, ordenar)
+
+    def abrir_referencias(self, directorio_salida):
+        # referencias.txt lista cada salto hacia adelante. En una pasada las
+        # entradas se liberan al definirse la etiqueta, así que se escriben
+        # en ese momento; generar_referencias_pendientes agrega al final las
+        # que nunca se resolvieron y cierra el archivo. Se crea recién con la
+        # primera entrada: un fuente que no se pudo leer no deja un reporte vacío
+        self.ruta_referencias = os.path.join(directorio_salida, 'referencias.txt')
+
+    def escribir_resuelta(self, etiqueta, posiciones):
+        if self.reporte_referencias is None:
+            self.reporte_referencias = open(self.ruta_referencias, 'w')
+        self.escribir_referencias(self.reporte_referencias, {etiqueta: posiciones})
+
+    def generar_referencias_pendientes(self, ruta='referencias.txt'):
+        f = self.reporte_referencias
+        self.reporte_referencias = self.ruta_referencias = None
+        with (f if f is not None else open(ruta, 'w')) as f:
+            self.escribir_referencias(f, self.referencias_pendientes)
+
+    def escribir_referencias(self, f, referencias):
+        for simbolo, direcciones in referencias.items():
+            f.write(f"{simbolo}: {', '.join(hex(d) for d in direcciones)}\n")
 
-    print("\nCódigo máquina generado:")
-    print(" ".join(f"{byte:02X}" for byte in ensamblador.codigo_hex))
+    def generar_listado(self, ruta, archivo_entrada):
+        # Listado .lst: línea, dirección, etiqueta+desp de esa dirección, bytes
+        # finales (ya parchados) y el fuente. Se vuelve a leer el fuente línea a línea y cada rango de
+        # código se toma del buffer al escribirlo, así que no se guarda en
+        # memoria ni una copia del fuente ni del listado. Requiere haber
+        # ensamblado con listado=True.
+        lineas, direcciones = self.listado_lineas, self.direcciones_listado()
+        total = len(self.codigo_hex)
+        tabla = self.tabla_simbolos
+        ancho = max(map(len, tabla), default=0)
+        if ancho:
+            ancho += 10  # '+', hasta 8 dígitos hex del desplazamiento y el separador
+        errores = {}
+        for linea, mensaje in self.diagnosticos.errores:
+            errores.setdefault(linea, []).append(mensaje)
+        k = 0
+        with open(archivo_entrada, 'rb') as fuente, open(ruta, 'w') as f:
+            for numero, texto in enumerate(fuente, 1):
+                texto = texto.rstrip(b'\r\n').decode(errors='replace')
+                if k < len(lineas) and lineas[k] == numero:
+                    inicio = direcciones[k]
+                    k += 1
+                    fin = direcciones[k] if k < len(lineas) else total
+                    codigo = self.codigo_hex[inicio:fin]
+                    primeros = codigo[:BYTES_POR_FILA].hex(' ').upper()
+                    ubicacion = tabla.ubicacion(inicio) if ancho else ''
+                    f.write(f"{numero:6} {inicio:08X} {ubicacion:{ancho}}{primeros:<{3 * BYTES_POR_FILA}} {texto}\n")
+                    for resto in range(BYTES_POR_FILA, len(codigo), BYTES_POR_FILA):
+                        f.write(f"{'':6} {inicio + resto:08X} {'':{ancho}}"
+                                f"{codigo[resto:resto + BYTES_POR_FILA].hex(' ').upper()}\n")
+                else:
+                    f.write(f"{numero:6} {'':8} {'':{ancho}}{'':<{3 * BYTES_POR_FILA}} {texto}\n")
+                for mensaje in errores.pop(numero, ()):
+                    f.write(f"{'':6} *** error: {mensaje}\n")
+            for mensaje in errores.get(None, ()):  # Errores sin línea del fuente
+                f.write(f"{'':6} *** error: {mensaje}\n")
 
+
+def buscar_entradas(entradas):
+    # Cada entrada puede ser un archivo, un directorio (todos sus .asm) o un
+    # patrón glob. Se respeta el orden y se quitan los repetidos.
+    archivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            archivos.extend(sorted(glob.glob(os.path.join(entrada, '*.asm'))))
+        elif glob.has_magic(entrada):
+            archivos.extend(sorted(glob.glob(entrada, recursive=True)))
+        else:
+            archivos.append(entrada)
+    return list(dict.fromkeys(archivos))
+
+
+def directorios_de_trabajo(archivos, directorio_base):
+    # Un directorio por archivo (<base>/<nombre>) para que las tablas y el
+    # código de distintos trabajos no se pisen; los nombres repetidos se numeran
+    directorios = []
+    usados = set()
+    for archivo in archivos:
+        nombre = os.path.splitext(os.path.basename(archivo))[0]
+        candidato, n = nombre, 1
+        while candidato in usados:
+            n += 1
+            candidato = f"{nombre}_{n}"
+        usados.add(candidato)
+        directorios.append(os.path.join(directorio_base, candidato))
+    return directorios
+
+
+def ensamblar_trabajo(clase, archivo, directorio, *opciones):
+    # Un trabajo del lote. Es una función de módulo para poder enviarla a otro
+    # proceso. Un archivo que no se puede leer (o una salida que no se puede
+    # escribir) es un error de ese trabajo y no corta el lote; si el fuente
+    # no abre, no se crea nada en su directorio de salida.
+    try:
+        with open(archivo, 'rb'):
+            pass
+        return ensamblar_archivo(clase, archivo, directorio, *opciones)
+    except OSError as e:
+        if e.filename == archivo:
+            mensaje = f"no se pudo leer el archivo: {e.strerror}"
+        else:
+            mensaje = f"no se pudo escribir '{e.filename}': {e.strerror}"
+        return archivo, None, 0, [(None, mensaje)], None, None
+
+
+def ensamblar_archivo(clase, archivo, directorio, formato, detallado, ruta=None,
+                      directorio_cache=None, limite_cache=None, medir=False, listado=False, optimizar=False,
+                      formato_simbolos='texto', ordenar_simbolos=False, limite_memoria=None,
+                      ruta_diagnosticos=None):
+    # Instancia propia y directorio de salida propio
+    os.makedirs(directorio, exist_ok=True)
+    jsonl = open(ruta_diagnosticos, 'w', encoding='utf-8') if ruta_diagnosticos is not None else None
+    try:
+        perfilador = perfil.Perfilador() if medir else None
+        ensamblador = clase(Diagnosticos(nivel=INFO if detallado else SILENCIO, jsonl=jsonl), perfilador)
+        ensamblador.listado = listado
+        ensamblador.optimizar = optimizar
+        ensamblador.formato_simbolos = formato_simbolos
+        ensamblador.ordenar_simbolos = ordenar_simbolos
+        desde_cache = None
+        nombre = os.path.splitext(os.path.basename(archivo))[0]
+        # La cache no guarda las líneas del listado ni los eventos JSONL, y
+        # guarda el código completo en memoria, lo que anularía limite_memoria
+        if directorio_cache is None or listado or limite_memoria is not None or jsonl is not None:
+            ensamblador.ensamblar(archivo, limite_memoria, directorio)
+        else:
+            cache_archivos = cache.obtener_cache(directorio_cache, limite_cache)
+            desde_cache = cache.ensamblar_con_cache(cache_archivos, ensamblador, archivo, directorio)
+    finally:
+        if jsonl is not None:
+            jsonl.close()
+    if ruta is None:
+        ruta = os.path.join(directorio, nombre + salida.FORMATOS[formato][1])
+    salida.escribir(formato, ensamblador.codigo_hex, ensamblador.tabla_simbolos, ruta,
+                    ensamblador.reubicaciones)
+    if listado:
+        ensamblador.generar_listado(os.path.join(directorio, nombre + '.lst'), archivo)
+    if detallado:
+        print(f"\nCódigo máquina generado ({archivo}):")
+        print(bytes(ensamblador.codigo_hex).hex(' ').upper())
+    if perfilador is not None:
+        perfilador.guardar_chrome_trace(os.path.join(directorio, 'perfil.json'))
+        perfilador.guardar_pstats(os.path.join(directorio, 'perfil.prof'))
+        with open(os.path.join(directorio, 'perfil.txt'), 'w') as f:
+            f.write(perfilador.resumen() + "\n")
+    ahorrado = ensamblador.mirilla.ahorrado if optimizar and not desde_cache else None
+    return archivo, ruta, len(ensamblador.codigo_hex), ensamblador.diagnosticos.errores, desde_cache, ahorrado
+
+
+def main(argv=None, clase=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ensamblador básico IA-32")
+    parser.add_argument('entradas', nargs='*', default=['programa.asm'],
+                        help="archivos .asm, directorios o patrones glob")
+    parser.add_argument('-f', '--formato', choices=sorted(salida.FORMATOS), default='hex',
+                        help="formato de salida (por defecto Intel HEX)")
+    parser.add_argument('-d', '--directorio', default='.',
+                        help="directorio base; cada archivo se escribe en <directorio>/<nombre>/")
+    parser.add_argument('-o', '--salida', help="archivo de salida (sólo con una entrada)")
+    parser.add_argument('-j', '--procesos', type=int, default=os.cpu_count(),
+                        help="procesos para ensamblar en paralelo")
+    parser.add_argument('-v', '--detallado', action='store_true', help="mostrar cada instrucción generada")
+    parser.add_argument('-O', '--optimizar', action='store_true',
+                        help="optimización de mirilla (MOV r, 0 -> XOR, saltos a la etiqueta siguiente...)")
+    parser.add_argument('-l', '--listado', action='store_true',
+                        help="escribir <nombre>.lst con dirección, bytes y fuente de cada línea")
+    parser.add_argument('--simbolos', choices=sorted(simbolos.ARCHIVOS), default='texto',
+                        help="formato de la tabla de símbolos: simbolos.txt o simbolos.bin (ver simbolos.py)")
+    parser.add_argument('--ordenar', action='store_true',
+                        help="tabla de símbolos ordenada por dirección en vez de por definición")
+    parser.add_argument('--limite-memoria', type=int, metavar='MB',
+                        help="volcar el código a un temporal en disco al pasar de MB (no usa la cache)")
+    parser.add_argument('--cache', metavar='DIRECTORIO',
+                        help="reutilizar resultados de archivos sin cambios guardados en DIRECTORIO")
+    parser.add_argument('--cache-limite', type=int, default=256, metavar='MB',
+                        help="tamaño máximo de la cache en MB (se expulsan las entradas menos usadas)")
+    parser.add_argument('--perfil', action='store_true',
+                        help="medir cada fase y guardar perfil.txt, perfil.json (Chrome) y perfil.prof (pstats)")
+    parser.add_argument('--diagnosticos', metavar='ARCHIVO.jsonl',
+                        help="escribir un evento JSON por línea (errores, instrucciones, etiquetas, saltos "
+                             "resueltos); con varias entradas, uno por archivo en su directorio de salida")
+    args = parser.parse_args(argv)
+
+    archivos = buscar_entradas(args.entradas)
+    if not archivos:
+        parser.error("no se encontraron archivos .asm")
+    if args.salida and len(archivos) > 1:
+        parser.error("-o sólo se puede usar con un archivo de entrada")
+
+    clase = clase if clase is not None else EnsambladorIA32
+    directorios = directorios_de_trabajo(archivos, args.directorio)
+    # Con una sola entrada el JSONL va donde se pidió (como -o); con varias,
+    # cada trabajo escribe el suyo con ese nombre en su directorio
+    if args.diagnosticos is None:
+        diagnosticos = [None] * len(archivos)
+    elif len(archivos) == 1:
+        diagnosticos = [args.diagnosticos]
+    else:
+        diagnosticos = [os.path.join(d, os.path.basename(args.diagnosticos)) for d in directorios]
+    trabajos = [(clase, archivo, directorio, args.formato, args.detallado, args.salida,
+                 args.cache, args.cache_limite * 1024 * 1024, args.perfil, args.listado, args.optimizar,
+                 args.simbolos, args.ordenar,
+                 args.limite_memoria * 1024 * 1024 if args.limite_memoria is not None else None, jsonl)
+                for archivo, directorio, jsonl in zip(archivos, directorios, diagnosticos)]
+    if len(trabajos) == 1 or args.procesos <= 1:
+        resultados = [ensamblar_trabajo(*trabajo) for trabajo in trabajos]
+    else:
+        with ProcessPoolExecutor(max_workers=args.procesos) as ejecutor:
+            resultados = list(ejecutor.map(ensamblar_trabajo, *zip(*trabajos), chunksize=4))
+
+    fallidos = aciertos = ilegibles = 0
+    for archivo, ruta, tamano, errores, desde_cache, ahorrado in resultados:
+        for linea, mensaje in errores:
+            donde = f":{linea}" if linea is not None else ""
+            print(f"{archivo}{donde}: error: {mensaje}", file=sys.stderr)
+        fallidos += bool(errores)
+        if ruta is None:  # No se pudo ensamblar: el error ya se mostró
+            ilegibles += 1
+            continue
+        aciertos += bool(desde_cache)
+        nota = " (cache)" if desde_cache else f" ({ahorrado} bytes ahorrados)" if ahorrado is not None else ""
+        print(f"{archivo}: {tamano} bytes -> {ruta}{nota}")
+    if args.cache:
+        print(f"cache: {aciertos} aciertos, {len(resultados) - ilegibles - aciertos} fallos")
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,320 +1,313 @@
-import re
-# Constantes globales
-REGISTROS_32 = {
-    'EAX': 0b000,
-    'ECX': 0b001,
-    'EDX': 0b010,
-    'EBX': 0b011,
-}
-
-class EnsambladorIA32:
-    def __init__(self):
-        self.tabla_simbolos = {}  # {simbolo: direccion}
-        self.referencias_pendientes = {}  # {simbolo: [lista de direcciones]}
-        self.codigo_hex = []  # Lista de bytes en hex
-        self.contador_posicion = 0  # Location counter
-
-    def ensamblar(self, archivo_entrada):
-        with open(archivo_entrada, 'r') as f:
-            lineas = f.readlines()
-        for linea in lineas:
-            self.procesar_linea(linea)
-        # Resolver las referencias pendientes
+import sys
+from array import array
+
+import ensamblador
+from ensamblador import ABS32, BufferCodigo, FORMA_CERCANA, REL8, REL32, SALTOS, imm32
+from simbolos import TablaSimbolos
+
+
+class EnsambladorIA32(ensamblador.EnsambladorIA32):
+    # Ensamblador de dos pasadas sobre los mismos generadores del ensamblador
+    # de una pasada. La primera pasada codifica en codigo_fijo todo lo que no
+    # depende de etiquetas y deja los saltos aparte, así conoce el tamaño de
+    # cada instrucción y la dirección de cada etiqueta. La segunda intercala
+    # los saltos en el código final, anota cada desplazamiento como fixup
+    # (posicion, ancho, tipo, simbolo) y los parcha todos juntos al terminar.
+    def reiniciar(self):
+        super().reiniciar()
+        self.codigo_fijo = self.codigo_hex  # Código sin saltos (primera pasada)
+        self.etiquetas = TablaSimbolos()  # {etiqueta: posicion en codigo_fijo}
+        self.etiquetas_saltos = array('I')  # Saltos anteriores a cada etiqueta
+        self.saltos_posicion = array('I')  # Posición de cada salto en codigo_fijo
+        self.saltos_opcode = array('B')  # Opcode de la forma corta
+        self.saltos_etiqueta = []
+        self.saltos_linea = array('I')
+        self.saltos_adelante = array('B')  # 1 si la etiqueta aún no estaba definida
+        self.saltos_eliminados = array('B')  # 1 si optimizar_saltos lo quitó (tamaño 0)
+        self.saltos_tamano = array('B')  # Tamaño elegido por relajar_saltos
+        self.desplazamiento_saltos = array('I')  # Bytes de saltos antes del salto k
+        self.iteraciones_relajacion = 0
+        self.instrucciones = []  # Sólo en modo detallado, para el reporte final
+        self.fixups = []  # [(posicion, ancho, tipo, simbolo)]
+        self.absolutos = []  # [(posicion en codigo_fijo, saltos anteriores, simbolo)] de [etiqueta]
+        self.listado_saltos = array('I')  # Con listado: saltos anteriores a cada línea anotada
+
+    # Los saltos se optimizan con la vista completa en optimizar_saltos
+    mirilla_saltos = False
+
+    def ensamblar(self, archivo_entrada, limite_memoria=None, directorio_salida='.'):
+        # Con limite_memoria tanto codigo_fijo como el código final son
+        # BufferCodigo: ninguna de las dos pasadas guarda el programa en RAM
+        if limite_memoria is not None:
+            self.codigo_hex = self.codigo_fijo = BufferCodigo(limite_memoria)
+
+        # Primera pasada: tamaños y direcciones de las etiquetas
+        self.procesar_fuente(archivo_entrada)
+        self.finalizar(limite_memoria)
+        self.generar_reportes(directorio_salida)
+
+    def finalizar(self, limite_memoria=None):
+        if self.mirilla is not None:
+            self.mirilla.vaciar()
+        self.relajar_saltos()
+        if self.mirilla is not None:
+            antes = self.desplazamiento_saltos[-1]
+            self.optimizar_saltos()
+            self.relajar_saltos()
+            self.mirilla.ahorrado += antes - self.desplazamiento_saltos[-1]
+        self.calcular_direcciones()
+
+        # Segunda pasada: emitir el código y parchar los desplazamientos
+        self.codigo_hex = BufferCodigo(limite_memoria) if limite_memoria is not None else bytearray()
+        self.segunda_pasada()
         self.resolver_referencias_pendientes()
-        # Generar los archivos de salida
-        self.generar_tabla_simbolos()
-        self.generar_referencias_pendientes()
-    def resolver_referencias_pendientes(self):
-    # Resuelve las referencias pendientes, es decir, actualiza los saltos a etiquetas
-        for simbolo, direcciones in self.referencias_pendientes.items():
-            if simbolo in self.tabla_simbolos:
-                # Obtener la dirección de la etiqueta
-                direccion_etiqueta = self.tabla_simbolos[simbolo]
-                # Actualizar las direcciones pendientes
-                for pos in direcciones:
-                    # Calcular el desplazamiento de la etiqueta
-                    desplazamiento = direccion_etiqueta - pos - 5  # 1 byte de opcode + 4 bytes de desplazamiento
-                    # Reemplazar el código hexadecimal en la posición correcta
-                    self.codigo_hex[pos + 1] = desplazamiento & 0xFF  # Solo el byte de desplazamiento
-
-                print(f"Resuelto salto a '{simbolo}' con dirección {direccion_etiqueta:04X}")
-            else:
-                print(f"Error: La etiqueta '{simbolo}' no está definida.")
-
-    def procesar_linea(self, linea):
-        # Eliminar comentarios usando expresión regular y quitar espacios
-        linea = re.sub(r';.*', '', linea).strip()  # Elimina todo después de ';'
-        if not linea:  # Si la línea está vacía después de eliminar comentarios, la ignoramos
-            return
-        if linea.endswith(':'):  # Si es una etiqueta, procesarla
-            etiqueta = linea[:-1].strip()
-            self.procesar_etiqueta(etiqueta)
-            return
-        # Sino, es instrucción
-        self.procesar_instruccion(linea)
 
     def procesar_etiqueta(self, etiqueta):
-        if etiqueta in self.tabla_simbolos:
-            print(f"Error: etiqueta {etiqueta} duplicada")
+        self.bloque_reubicable = False
+        if etiqueta in self.etiquetas:
+            self.error(f"etiqueta duplicada '{etiqueta}'")
         else:
-            self.tabla_simbolos[etiqueta] = self.contador_posicion
-            print(f"Etiqueta {etiqueta} definida en {self.contador_posicion:04X}")
-
-    def procesar_instruccion(self, instruccion):
-        partes = instruccion.split(None, 1)
-        if len(partes) != 2:
-            print(f"Error: instrucción mal formada '{instruccion}'")
-            return
-        mnemonico = partes[0].upper()
-        operandos = partes[1].split(',')
-        # Limpiar operandos
-        operandos = [op.strip().upper() for op in operandos]
-        
-        if mnemonico == 'MOV':
-            self.generar_mov(operandos)
-        elif mnemonico == 'ADD':
-            self.generar_add(operandos)
-        elif mnemonico == 'SUB':
-            self.generar_sub(operandos)
-        elif mnemonico == 'CMP':
-            self.generar_cmp(operandos)
-        elif mnemonico == 'JMP':
-            self.generar_jmp(operandos[0])
-        elif mnemonico == 'JE':
-            self.generar_je(operandos[0])
-        elif mnemonico == 'JNE':
-            self.generar_jne(operandos[0])        
+            self.etiquetas[etiqueta] = self.contador_posicion
+            self.etiquetas_saltos.append(len(self.saltos_posicion))
+            self.lineas_pendientes.pop(etiqueta, None)
+
+    def generar_salto(self, mnemonico, formas, operandos):
+        etiqueta = operandos[0][1]
+        self.bloque_reubicable = False
+        self.saltos_posicion.append(self.contador_posicion)
+        self.saltos_opcode.append(formas[0])
+        self.saltos_etiqueta.append(etiqueta)
+        self.saltos_linea.append(self.numero_linea)
+        adelante = etiqueta not in self.etiquetas
+        self.saltos_adelante.append(adelante)
+        if adelante:
+            self.lineas_pendientes.setdefault(etiqueta, self.numero_linea)
+
+    def registrar_absoluto(self, campo, memoria):
+        # El campo queda con el desplazamiento de [etiqueta + n]; la dirección
+        # se suma como fixup ABS32 cuando se conoce la posición final
+        self.bloque_reubicable = False
+        self.absolutos.append((campo, len(self.saltos_posicion), memoria.etiqueta))
+        if memoria.etiqueta not in self.etiquetas:
+            self.lineas_pendientes.setdefault(memoria.etiqueta, self.numero_linea)
+        return memoria.cola
+
+    def anotar(self, numero):
+        anotadas = len(self.listado_lineas)
+        super().anotar(numero)
+        if len(self.listado_lineas) > anotadas:
+            self.listado_saltos.append(len(self.saltos_posicion))
+
+    def direcciones_listado(self):
+        # Posición en codigo_fijo + bytes de los saltos anteriores, como en
+        # calcular_direcciones
+        desplazamiento = self.desplazamiento_saltos
+        return array('I', (posicion + desplazamiento[saltos] for posicion, saltos
+                           in zip(self.listado_posiciones, self.listado_saltos)))
+
+    def instruccion_generada(self, mnemonico, inicio):
+        # Las direcciones finales aún no se conocen: se guarda la posición en
+        # codigo_fijo y cuántos saltos la preceden
+        saltos = len(self.saltos_posicion)
+        longitud = self.contador_posicion - inicio
+        if longitud == 0:  # Es un salto; su tamaño se decide después
+            saltos -= 1
+            longitud = None
+        self.instrucciones.append((self.numero_linea, mnemonico, inicio, saltos, longitud))
+
+    def tamano_salto(self, k):
+        return self.saltos_tamano[k]
+
+    def acumular_tamanos(self, tamanos):
+        # desplazamiento[k] = bytes ocupados por los saltos 0..k-1
+        desplazamiento = array('I', bytes(4 * (len(tamanos) + 1)))
+        acumulado = 0
+        for k, tamano in enumerate(tamanos):
+            desplazamiento[k] = acumulado
+            acumulado += tamano
+        desplazamiento[len(tamanos)] = acumulado
+        return desplazamiento
+
+    def optimizar_saltos(self):
+        # Con todas las etiquetas y saltos a la vista: un salto a una etiqueta
+        # cuya primera instrucción es JMP X va directo a X (siguiendo la
+        # cadena), y un salto a una etiqueta que lo sigue sin código en medio
+        # se elimina. Las direcciones salen después de relajar_saltos, así
+        # que tabla_simbolos queda coherente con el código reescrito.
+        etiquetas = self.etiquetas
+        posiciones = self.saltos_posicion
+        n = len(posiciones)
+        jmp = SALTOS['JMP'][0]
+        redireccion = {}  # {etiqueta: destino del JMP que la sigue}
+        for i, nombre in enumerate(etiquetas.nombres):
+            k = self.etiquetas_saltos[i]
+            if (k < n and posiciones[k] == etiquetas.direcciones[i] and self.saltos_opcode[k] == jmp
+                    and self.saltos_etiqueta[k] in etiquetas):
+                redireccion[nombre] = self.saltos_etiqueta[k]
+
+        aplicadas = self.mirilla.aplicadas
+        for k, etiqueta in enumerate(self.saltos_etiqueta):
+            destino, vistos = etiqueta, {etiqueta}
+            while destino in redireccion and redireccion[destino] not in vistos:  # Un ciclo se deja como está
+                destino = redireccion[destino]
+                vistos.add(destino)
+            if destino != etiqueta:
+                self.saltos_etiqueta[k] = destino
+                self.saltos_adelante[k] = self.etiquetas_saltos[etiquetas.indice(destino)] > k
+                aplicadas['enhebrar_saltos'] = aplicadas.get('enhebrar_saltos', 0) + 1
+
+        eliminados = self.saltos_eliminados = array('B', bytes(n))
+        for k in range(n - 1, -1, -1):
+            i = etiquetas.indice(self.saltos_etiqueta[k])
+            if i is None:
+                continue
+            siguiente = self.etiquetas_saltos[i]
+            if (siguiente > k and etiquetas.direcciones[i] == posiciones[k]
+                    and all(eliminados[j] for j in range(k + 1, siguiente))):
+                eliminados[k] = 1
+                aplicadas['salto_a_siguiente'] = aplicadas.get('salto_a_siguiente', 0) + 1
+
+    def relajar_saltos(self):
+        # Todos los saltos empiezan en la forma corta (2 bytes). En cada
+        # iteración se agrandan a rel32 los que no alcanzan su destino con
+        # rel8. Un salto nunca vuelve a achicarse, así que el proceso termina;
+        # en la práctica bastan dos o tres iteraciones.
+        n = len(self.saltos_posicion)
+        posiciones = self.saltos_posicion
+        tamanos = array('B', [2]) * n
+        largo = array('B', (len(FORMA_CERCANA[opcode]) + 4 for opcode in self.saltos_opcode))
+
+        # Destino de cada salto como (posición fija, saltos anteriores)
+        destino_posicion = array('I', bytes(4 * n))
+        destino_saltos = array('I', bytes(4 * n))
+        cortos = []
+        eliminados = self.saltos_eliminados
+        for k, etiqueta in enumerate(self.saltos_etiqueta):
+            i = self.etiquetas.indice(etiqueta)
+            if eliminados and eliminados[k]:
+                tamanos[k] = 0
+            elif i is None:  # Se reporta al parchar; se deja la forma larga
+                tamanos[k] = largo[k]
+            else:
+                destino_posicion[k] = self.etiquetas.direcciones[i]
+                destino_saltos[k] = self.etiquetas_saltos[i]
+                cortos.append(k)
+
+        self.iteraciones_relajacion = 0
+        while True:
+            self.iteraciones_relajacion += 1
+            desplazamiento = self.acumular_tamanos(tamanos)
+            siguen_cortos = []
+            for k in cortos:
+                origen = posiciones[k] + desplazamiento[k] + 2
+                destino = destino_posicion[k] + desplazamiento[destino_saltos[k]]
+                if -128 <= destino - origen <= 127:
+                    siguen_cortos.append(k)
+                else:
+                    tamanos[k] = largo[k]
+            if len(siguen_cortos) == len(cortos):
+                break
+            cortos = siguen_cortos
+
+        self.saltos_tamano = tamanos
+        self.desplazamiento_saltos = desplazamiento
+
+    def calcular_direcciones(self):
+        # Dirección = posición en codigo_fijo + bytes de los saltos anteriores
+        desplazamiento = self.desplazamiento_saltos
+        direcciones = array('I', (posicion + desplazamiento[saltos] for posicion, saltos
+                                  in zip(self.etiquetas.direcciones, self.etiquetas_saltos)))
+        self.tabla_simbolos = self.etiquetas.con_direcciones(direcciones)
+        if self.detallado:
+            for etiqueta, direccion in self.tabla_simbolos.items():
+                self.diagnosticos.etiqueta(None, etiqueta, direccion)
+
+    def segunda_pasada(self):
+        # Un BufferCodigo se copia por bloques desde su temporal
+        volcado = isinstance(self.codigo_fijo, BufferCodigo)
+        fijo = self.codigo_fijo if volcado else memoryview(self.codigo_fijo)
+        anterior = 0
+        for k, posicion in enumerate(self.saltos_posicion):
+            if volcado:
+                for bloque in fijo.bloques(anterior, posicion):
+                    self.codigo_hex.extend(bloque)
+            else:
+                self.codigo_hex.extend(fijo[anterior:posicion])
+            anterior = posicion
+            direccion = posicion + self.desplazamiento_saltos[k]
+            opcode = self.saltos_opcode[k]
+            etiqueta = self.saltos_etiqueta[k]
+            if self.saltos_tamano[k] == 0:  # Eliminado por optimizar_saltos
+                continue
+            if self.saltos_tamano[k] == 2:
+                self.codigo_hex.extend(bytes((opcode, 0)))
+                self.fixups.append((direccion + 1, 1, REL8, etiqueta))
+            else:
+                cercano = FORMA_CERCANA[opcode]
+                self.codigo_hex.extend(cercano + imm32(0))
+                self.fixups.append((direccion + len(cercano), 4, REL32, etiqueta))
+            if self.saltos_adelante[k]:
+                self.referencias_pendientes.setdefault(etiqueta, []).append(direccion)
+        if volcado:
+            for bloque in fijo.bloques(anterior):
+                self.codigo_hex.extend(bloque)
+            fijo.cerrar()
         else:
-            print(f"Instrucción '{mnemonico}' no implementada aún")
-            self.contador_posicion += 2  # Temporal   
-            
-    def generar_mov(self, operandos):
-        if len(operandos) != 2:
-            print("Error: MOV requiere 2 operandos")
-            return
-        dest, src = operandos
-        
-        # Registro a registro
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x89  # MOV reg to reg
-            mod = 0b11     # modo registro a registro
-            reg = REGISTROS_32[src]   # registro fuente (reg field)
-            rm = REGISTROS_32[dest]   # registro destino (r/m field)
-
-            # Byte ModR/M: mod (2 bits) | reg (3 bits) | r/m (3 bits)
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-
-            print(f"Generado MOV reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
-
-        # Inmediato a registro (ejemplo MOV EAX, 10)
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)  # Detecta decimal, hex (0x), etc.
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0xB8 + REGISTROS_32[dest]  # Opcode MOV reg32, imm32 empieza en B8
-            self.codigo_hex.append(opcode)
-
-            # El inmediato es de 32 bits, little endian
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-
-            print(f"Generado MOV reg,imm: opcode {opcode:02X} imm {valor_inmediato}")
-            self.contador_posicion += 5  # 1 byte opcode + 4 bytes inmediato
-            return
-
-        print("Error: modo de direccionamiento no soportado o mal operandos")
-    
-    def generar_add(self, operandos):
-        if len(operandos) != 2:
-            print("Error: ADD requiere 2 operandos")
-            return
-
-        dest, src = operandos
-
-        # Registro a registro
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x01
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado ADD reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
-
-        # Inmediato a registro
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0x81
-            mod = 0b11
-            reg = 0b000
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado ADD reg,imm: opcode {opcode:02X} modrm {modrm:02X} imm {valor_inmediato}")
-            self.contador_posicion += 6
-            return
+            self.codigo_hex.extend(fijo[anterior:])
+            fijo.release()
+        self.codigo_fijo = self.codigo_hex  # El código de la primera pasada ya no hace falta
+        for campo, saltos, etiqueta in self.absolutos:
+            campo += self.desplazamiento_saltos[saltos]
+            self.fixups.append((campo, 4, ABS32, etiqueta))
+            self.reubicaciones.append(campo)
+        self.contador_posicion = len(self.codigo_hex)
+
+    def generar_referencias_pendientes(self, ruta='referencias.txt'):
+        # Mismo reporte que en una pasada: las etiquetas definidas en el orden
+        # en que se definieron y después las que no se definieron nunca
+        pendientes = self.referencias_pendientes
+        ordenadas = {simbolo: pendientes[simbolo] for simbolo in self.tabla_simbolos if simbolo in pendientes}
+        ordenadas.update(pendientes)
+        self.referencias_pendientes = ordenadas
+        super().generar_referencias_pendientes(ruta)
 
-        print("Error: modo de direccionamiento no soportado o mal operandos")
-
-    def generar_sub(self, operandos):
-        if len(operandos) != 2:
-            print("Error: SUB requiere 2 operandos")
-            return
-
-        dest, src = operandos
-
-        # Registro a registro
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x29
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado SUB reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
-
-        # Inmediato a registro
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0x81
-            mod = 0b11
-            reg = 0b101
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado SUB reg,imm: opcode {opcode:02X} modrm {modrm:02X} imm {valor_inmediato}")
-            self.contador_posicion += 6
-            return
-
-        print("Error: modo de direccionamiento no soportado o mal operandos")
-
-    def generar_cmp(self, operandos):
-        if len(operandos) != 2:
-            print("Error: CMP requiere 2 operandos")
-            return
-
-        dest, src = operandos
-
-        # Registro a registro
-        if dest in REGISTROS_32 and src in REGISTROS_32:
-            opcode = 0x39
-            mod = 0b11
-            reg = REGISTROS_32[src]
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            print(f"Generado CMP reg,reg: opcode {opcode:02X} modrm {modrm:02X}")
-            self.contador_posicion += 2
-            return
-
-        # Inmediato a registro
-        if dest in REGISTROS_32:
-            try:
-                valor_inmediato = int(src, 0)
-            except ValueError:
-                print(f"Error: valor inmediato inválido '{src}'")
-                return
-
-            opcode = 0x81
-            mod = 0b11
-            reg = 0b111  # /7 en ModR/M para CMP
-            rm = REGISTROS_32[dest]
-            modrm = (mod << 6) | (reg << 3) | rm
-
-            self.codigo_hex.append(opcode)
-            self.codigo_hex.append(modrm)
-            for i in range(4):
-                self.codigo_hex.append((valor_inmediato >> (8 * i)) & 0xFF)
-            print(f"Generado CMP reg,imm: opcode {opcode:02X} modrm {modrm:02X} imm {valor_inmediato}")
-            self.contador_posicion += 6
-            return
-
-        print("Error: modo de direccionamiento no soportado o mal operandos")
-
-    def generar_jmp(self, etiqueta):
-        if etiqueta not in self.tabla_simbolos:
-            print(f"Error: Etiqueta '{etiqueta}' no definida.")
-            self.referencias_pendientes[etiqueta] = self.referencias_pendientes.get(etiqueta, [])
-            self.referencias_pendientes[etiqueta].append(self.contador_posicion)
-            return
-
-        desplazamiento = self.tabla_simbolos[etiqueta] - self.contador_posicion - 5
-        self.codigo_hex.append(0xE9)
-        for i in range(4):
-            self.codigo_hex.append((desplazamiento >> (8 * i)) & 0xFF)
-    
-        print(f"Generado JMP a {etiqueta} con desplazamiento {desplazamiento}")
-        self.contador_posicion += 5
-
-    def generar_je(self, etiqueta):
-            self.generar_condicional(0x74, etiqueta)
-
-    def generar_jne(self, etiqueta):
-            self.generar_condicional(0x75, etiqueta)
-
-    def generar_condicional(self, opcode, etiqueta):
-        if etiqueta not in self.tabla_simbolos:
-            print(f"Error: Etiqueta '{etiqueta}' no definida.")
-            self.referencias_pendientes[etiqueta] = self.referencias_pendientes.get(etiqueta, [])
-            self.referencias_pendientes[etiqueta].append(self.contador_posicion)
-            return
+    def resolver_referencias_pendientes(self):
+        # Parcha en bloque todos los fixups; las etiquetas ya son conocidas
+        codigo = self.codigo_hex
+        tabla = self.tabla_simbolos
+        no_definidas = set()
+        for posicion, ancho, tipo, simbolo in self.fixups:
+            destino = tabla.get(simbolo)
+            if destino is None:
+                if simbolo not in no_definidas:
+                    no_definidas.add(simbolo)
+                    self.etiqueta_no_definida(simbolo)
+                continue
+            if tipo == ABS32:
+                destino += int.from_bytes(codigo[posicion:posicion + 4], 'little')
+                codigo[posicion:posicion + 4] = imm32(destino)
+                continue
+            desplazamiento = destino - (posicion + ancho)
+            if tipo == REL8:
+                if not -128 <= desplazamiento <= 127:
+                    self.diagnosticos.error(None, f"salto a '{simbolo}' fuera de rango rel8 ({desplazamiento})")
+                codigo[posicion] = desplazamiento & 0xFF
+            else:
+                codigo[posicion:posicion + 4] = imm32(desplazamiento)
 
-        desplazamiento = self.tabla_simbolos[etiqueta] - self.contador_posicion - 2
-        self.codigo_hex.append(opcode)
-        self.codigo_hex.append(desplazamiento & 0xFF)
+        if self.detallado:
+            for linea, mnemonico, inicio, saltos, longitud in self.instrucciones:
+                if longitud is None:
+                    longitud = self.tamano_salto(saltos)
+                direccion = inicio + self.desplazamiento_saltos[saltos]
+                self.diagnosticos.instruccion(linea, direccion, mnemonico, codigo[direccion:direccion + longitud])
 
-        print(f"Generado salto condicional {hex(opcode)} a {etiqueta} con desplazamiento {desplazamiento}")
-        self.contador_posicion += 2
-    def generar_tabla_simbolos(self):
-        with open('simbolos.txt', 'w') as f:
-            for simbolo, direccion in self.tabla_simbolos.items():
-                f.write(f"{simbolo}: {direccion:04X}\n")
+    def fixups_pendientes(self):
+        return [fixup for fixup in self.fixups if fixup[3] not in self.tabla_simbolos]
 
-    def generar_referencias_pendientes(self):
-        with open('referencias.txt', 'w') as f:
-            for simbolo, direcciones in self.referencias_pendientes.items():
-                f.write(f"{simbolo}: {', '.join(hex(d) for d in direcciones)}\n")
 
 if __name__ == "__main__":
-    ensamblador = EnsambladorIA32()
-    ensamblador.ensamblar("programa.asm")
-
-    # Mostrar código generado en hexadecimal
-    print("Código máquina generado:")
-    print(" ".join(f"{byte:02X}" for byte in ensamblador.codigo_hex))
\ No newline at end of file
+    import ensambladorDosPasadas
+    # Se usa la clase del módulo importado (no la de __main__) para que los
+    # procesos del lote puedan recibirla
+    sys.exit(ensamblador.main(clase=ensambladorDosPasadas.EnsambladorIA32))
@@ -0,0 +1,162 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+import diferencial
+import emulador
+import ensamblador
+import paralelo
+
+# Pruebas de equivalencia entre caminos del ensamblador que deben dar lo
+# mismo, complemento de diferencial.py (que compara cada codificación con la
+# tabla de referencia):
+# - paralelo: EnsambladorParalelo contra la pasada única sobre el mismo
+#   archivo, cortado en muchos trozos. Se comparan código, tabla de
+#   símbolos, errores con su línea y referencias.txt.
+# - mirilla: cada motor con y sin -O ejecutado en el emulador desde los
+#   mismos registros iniciales. Los registros finales deben coincidir (las
+#   banderas no: la mirilla puede quitar instrucciones cuyas banderas nadie
+#   lee). Los saltos van sólo hacia adelante, así todo programa termina.
+
+PRUEBAS = ('paralelo', 'mirilla')
+TAM_TROZO = 512  # TAM_MINIMO_TROZO para la prueba: programas chicos en muchos trozos
+
+REGISTROS = emulador.REGISTROS
+INMEDIATOS_MIRILLA = (0, 0, 0, -1, 1, 5, 0x7F, 0x80, 0xFFFFFFFF)
+
+
+def programa_paralelo(aleatorio, formas, instrucciones):
+    # Flujo de diferencial.Generador sin memoria (combinar no reubica
+    # [etiqueta]) con algunas líneas que dan error: etiquetas sin definir,
+    # duplicadas e instrucciones inválidas, para comparar los diagnósticos
+    generador = diferencial.Generador(aleatorio, formas, sorted(ensamblador.OPERANDOS_REQUERIDOS), memoria=False)
+    lineas, _, _ = generador.flujo(instrucciones)
+    for _ in range(aleatorio.randrange(4)):
+        lineas.insert(aleatorio.randrange(len(lineas) + 1), aleatorio.choice((
+            f"    JNE nada{aleatorio.randrange(3)}", "L0:", "    FOO EAX", "    MOV EAX")))
+    return "\n".join(lineas) + "\n"
+
+
+def programa_mirilla(aleatorio, instrucciones):
+    # Sólo lo que el emulador ejecuta (registros de 32 bits), con muchos
+    # casos de las reglas de la mirilla: MOV r, 0, ADD r, 0, AND r, -1,
+    # MOV r, r, saltos a la etiqueta siguiente y cadenas de saltos
+    a = aleatorio
+    lineas = []
+    definidas = 0
+    maxima = -1
+    for _ in range(instrucciones):
+        r = a.random()
+        if r < 0.12:
+            lineas.append(f"L{definidas}:")
+            definidas += 1
+            if a.random() < 0.3:  # Cadena: la etiqueta sólo salta a otra
+                maxima = max(maxima, definidas + 1)
+                lineas.append(f"    JMP L{definidas + 1}")
+        elif r < 0.3:
+            destino = definidas + (0 if a.random() < 0.3 else a.randrange(4))
+            maxima = max(maxima, destino)
+            lineas.append(f"    {a.choice(('JMP', 'JE', 'JNE'))} L{destino}")
+        else:
+            mnemonico = a.choice(('MOV',) + tuple(ensamblador.GRUPO_ALU))
+            destino = a.choice(REGISTROS)
+            if a.random() < 0.4:
+                fuente = destino if a.random() < 0.3 else a.choice(REGISTROS)
+            else:
+                fuente = str(a.choice(INMEDIATOS_MIRILLA) if a.random() < 0.7 else a.randrange(1 << 32))
+            lineas.append(f"    {mnemonico} {destino}, {fuente}")
+    lineas.extend(f"L{numero}:" for numero in range(definidas, maxima + 1))
+    return "\n".join(lineas) + "\n"
+
+
+def resultado_archivo(motor, ruta, directorio):
+    motor.ensamblar(ruta, directorio_salida=directorio)
+    with open(os.path.join(directorio, 'referencias.txt')) as f:
+        referencias = f.read()
+    return (bytes(motor.codigo_hex), dict(motor.tabla_simbolos), motor.diagnosticos.errores, referencias)
+
+
+def verificar_paralelo(semilla, programas, instrucciones, procesos):
+    formas, _ = diferencial.tabla(diferencial.TABLA)
+    paralelo.TAM_MINIMO_TROZO = TAM_TROZO
+    fallos = []
+    trozos = 0
+    nombres = ('código', 'tabla de símbolos', 'errores', 'referencias.txt')
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, 'programa.asm')
+        for programa in range(programas):
+            aleatorio = random.Random(f"{semilla}:paralelo:{programa}")
+            with open(ruta, 'w') as f:
+                f.write(programa_paralelo(aleatorio, formas, instrucciones))
+            esperado = resultado_archivo(ensamblador.EnsambladorIA32(), ruta, directorio)
+            motor = paralelo.EnsambladorParalelo(procesos=procesos)
+            obtenido = resultado_archivo(motor, ruta, directorio)
+            trozos += motor.trozos
+            distintos = [nombre for nombre, x, y in zip(nombres, esperado, obtenido) if x != y]
+            if distintos:
+                fallos.append((programa, f"distinto: {', '.join(distintos)} ({motor.trozos} trozos)"))
+    return trozos, fallos
+
+
+def ejecutar(codigo, iniciales):
+    maquina = emulador.Emulador(codigo)
+    maquina.registros[:] = iniciales
+    maquina.ejecutar()
+    return maquina.registros
+
+
+def verificar_mirilla(semilla, programas, instrucciones):
+    fallos = []
+    ahorrado = 0
+    for programa in range(programas):
+        aleatorio = random.Random(f"{semilla}:mirilla:{programa}")
+        fuente = programa_mirilla(aleatorio, instrucciones)
+        iniciales = [aleatorio.randrange(1 << 32) for _ in REGISTROS]
+        for nombre, clase in diferencial.MOTORES.items():
+            resultados = []
+            for optimizar in (False, True):
+                motor = clase()
+                motor.optimizar = optimizar
+                resultado = motor.ensamblar_texto(fuente)
+                if resultado.errores:
+                    fallos.append((programa, f"{nombre}{' -O' if optimizar else ''}: {resultado.errores[0]}"))
+                    break
+                resultados.append(ejecutar(resultado.codigo, iniciales))
+            else:
+                ahorrado += motor.mirilla.ahorrado
+                if resultados[0] != resultados[1]:
+                    distintos = [r for r, x, y in zip(REGISTROS, *resultados) if x != y]
+                    fallos.append((programa, f"{nombre} -O: registros distintos ({', '.join(distintos)})"))
+    return ahorrado, fallos
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Equivalencia de paralelo y -O con los caminos de referencia")
+    parser.add_argument('-n', '--programas', type=int, default=200, help="programas por prueba")
+    parser.add_argument('--instrucciones', type=int, default=400, help="instrucciones por programa")
+    parser.add_argument('-j', '--procesos', type=int, default=4, help="procesos de EnsambladorParalelo")
+    parser.add_argument('--pruebas', nargs='+', default=list(PRUEBAS), choices=PRUEBAS)
+    parser.add_argument('--semilla', default='0')
+    parser.add_argument('--mostrar', type=int, default=10, help="fallos a mostrar")
+    args = parser.parse_args(argv)
+
+    total_fallos = 0
+    for prueba in args.pruebas:
+        if prueba == 'paralelo':
+            trozos, fallos = verificar_paralelo(args.semilla, args.programas, args.instrucciones,
+                                                max(2, args.procesos))
+            resumen = f"{trozos} trozos"
+        else:
+            ahorrado, fallos = verificar_mirilla(args.semilla, args.programas, args.instrucciones)
+            resumen = f"{ahorrado} bytes ahorrados por -O"
+        for programa, detalle in fallos[:args.mostrar]:
+            print(f"{prueba}: programa {programa}: {detalle}", file=sys.stderr)
+        print(f"{prueba}: {args.programas} programas, {len(fallos)} fallos, {resumen}")
+        total_fallos += len(fallos)
+    return 1 if total_fallos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+from ensamblador import ETQ, GRUPO_ALU, IMM, REG, SALTOS
+
+MASCARA = 0xFFFFFFFF
+VENTANA = 8  # Instrucciones retenidas como máximo esperando saber si se usan las banderas
+
+# Escriben todas las banderas sin leerlas. Cualquier otra instrucción que no
+# sea MOV (ADC/SBB y Jcc las leen, JMP las lleva a otro lado, las desconocidas
+# no se sabe) se toma como uso de las banderas.
+ESCRIBEN_BANDERAS = frozenset(mnemonico for mnemonico in GRUPO_ALU if mnemonico not in ('ADC', 'SBB'))
+
+
+def mismo_registro(operandos):
+    return operandos[0][1] == operandos[1][1]
+
+
+# Las condiciones comparan el valor escrito, sin truncar: un inmediato fuera
+# de rango (0x100000000) no se toma como 0 y llega al generador, que da el error
+def es_cero(operandos):
+    return operandos[1][1] == 0
+
+
+def todos_unos(operandos):
+    return operandos[1][1] in (-1, MASCARA)
+
+
+def xor_consigo(operandos):
+    return 'XOR', (operandos[0], operandos[0]), (REG, REG)
+
+
+# Reglas de la mirilla: (mnemonico, tipos) -> (nombre, condición, reemplazo,
+# requiere banderas muertas, bytes ahorrados). Reemplazo None elimina la
+# instrucción. Los bytes son los de la codificación que elegiría el
+# ensamblador: MOV r, imm32 ocupa 5 y XOR r, r 2; ALU r, 0 y AND r, -1 van
+# en la forma 83 /digit ib, de 3.
+REGLAS = {
+    ('MOV', (REG, REG)): ('mov_mismo_registro', mismo_registro, None, False, 2),
+    ('MOV', (REG, IMM)): ('mov_cero_a_xor', es_cero, xor_consigo, True, 3),
+    ('AND', (REG, IMM)): ('alu_neutro', todos_unos, None, True, 3),
+}
+for _mnemonico in ('ADD', 'OR', 'SUB', 'XOR'):
+    REGLAS[(_mnemonico, (REG, IMM))] = ('alu_neutro', es_cero, None, True, 3)
+del _mnemonico
+
+
+class Mirilla:
+    # Optimización de mirilla entre la tokenización y los generadores: recibe
+    # las instrucciones ya clasificadas (mnemonico, operandos, tipos) y las
+    # pasa a procesar_instruccion, reescritas según REGLAS. Las reglas que
+    # cambian las banderas esperan en `pendientes` hasta ver si alguien las
+    # lee; ante la duda (etiqueta, salto, fin del fuente, ventana llena) la
+    # instrucción queda como estaba. Como nada se emite hasta decidir, las
+    # etiquetas siempre reciben la dirección del código ya reescrito.
+    def __init__(self, ensamblador, saltos=True):
+        self.ensamblador = ensamblador
+        self.saltos = saltos  # Eliminar el salto a la etiqueta que le sigue
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.pendientes = []  # [(linea, mnemonico, operandos, tipos, regla)]
+        self.indecisas = 0  # Pendientes con una regla que depende de las banderas
+        self.lineas_diferidas = []  # Líneas del listado que empezaron con pendientes
+        self.ahorrado = 0  # Bytes ahorrados
+        self.aplicadas = {}  # {nombre de regla: veces}
+
+    def contar(self, nombre, ahorrado):
+        self.aplicadas[nombre] = self.aplicadas.get(nombre, 0) + 1
+        self.ahorrado += ahorrado
+
+    def instruccion(self, mnemonico, operandos, tipos):
+        regla = REGLAS.get((mnemonico, tipos))
+        if regla is not None and not regla[1](operandos):
+            regla = None
+        if regla is not None and not regla[3]:
+            # No depende de las banderas: se aplica ya
+            self.contar(regla[0], regla[4])
+            if regla[2] is None:
+                return
+            mnemonico, operandos, tipos = regla[2](operandos)
+            regla = None
+
+        if mnemonico in ESCRIBEN_BANDERAS:
+            # Se quede o se elimine, después de ésta las banderas anteriores ya no se leen
+            self.vaciar(muertas=True)
+        elif mnemonico != 'MOV':
+            self.vaciar()
+        self.pendientes.append((self.ensamblador.numero_linea, mnemonico, operandos, tipos, regla))
+        if regla is not None:
+            self.indecisas += 1
+        elif self.saltos and mnemonico in SALTOS and tipos == (ETQ,):
+            return  # Espera a ver si la siguiente línea es su etiqueta
+        if not self.indecisas or len(self.pendientes) > VENTANA:
+            self.vaciar()
+
+    def etiqueta(self, etiqueta):
+        # Un salto seguido de su propia etiqueta no hace nada: se elimina
+        if self.pendientes:
+            _, mnemonico, operandos, tipos, _ = self.pendientes[-1]
+            if (mnemonico in SALTOS and tipos == (ETQ,) and operandos[0][1] == etiqueta
+                    and etiqueta not in self.ensamblador.tabla_simbolos):
+                self.pendientes.pop()
+                self.contar('salto_a_siguiente', len(SALTOS[mnemonico][1]) + 4)  # Forma rel32 hacia adelante
+            self.vaciar()
+        self.ensamblador.procesar_etiqueta(etiqueta)
+
+    def vaciar(self, muertas=False):
+        # Emite las pendientes; con `muertas` aplica las reglas que esperaban
+        # saber que las banderas no se usan. Las líneas del listado que se
+        # anotaron mientras había pendientes se anotan ahora, en su lugar.
+        if not self.pendientes and not self.lineas_diferidas:
+            return
+        ensamblador = self.ensamblador
+        linea = ensamblador.numero_linea
+        diferidas = self.lineas_diferidas
+        d = 0
+        for numero, mnemonico, operandos, tipos, regla in self.pendientes:
+            while d < len(diferidas) and diferidas[d] <= numero:
+                ensamblador.anotar(diferidas[d])
+                d += 1
+            if regla is not None and muertas:
+                self.contar(regla[0], regla[4])
+                if regla[2] is None:
+                    continue
+                mnemonico, operandos, tipos = regla[2](operandos)
+            ensamblador.numero_linea = numero
+            ensamblador.procesar_instruccion(mnemonico, operandos, tipos)
+        for numero in diferidas[d:]:
+            ensamblador.anotar(numero)
+        ensamblador.numero_linea = linea
+        self.pendientes.clear()
+        diferidas.clear()
+        self.indecisas = 0
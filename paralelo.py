@@ -0,0 +1,187 @@
+import mmap
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import ensamblador
+import ensambladorDosPasadas
+from ensamblador import BufferCodigo, ETQ, LINEA_BYTES, LINEA_DIRECTIVA_BYTES, SALTOS
+
+# Opcode de la forma corta -> (opcode corto, prefijo rel32), como en SALTOS
+FORMAS_POR_OPCODE = {corto: (corto, cercano) for corto, cercano in SALTOS.values()}
+
+TAM_MINIMO_TROZO = 1 << 20  # Archivos con menos de dos trozos de este tamaño van en secuencia
+VENTANA_ETIQUETA = 4096  # Líneas que se buscan hacia adelante para cortar en una etiqueta
+
+
+class EnsambladorTrozo(ensambladorDosPasadas.EnsambladorIA32):
+    # Primera pasada del ensamblador de dos pasadas sobre un tramo del
+    # archivo. Todo lo que no es salto queda codificado en codigo_fijo
+    # relativo al inicio del trozo; los saltos y etiquetas quedan aparte,
+    # con su línea, para que la combinación los resuelva en orden global.
+    def reiniciar(self):
+        super().reiniciar()
+        self.etiquetas_linea = array('I')  # Línea (local al trozo) de cada etiqueta
+
+    def procesar_etiqueta(self, etiqueta):
+        definidas = len(self.etiquetas)
+        super().procesar_etiqueta(etiqueta)
+        if len(self.etiquetas) > definidas:
+            self.etiquetas_linea.append(self.numero_linea)
+
+
+def ensamblar_trozo(archivo, inicio, fin):
+    # Se ejecuta en un proceso del pool: mapea el archivo y procesa sólo
+    # las líneas entre inicio y fin
+    trozo = EnsambladorTrozo()
+    with open(archivo, 'rb') as f:
+        datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with datos:
+        for linea_inicio, linea_fin in trozo.leer_lineas_mapeadas(datos, inicio, fin):
+            trozo.numero_linea += 1
+            trozo.procesar_linea_bytes(datos, linea_inicio, linea_fin)
+    return (trozo.codigo_fijo, trozo.saltos_posicion, trozo.saltos_opcode, trozo.saltos_etiqueta,
+            trozo.saltos_linea, trozo.etiquetas.nombres, trozo.etiquetas.direcciones,
+            trozo.etiquetas_saltos, trozo.etiquetas_linea, trozo.diagnosticos.errores, trozo.numero_linea)
+
+
+def inicio_de_linea(datos, posicion):
+    # Primera línea que empieza en o después de `posicion`
+    if posicion == 0:
+        return 0
+    salto = datos.find(b'\n', posicion - 1)
+    return len(datos) if salto < 0 else salto + 1
+
+
+def corte_en_etiqueta(datos, posicion):
+    # Inicio de la primera línea con etiqueta a partir de `posicion`; si no
+    # hay ninguna cerca, el inicio de la primera línea
+    corte = inicio = inicio_de_linea(datos, posicion)
+    total = len(datos)
+    for _ in range(VENTANA_ETIQUETA):
+        if inicio >= total:
+            break
+        fin = datos.find(b'\n', inicio)
+        if fin < 0:
+            fin = total
+        partes = LINEA_BYTES.match(datos, inicio, fin)
+        if partes is not None and partes.group(1) is not None:
+            return inicio
+        inicio = fin + 1
+    return corte
+
+
+class EnsambladorParalelo(ensamblador.EnsambladorIA32):
+    # Ensambla un archivo grande repartiéndolo en trozos que se cortan en
+    # etiquetas y se codifican en paralelo (EnsambladorTrozo). La
+    # combinación recorre los trozos en orden reubicándolos y aplica la
+    # misma regla que la pasada única a cada etiqueta y salto, así que el
+    # resultado es idéntico byte a byte al de ensamblador.EnsambladorIA32.
+    def __init__(self, diagnosticos=None, perfilador=None, procesos=None):
+        super().__init__(diagnosticos, perfilador)
+        self.procesos = procesos if procesos is not None else os.cpu_count()
+
+    def reiniciar(self):
+        super().reiniciar()
+        self.trozos = 0  # Trozos usados en el último ensamblado (0: en secuencia)
+
+    def ensamblar(self, archivo_entrada, limite_memoria=None, directorio_salida='.'):
+        tramos = self.dividir(archivo_entrada)
+        if tramos is None:
+            super().ensamblar(archivo_entrada, limite_memoria, directorio_salida)
+            return
+        if limite_memoria is not None:
+            self.codigo_hex = BufferCodigo(limite_memoria)
+        self.abrir_referencias(directorio_salida)
+
+        self.trozos = len(tramos)
+        inicios, fines = zip(*tramos)
+        with ProcessPoolExecutor(max_workers=min(self.procesos, len(tramos))) as ejecutor:
+            # map entrega en orden: cada trozo se combina apenas llega
+            for trozo in ejecutor.map(ensamblar_trozo, repeat(archivo_entrada), inicios, fines):
+                self.combinar(*trozo)
+
+        self.finalizar()
+        self.generar_reportes(directorio_salida)
+
+    def dividir(self, archivo_entrada):
+        # Tramos (inicio, fin) del archivo, o None si conviene ir en
+        # secuencia: archivo chico, un solo proceso, modo detallado (los
+        # eventos deben salir en orden), listado (se anota línea a línea),
+        # mirilla (mira entre líneas vecinas), fuente que no se puede mapear,
+        # que necesita el preprocesador (las macros cruzan los trozos) o con
+        # operandos de memoria ([etiqueta] lleva direcciones absolutas que
+        # combinar no reubica)
+        if (self.procesos <= 1 or self.detallado or self.listado or self.optimizar
+                or not self.entrada_mapeada):
+            return None
+        try:
+            with open(archivo_entrada, 'rb') as f:
+                datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return None
+        with datos:
+            total = len(datos)
+            partes = min(self.procesos * 4, total // TAM_MINIMO_TROZO)
+            if partes < 2 or datos.find(b'[') >= 0 \
+                    or (self.preprocesar and LINEA_DIRECTIVA_BYTES.search(datos) is not None):
+                return None
+            cortes = [0]
+            for i in range(1, partes):
+                corte = corte_en_etiqueta(datos, total * i // partes)
+                if cortes[-1] < corte < total:
+                    cortes.append(corte)
+            cortes.append(total)
+        return list(zip(cortes, cortes[1:]))
+
+    def combinar(self, codigo_fijo, saltos_posicion, saltos_opcode, saltos_etiqueta, saltos_linea,
+                 etiquetas, etiquetas_posicion, etiquetas_saltos, etiquetas_linea, errores, lineas):
+        # Intercala el código fijo del trozo con sus etiquetas y saltos en
+        # orden de fuente. procesar_etiqueta y generar_salto son los de la
+        # pasada única: detectan duplicados contra todo lo anterior, eligen
+        # la forma corta sólo si el destino ya está definido y alcanza, y
+        # parchan las referencias hacia adelante al definirse la etiqueta.
+        # Los errores del trozo se reportan intercalados por línea.
+        base = self.numero_linea
+        fijo = memoryview(codigo_fijo)
+        errores = [(base + linea, mensaje) for linea, mensaje in errores]
+        errores.reverse()
+        emitir, error = self.emitir, self.diagnosticos.error
+        procesar_etiqueta, generar_salto = self.procesar_etiqueta, self.generar_salto
+        n_saltos, n_etiquetas = len(saltos_posicion), len(etiquetas)
+        anterior = 0
+        e = 0
+        for k in range(n_saltos + 1):
+            while e < n_etiquetas and etiquetas_saltos[e] <= k:
+                posicion = etiquetas_posicion[e]
+                if posicion != anterior:
+                    emitir(fijo[anterior:posicion])
+                    anterior = posicion
+                self.numero_linea = linea = base + etiquetas_linea[e]
+                while errores and errores[-1][0] < linea:
+                    error(*errores.pop())
+                procesar_etiqueta(etiquetas[e])
+                e += 1
+            if k == n_saltos:
+                break
+            posicion = saltos_posicion[k]
+            if posicion != anterior:
+                emitir(fijo[anterior:posicion])
+                anterior = posicion
+            self.numero_linea = linea = base + saltos_linea[k]
+            while errores and errores[-1][0] <= linea:
+                error(*errores.pop())
+            generar_salto(None, FORMAS_POR_OPCODE[saltos_opcode[k]], ((ETQ, saltos_etiqueta[k]),))
+        emitir(fijo[anterior:])
+        fijo.release()
+        while errores:
+            error(*errores.pop())
+        self.numero_linea = base + lineas
+
+
+if __name__ == "__main__":
+    import paralelo
+    # Como en ensambladorDosPasadas: la clase del módulo importado, no la de __main__
+    sys.exit(ensamblador.main(clase=paralelo.EnsambladorParalelo))
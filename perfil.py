@@ -0,0 +1,131 @@
+import json
+import marshal
+from time import perf_counter_ns
+
+# Fases que se miden si el ensamblador las tiene. Los generadores de la tabla
+# de despacho (generar_reg_reg, generar_alu_imm, ...) se agregan solos.
+FASES = (
+    'ensamblar',
+    'ensamblar_texto',
+    'leer_lineas',
+    'leer_lineas_mapeadas',
+    'procesar_linea',
+    'procesar_linea_bytes',
+    'procesar_inclusion',
+    'procesar_etiqueta',
+    'procesar_instruccion',
+    'relajar_saltos',
+    'calcular_direcciones',
+    'segunda_pasada',
+    'resolver_referencias_pendientes',
+    'generar_tabla_simbolos',
+    'generar_referencias_pendientes',
+)
+
+
+class Perfilador:
+    # Cuenta llamadas y tiempo por fase de un EnsambladorIA32. No hay ningún
+    # costo si no se usa: instrumentar() reemplaza los métodos sólo en la
+    # instancia indicada. Se guarda el tiempo total (incluye las fases
+    # anidadas) y el propio; el propio de procesar_linea (o procesar_linea_bytes
+    # con la entrada mapeada) es la tokenización.
+    def __init__(self, limite_eventos=100_000):
+        self.fases = {}  # {fase: [llamadas, total_ns, propio_ns]}
+        self.llamadores = {}  # {(padre, fase): [llamadas, total_ns, propio_ns]}
+        self.claves = {}  # {fase: (archivo, linea, nombre)} para el formato pstats
+        self.pila = []  # [fase, inicio, ns de las fases hijas]
+        self.eventos = []  # Para el trace de Chrome: (fase, inicio, duración)
+        self.limite_eventos = limite_eventos
+        self.origen = perf_counter_ns()
+
+    def instrumentar(self, ensamblador):
+        for fase in FASES:
+            metodo = getattr(ensamblador, fase, None)
+            if metodo is None:
+                continue
+            self.registrar_clave(fase, metodo)
+            if fase in ('leer_lineas', 'leer_lineas_mapeadas'):
+                setattr(ensamblador, fase, self.envolver_lectura(fase, metodo))
+            else:
+                setattr(ensamblador, fase, self.envolver(fase, metodo))
+        for clave, (metodo, argumento) in ensamblador.despacho.items():
+            fase = metodo.__name__
+            self.registrar_clave(fase, metodo)
+            ensamblador.despacho[clave] = (self.envolver(fase, metodo), argumento)
+        return ensamblador
+
+    def registrar_clave(self, fase, metodo):
+        codigo = metodo.__code__
+        self.claves[fase] = (codigo.co_filename, codigo.co_firstlineno, fase)
+
+    def entrar(self, fase):
+        self.pila.append([fase, perf_counter_ns(), 0])
+
+    def salir(self):
+        fase, inicio, hijos = self.pila.pop()
+        total = perf_counter_ns() - inicio
+        padre = self.pila[-1][0] if self.pila else None
+        if self.pila:
+            self.pila[-1][2] += total
+        for tabla, clave in ((self.fases, fase), (self.llamadores, (padre, fase))):
+            acumulado = tabla.get(clave)
+            if acumulado is None:
+                acumulado = tabla[clave] = [0, 0, 0]
+            acumulado[0] += 1
+            acumulado[1] += total
+            acumulado[2] += total - hijos
+        if len(self.eventos) < self.limite_eventos:
+            self.eventos.append((fase, inicio - self.origen, total))
+
+    def envolver(self, fase, funcion):
+        def envoltura(*args, **kwargs):
+            self.entrar(fase)
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                self.salir()
+        return envoltura
+
+    def envolver_lectura(self, fase, funcion):
+        # Sólo se mide el tiempo dentro de cada next(): el procesamiento de la
+        # línea ocurre fuera y se atribuye a su propia fase
+        def envoltura(*args, **kwargs):
+            iterador = iter(funcion(*args, **kwargs))
+            while True:
+                self.entrar(fase)
+                try:
+                    linea = next(iterador)
+                except StopIteration:
+                    return
+                finally:
+                    self.salir()
+                yield linea
+        return envoltura
+
+    def resumen(self):
+        filas = [f"{'fase':34} {'llamadas':>10} {'total ms':>11} {'propio ms':>11}"]
+        for fase, (llamadas, total, propio) in sorted(self.fases.items(), key=lambda f: -f[1][2]):
+            filas.append(f"{fase:34} {llamadas:>10} {total / 1e6:>11.2f} {propio / 1e6:>11.2f}")
+        return "\n".join(filas)
+
+    def guardar_chrome_trace(self, ruta):
+        # Formato "Trace Event" (chrome://tracing, Perfetto); tiempos en µs.
+        # Sólo se guardan los primeros limite_eventos; los totales van aparte.
+        eventos = [{"name": fase, "ph": "X", "ts": inicio / 1000, "dur": duracion / 1000,
+                    "pid": 0, "tid": 0} for fase, inicio, duracion in self.eventos]
+        with open(ruta, 'w') as f:
+            json.dump({"traceEvents": eventos, "displayTimeUnit": "ms",
+                       "otherData": {fase: {"llamadas": n, "total_ms": t / 1e6, "propio_ms": p / 1e6}
+                                     for fase, (n, t, p) in self.fases.items()}}, f)
+
+    def guardar_pstats(self, ruta):
+        # Mismo formato que cProfile.Profile.dump_stats: pstats.Stats(ruta) lo lee
+        estadisticas = {}
+        for fase, (llamadas, total, propio) in self.fases.items():
+            estadisticas[self.claves[fase]] = (llamadas, llamadas, propio / 1e9, total / 1e9, {})
+        for (padre, fase), (llamadas, total, propio) in self.llamadores.items():
+            if padre is not None:
+                estadisticas[self.claves[fase]][4][self.claves[padre]] = (
+                    llamadas, llamadas, propio / 1e9, total / 1e9)
+        with open(ruta, 'wb') as f:
+            marshal.dump(estadisticas, f)
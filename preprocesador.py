@@ -0,0 +1,242 @@
+import os
+import re
+
+# Directiva: %nombre [argumentos] [; comentario]
+DIRECTIVA = re.compile(r'\s*%(\w+)(?:[ \t]+([^;]*?))?\s*(?:;.*)?$')
+# Posible invocación de macro: [etiqueta:] nombre [argumentos] [; comentario]
+INVOCACION = re.compile(r'\s*(?:([^\s:;,%]+)\s*:)?\s*([A-Za-z_.][\w.]*)(?:[ \t]+([^;]*?))?\s*(?:;.*)?$')
+# Dentro del cuerpo de una macro: %%local, %N (parámetro) y %0 (número de argumentos)
+PARAMETRO = re.compile(r'%%([\w.]+)|%(\d+)')
+NOMBRE = re.compile(r'[A-Za-z_.][\w.]*$')
+
+LIMITE_ANIDAMIENTO = 32  # Macros e %include anidados como máximo
+LOCAL = -1  # Marca en el cuerpo compilado: prefijo único de la invocación
+
+# Contenido de los archivos incluidos: (ruta, mtime, tamaño) -> tupla de líneas.
+# Un archivo incluido muchas veces (o en muchos trabajos) se lee una sola vez.
+CACHE_ARCHIVOS = {}
+LIMITE_CACHE_ARCHIVOS = 256
+
+
+def firma(ruta):
+    info = os.stat(ruta)
+    return ruta, info.st_mtime_ns, info.st_size
+
+
+def leer_incluido(ruta):
+    clave = firma(ruta)
+    lineas = CACHE_ARCHIVOS.get(clave)
+    if lineas is None:
+        with open(ruta, 'r') as f:
+            lineas = tuple(f.read().splitlines())
+        if len(CACHE_ARCHIVOS) >= LIMITE_CACHE_ARCHIVOS:
+            CACHE_ARCHIVOS.clear()
+        CACHE_ARCHIVOS[clave] = lineas
+    return clave, lineas
+
+
+def compilar_linea(linea):
+    # Parte una línea del cuerpo en literales, parámetros (int) y prefijos
+    # locales (LOCAL seguido del nombre) para sustituir con un solo join.
+    # También devuelve su primera palabra si es fija (no es parámetro ni
+    # directiva): si no es una macro, la línea expandida sale sin reprocesar
+    cabeza = None
+    if not linea.lstrip().startswith('%'):
+        invocacion = INVOCACION.match(linea)
+        if invocacion is not None and '%' not in linea[:invocacion.end(2)]:
+            cabeza = invocacion.group(2).upper()
+    partes = []
+    inicio = 0
+    for parametro in PARAMETRO.finditer(linea):
+        partes.append(linea[inicio:parametro.start()])
+        local, numero = parametro.groups()
+        if local is not None:
+            partes += (LOCAL, local)
+        else:
+            partes.append(int(numero))
+        inicio = parametro.end()
+    partes.append(linea[inicio:])
+    return tuple(parte for parte in partes if parte != ''), cabeza
+
+
+class Inclusion:
+    # Un %include ya resuelto. `clave` identifica el archivo y el estado del
+    # preprocesador al incluirlo: con la misma clave la expansión es la misma.
+    # `puro` queda en False si la expansión cambia ese estado (%define,
+    # %macro), y entonces su resultado no se puede reutilizar.
+    def __init__(self, preprocesador, ruta, clave, lineas, numero, profundidad):
+        self.preprocesador = preprocesador
+        self.ruta = ruta
+        self.clave = clave
+        self.contenido = lineas
+        self.numero = numero  # Línea del archivo principal que la originó
+        self.profundidad = profundidad
+        self.puro = True
+
+    def lineas(self):
+        # Genera las líneas (str) o Inclusion anidadas del archivo, bajo demanda
+        return self.preprocesador.expandir_inclusion(self)
+
+
+class Preprocesador:
+    # Etapa previa a procesar_linea: %include, %macro/%endmacro y %define.
+    # Todo es perezoso: expandir() genera una línea a la vez, y una macro
+    # invocada un millón de veces se expande invocación por invocación sin
+    # materializar nunca el resultado. Los errores se reportan con `error`
+    # (linea, mensaje), con el número de línea del archivo principal.
+    def __init__(self, error=None):
+        self.error = error if error is not None else (lambda linea, mensaje: None)
+        self.definiciones = {}  # {nombre: valor}
+        self.patron = None  # Regex con todos los nombres definidos
+        self.macros = {}  # {NOMBRE: (parametros, cuerpo compilado)}
+        self.definiendo = None  # (nombre, parametros, cuerpo, linea) dentro de %macro
+        self.version = 0  # Cambia con cada %define o %macro
+        self.invocaciones = 0  # Para los prefijos únicos de %%local
+        self.pila = []  # Inclusion en curso, de la más externa a la más interna
+        self.rutas = []  # Rutas en curso, para detectar inclusiones circulares
+        self.incluidos = {}  # {ruta: firma} de todo lo incluido, para invalidar caches
+
+    def expandir(self, lineas, ruta):
+        # Genera (número de línea, línea o Inclusion) a partir de las líneas
+        # del archivo principal `ruta`
+        self.rutas.append(os.path.abspath(ruta))
+        directorio = os.path.dirname(self.rutas[-1])
+        for numero, linea in enumerate(lineas, 1):
+            for resultado in self.procesar(numero, linea, directorio, 0):
+                yield numero, resultado
+        self.rutas.pop()
+        if self.definiendo is not None:
+            self.error(self.definiendo[3], f"%macro '{self.definiendo[0]}' sin %endmacro")
+            self.definiendo = None
+
+    def procesar(self, numero, linea, directorio, profundidad):
+        # Devuelve lo que produce una línea: nada, la línea misma (con los
+        # %define sustituidos), una Inclusion o la expansión de una macro
+        if self.definiendo is not None:
+            self.definir_linea(numero, linea)
+            return ()
+        if '%' in linea:
+            directiva = DIRECTIVA.match(linea)
+            if directiva is not None:
+                nombre, argumentos = directiva.groups()
+                return self.directiva(numero, nombre.lower(), argumentos or '', directorio, profundidad)
+        if self.macros:
+            invocacion = INVOCACION.match(linea)
+            if invocacion is not None and invocacion.group(2).upper() in self.macros:
+                return self.expandir_macro(numero, *invocacion.groups(), directorio, profundidad)
+        if self.patron is not None:
+            linea = self.patron.sub(self.sustituir, linea)
+        return (linea,)
+
+    def sustituir(self, nombre):
+        return self.definiciones[nombre.group()]
+
+    def directiva(self, numero, nombre, argumentos, directorio, profundidad):
+        if nombre == 'include':
+            return self.incluir(numero, argumentos, directorio, profundidad)
+        for inclusion in self.pila:  # El estado cambia: nada de lo que está en curso es reutilizable
+            inclusion.puro = False
+        if nombre == 'define':
+            partes = argumentos.split(None, 1)
+            if not partes or NOMBRE.match(partes[0]) is None:
+                self.error(numero, f"%define inválido '{argumentos}'")
+                return ()
+            valor = partes[1] if len(partes) > 1 else ''
+            if self.patron is not None:
+                valor = self.patron.sub(self.sustituir, valor)
+            self.definiciones[partes[0]] = valor
+            # Los nombres más largos primero para que 'AB' no se tome como 'A'
+            nombres = sorted(self.definiciones, key=len, reverse=True)
+            self.patron = re.compile(r'(?<![\w.])(?:' + '|'.join(map(re.escape, nombres)) + r')(?![\w.])')
+            self.version += 1
+        elif nombre == 'macro':
+            partes = argumentos.split()
+            if len(partes) not in (1, 2) or NOMBRE.match(partes[0]) is None \
+                    or (len(partes) == 2 and not partes[1].isdigit()):
+                self.error(numero, f"%macro inválida '{argumentos}'")
+                partes = ['', '0']  # Se lee el cuerpo igual, hasta %endmacro
+            self.definiendo = (partes[0], int(partes[1]) if len(partes) == 2 else 0, [], numero)
+        elif nombre == 'endmacro':
+            self.error(numero, "%endmacro sin %macro")
+        else:
+            self.error(numero, f"directiva '%{nombre}' desconocida")
+        return ()
+
+    def definir_linea(self, numero, linea):
+        directiva = DIRECTIVA.match(linea) if '%' in linea else None
+        nombre = directiva.group(1).lower() if directiva is not None else None
+        if nombre == 'endmacro':
+            macro, parametros, cuerpo, inicio = self.definiendo
+            self.definiendo = None
+            usados = max((p for partes, _ in cuerpo for p in partes if p.__class__ is int), default=0)
+            if usados > parametros:
+                self.error(inicio, f"la macro '{macro}' usa %{usados} pero tiene {parametros} parámetros")
+            elif macro:
+                self.macros[macro.upper()] = (parametros, tuple(cuerpo))
+                self.version += 1
+        elif nombre == 'macro':
+            self.error(numero, "no se permiten %macro anidadas")
+        else:
+            self.definiendo[2].append(compilar_linea(linea))
+
+    def expandir_macro(self, numero, etiqueta, nombre, argumentos, directorio, profundidad):
+        parametros, cuerpo = self.macros[nombre.upper()]
+        valores = [a.strip() for a in argumentos.split(',')] if argumentos else []
+        if len(valores) != parametros:
+            self.error(numero, f"la macro '{nombre}' requiere {parametros} argumento"
+                               f"{'s' if parametros != 1 else ''}")
+            return
+        if profundidad >= LIMITE_ANIDAMIENTO:
+            self.error(numero, f"demasiados niveles de macros al expandir '{nombre}'")
+            return
+        if etiqueta is not None:
+            yield f"{etiqueta}:"
+        self.invocaciones += 1
+        valores.insert(0, str(parametros))  # %0
+        local = f"..@{self.invocaciones}."
+        macros = self.macros
+        for partes, cabeza in cuerpo:
+            linea = ''.join([p if p.__class__ is str else local if p == LOCAL else valores[p]
+                             for p in partes])
+            if cabeza is None or cabeza in macros or self.patron is not None or self.definiendo is not None:
+                yield from self.procesar(numero, linea, directorio, profundidad + 1)
+            else:
+                yield linea
+
+    def incluir(self, numero, argumentos, directorio, profundidad):
+        nombre = argumentos.strip().strip('"\'<>')
+        if not nombre:
+            self.error(numero, "%include sin archivo")
+            return ()
+        ruta = os.path.abspath(os.path.join(directorio, nombre))
+        if not os.path.isfile(ruta) and os.path.isfile(nombre):
+            ruta = os.path.abspath(nombre)
+        if ruta in self.rutas:
+            self.error(numero, f"inclusión circular de '{nombre}'")
+            return ()
+        if profundidad >= LIMITE_ANIDAMIENTO:
+            self.error(numero, f"demasiados niveles de %include al incluir '{nombre}'")
+            return ()
+        try:
+            clave, lineas = leer_incluido(ruta)
+        except OSError as e:
+            self.error(numero, f"no se pudo incluir '{nombre}': {e.strerror}")
+            return ()
+        self.incluidos[ruta] = clave
+        return (Inclusion(self, ruta, (clave, self.version), lineas, numero, profundidad + 1),)
+
+    def expandir_inclusion(self, inclusion):
+        # El número de línea de todo lo incluido es el del %include
+        numero = inclusion.numero
+        directorio = os.path.dirname(inclusion.ruta)
+        self.pila.append(inclusion)
+        self.rutas.append(inclusion.ruta)
+        try:
+            for linea in inclusion.contenido:
+                yield from self.procesar(numero, linea, directorio, inclusion.profundidad)
+        finally:
+            self.rutas.pop()
+            self.pila.pop()
+        if self.definiendo is not None:  # Una %macro no puede cruzar el fin del archivo
+            self.error(self.definiendo[3], f"%macro '{self.definiendo[0]}' sin %endmacro")
+            self.definiendo = None
@@ -0,0 +1,155 @@
+import struct
+
+# Escritores del código generado. Cada uno recibe el buffer completo
+# (bytearray o BufferCodigo) y lo recorre por bloques, sin formatear byte a
+# byte ni copiar a memoria un código que se volcó a disco.
+# `reubicaciones` son las posiciones de los campos de 32 bits que guardan una
+# dirección de .text ([etiqueta]); sólo ELF las necesita, el resto supone el
+# código cargado en la dirección 0.
+
+
+TAM_BLOQUE = 1 << 20  # Bytes de código por bloque al escribir
+
+
+def bloques(codigo, tamano=TAM_BLOQUE):
+    # Rebanadas sin copia si el código está en memoria; si se volcó a disco
+    # (BufferCodigo) se lee del temporal de a un bloque
+    if hasattr(codigo, 'bloques'):
+        return codigo.bloques(tamano=tamano)
+    datos = memoryview(codigo)
+    return (datos[inicio:inicio + tamano] for inicio in range(0, len(datos), tamano))
+
+
+def escribir_binario(codigo, tabla_simbolos, ruta, reubicaciones=()):
+    # Imagen plana: los bytes tal cual, cargables en la dirección 0
+    with open(ruta, 'wb') as f:
+        f.writelines(bloques(codigo))
+
+
+def registro_hex(tipo, direccion, datos):
+    # :LLAAAATT<datos>CC, con CC el complemento a dos de la suma de los bytes
+    cabecera = bytes((len(datos), (direccion >> 8) & 0xFF, direccion & 0xFF, tipo))
+    suma = sum(cabecera) + sum(datos)
+    return f":{cabecera.hex()}{bytes(datos).hex()}{(-suma) & 0xFF:02x}\n".upper()
+
+
+def escribir_intel_hex(codigo, tabla_simbolos, ruta, reubicaciones=(), bytes_por_registro=16):
+    # Un write por bloque de código; el bloque es múltiplo del registro para
+    # que ningún registro quede partido
+    segmento = None
+    base = 0
+    with open(ruta, 'w') as f:
+        for bloque in bloques(codigo, bytes_por_registro * (TAM_BLOQUE // bytes_por_registro)):
+            registros = []
+            for desde in range(0, len(bloque), bytes_por_registro):
+                inicio = base + desde
+                alto = inicio >> 16
+                if alto != segmento:  # Registro 04: dirección lineal extendida
+                    registros.append(registro_hex(0x04, 0, struct.pack('>H', alto)))
+                    segmento = alto
+                registros.append(registro_hex(0x00, inicio & 0xFFFF, bloque[desde:desde + bytes_por_registro]))
+            f.write("".join(registros))
+            base += len(bloque)
+        f.write(":00000001FF\n")
+
+
+# Constantes de ELF32 usadas por escribir_elf32
+ET_REL = 1
+EM_386 = 3
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_REL = 9
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+STT_NOTYPE = 0
+STT_SECTION = 3
+STB_LOCAL = 0
+R_386_32 = 1
+
+TAM_REUBICACION_ELF = 8
+
+TAM_CABECERA_ELF = 52
+TAM_SECCION_ELF = 40
+TAM_SIMBOLO_ELF = 16
+
+
+def alinear(valor, alineacion):
+    return (valor + alineacion - 1) & -alineacion
+
+
+def tabla_cadenas(nombres):
+    # Devuelve la tabla (bytes) y el desplazamiento de cada nombre
+    contenido = bytearray(b'\0')
+    desplazamientos = []
+    for nombre in nombres:
+        desplazamientos.append(len(contenido))
+        contenido += nombre.encode() + b'\0'
+    return bytes(contenido), desplazamientos
+
+
+def escribir_elf32(codigo, tabla_simbolos, ruta, reubicaciones=()):
+    # Objeto reubicable mínimo: .text con el código y las etiquetas como
+    # símbolos locales de .text. Secciones: nula, .text, .symtab, .strtab,
+    # .shstrtab y, si hay direcciones absolutas, .rel.text con un R_386_32
+    # por campo contra el símbolo de sección (el campo ya tiene el desplazamiento
+    # dentro de .text). El código se copia por bloques detrás de la cabecera
+    tamano = len(codigo)
+    nombres_secciones = ['.text', '.symtab', '.strtab', '.shstrtab']
+    if len(reubicaciones):
+        nombres_secciones.append('.rel.text')
+    shstrtab, (n_text, n_symtab, n_strtab, n_shstrtab, *n_rel) = tabla_cadenas(nombres_secciones)
+    strtab, nombres = tabla_cadenas(list(tabla_simbolos))
+
+    simbolos = bytearray(TAM_SIMBOLO_ELF)  # Símbolo nulo
+    simbolos += struct.pack('<IIIBBH', 0, 0, 0, (STB_LOCAL << 4) | STT_SECTION, 0, 1)
+    for nombre, direccion in zip(nombres, tabla_simbolos.values()):
+        simbolos += struct.pack('<IIIBBH', nombre, direccion, 0, (STB_LOCAL << 4) | STT_NOTYPE, 0, 1)
+    n_simbolos = len(simbolos) // TAM_SIMBOLO_ELF
+
+    off_text = alinear(TAM_CABECERA_ELF, 16)
+    off_symtab = alinear(off_text + tamano, 4)
+    off_strtab = off_symtab + len(simbolos)
+    off_shstrtab = off_strtab + len(strtab)
+    off_rel = alinear(off_shstrtab + len(shstrtab), 4)
+    rel = b''.join(struct.pack('<II', campo, (1 << 8) | R_386_32) for campo in reubicaciones)
+    off_secciones = alinear(off_rel + len(rel), 4)
+
+    cabecera = struct.pack('<16sHHIIIIIHHHHHH',
+                           b'\x7fELF\x01\x01\x01', ET_REL, EM_386, 1, 0, 0, off_secciones, 0,
+                           TAM_CABECERA_ELF, 0, 0, TAM_SECCION_ELF, len(nombres_secciones) + 1, 4)
+    secciones = [
+        bytes(TAM_SECCION_ELF),
+        struct.pack('<10I', n_text, SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, 0, off_text, tamano, 0, 0, 16, 0),
+        struct.pack('<10I', n_symtab, SHT_SYMTAB, 0, 0, off_symtab, len(simbolos), 3, n_simbolos, 4, TAM_SIMBOLO_ELF),
+        struct.pack('<10I', n_strtab, SHT_STRTAB, 0, 0, off_strtab, len(strtab), 0, 0, 1, 0),
+        struct.pack('<10I', n_shstrtab, SHT_STRTAB, 0, 0, off_shstrtab, len(shstrtab), 0, 0, 1, 0),
+    ]
+    if rel:  # Se aplica a .text (1) con los símbolos de .symtab (2)
+        secciones.append(struct.pack('<10I', n_rel[0], SHT_REL, 0, 0, off_rel, len(rel), 2, 1, 4,
+                                     TAM_REUBICACION_ELF))
+
+    with open(ruta, 'wb') as f:
+        f.write(cabecera.ljust(off_text, b'\0'))
+        f.writelines(bloques(codigo))
+        f.writelines((
+            bytes(off_symtab - off_text - tamano),
+            simbolos, strtab, shstrtab,
+            bytes(off_rel - off_shstrtab - len(shstrtab)),
+            rel,
+            bytes(off_secciones - off_rel - len(rel)),
+            b''.join(secciones),
+        ))
+
+
+# Formato -> (escritor, extensión)
+FORMATOS = {
+    'bin': (escribir_binario, '.bin'),
+    'hex': (escribir_intel_hex, '.hex'),
+    'elf': (escribir_elf32, '.o'),
+}
+
+
+def escribir(formato, codigo, tabla_simbolos, ruta, reubicaciones=()):
+    escritor, _ = FORMATOS[formato]
+    escritor(codigo, tabla_simbolos, ruta, reubicaciones)
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import ensamblador
+import ensambladorDosPasadas
+import salida
+from cliente import CABECERA, SOCKET, largos, marco
+
+MOTORES = {
+    'ensamblador': ensamblador.EnsambladorIA32,
+    'dos_pasadas': ensambladorDosPasadas.EnsambladorIA32,
+}
+
+LIMITE_EN_LINEA = 64 * 1024  # Fuentes más grandes se ensamblan en el pool de procesos
+
+INSTANCIAS = {}  # {motor: ensamblador ya armado}, una por proceso
+
+
+def instancia(motor):
+    # Los pedidos se atienden de a uno por proceso (el lazo de eventos no
+    # cede mientras se ensambla), así que basta una instancia por motor:
+    # cada ensamblado empieza con reiniciar()
+    ensamblador_motor = INSTANCIAS.get(motor)
+    if ensamblador_motor is None:
+        if motor not in MOTORES:
+            raise ValueError(f"motor '{motor}' desconocido")
+        ensamblador_motor = INSTANCIAS[motor] = MOTORES[motor]()
+    return ensamblador_motor
+
+
+def atender_texto(meta, datos):
+    resultado = instancia(meta.get('motor', 'ensamblador')).ensamblar_texto(
+        datos.decode(), origen=meta.get('origen') or '<texto>')
+    return {
+        'simbolos': dict(resultado.simbolos),
+        'fixups': resultado.fixups,
+        'errores': resultado.errores,
+    }, resultado.codigo
+
+
+def atender_archivos(meta, datos):
+    # Lo mismo que `python ensamblador.py entradas -f formato -d directorio
+    # [-o salida]`, con una instancia caliente en vez de una por archivo
+    archivos = ensamblador.buscar_entradas(meta['entradas'])
+    if not archivos:
+        raise ValueError("no se encontraron archivos .asm")
+    if meta.get('salida') and len(archivos) > 1:
+        raise ValueError("-o sólo se puede usar con un archivo de entrada")
+    formato = meta.get('formato', 'hex')
+    if formato not in salida.FORMATOS:
+        raise ValueError(f"formato '{formato}' desconocido")
+
+    ensamblador_motor = instancia(meta.get('motor', 'ensamblador'))
+    resultados = []
+    for archivo, directorio in zip(archivos, ensamblador.directorios_de_trabajo(archivos, meta['directorio'])):
+        os.makedirs(directorio, exist_ok=True)
+        ensamblador_motor.reiniciar()
+        ensamblador_motor.ensamblar(archivo, directorio_salida=directorio)
+        ruta = meta.get('salida')
+        if not ruta:
+            nombre = os.path.splitext(os.path.basename(archivo))[0]
+            ruta = os.path.join(directorio, nombre + salida.FORMATOS[formato][1])
+        salida.escribir(formato, ensamblador_motor.codigo_hex, ensamblador_motor.tabla_simbolos, ruta,
+                        ensamblador_motor.reubicaciones)
+        resultados.append((archivo, ruta, len(ensamblador_motor.codigo_hex), ensamblador_motor.diagnosticos.errores))
+    return {'resultados': resultados}, b''
+
+
+def tamano_pedido(meta, datos):
+    if meta.get('tipo') != 'archivos':
+        return len(datos)
+    total = 0
+    for archivo in ensamblador.buscar_entradas(meta.get('entradas', ())):
+        try:
+            total += os.path.getsize(archivo)
+        except OSError:
+            pass
+    return total
+
+
+ATENCION = {'texto': atender_texto, 'archivos': atender_archivos}
+
+
+class ServidorEnsamblador:
+    # Servidor asyncio de larga vida: cada cliente mantiene una conexión y
+    # manda pedidos en marcos (ver cliente.py). Los pedidos chicos se
+    # ensamblan en el mismo lazo, con la instancia caliente, sin copiar nada
+    # a otro proceso; los grandes van a un pool de procesos (cada uno con sus
+    # propias instancias) para no frenar a los demás clientes.
+    def __init__(self, ruta=SOCKET, procesos=None):
+        self.ruta = ruta
+        self.procesos = procesos if procesos is not None else os.cpu_count()
+        self.ejecutor = None
+        self.conexiones = 0
+        self.pedidos = 0
+        self.en_pool = 0
+        self.fallidos = 0
+        self.en_curso = set()  # Futuros del pool sin terminar, para cancelarlos al cerrar
+
+    async def servir(self):
+        if os.path.exists(self.ruta):
+            os.remove(self.ruta)  # Socket de un servidor anterior que no se cerró bien
+        for motor in MOTORES:
+            instancia(motor)
+        if self.procesos > 1:
+            self.ejecutor = ProcessPoolExecutor(max_workers=self.procesos)
+        servidor = await asyncio.start_unix_server(self.atender, path=self.ruta)
+        detener = asyncio.Event()
+        lazo = asyncio.get_running_loop()
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            lazo.add_signal_handler(senal, detener.set)
+        try:
+            async with servidor:
+                await detener.wait()
+        finally:
+            if self.ejecutor is not None:
+                # Los pedidos que todavía esperan en la cola del pool no se
+                # ejecutan (cancel_futures de shutdown hace lo mismo desde 3.9)
+                for futuro in list(self.en_curso):
+                    futuro.cancel()
+                self.ejecutor.shutdown()
+            if os.path.exists(self.ruta):
+                os.remove(self.ruta)
+
+    async def atender(self, lector, escritor):
+        self.conexiones += 1
+        try:
+            while True:
+                try:
+                    cabecera = await lector.readexactly(CABECERA.size)
+                except asyncio.IncompleteReadError:
+                    break  # El cliente cerró la conexión
+                largo_meta, largo_datos = largos(cabecera)
+                meta = json.loads(await lector.readexactly(largo_meta))
+                datos = await lector.readexactly(largo_datos)
+                escritor.write(marco(*await self.responder(meta, datos)))
+                await escritor.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass  # Conexión cortada o marco inválido: se descarta sólo esta conexión
+        finally:
+            escritor.close()
+
+    async def responder(self, meta, datos):
+        self.pedidos += 1
+        tipo = meta.get('tipo')
+        if tipo == 'estado':
+            return {
+                'conexiones': self.conexiones,
+                'pedidos': self.pedidos,
+                'en_pool': self.en_pool,
+                'fallidos': self.fallidos,
+                'procesos': self.procesos,
+            }, b''
+        funcion = ATENCION.get(tipo)
+        try:
+            if funcion is None:
+                raise ValueError(f"pedido '{tipo}' desconocido")
+            if self.ejecutor is not None and tamano_pedido(meta, datos) > LIMITE_EN_LINEA:
+                self.en_pool += 1
+                futuro = self.ejecutor.submit(funcion, meta, datos)
+                self.en_curso.add(futuro)
+                futuro.add_done_callback(self.en_curso.discard)
+                return await asyncio.wrap_future(futuro)
+            return funcion(meta, datos)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.fallidos += 1
+            return {'error': str(e)}, b''
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor de ensamblado IA-32 (socket Unix)")
+    parser.add_argument('--socket', default=SOCKET, help="ruta del socket")
+    parser.add_argument('-j', '--procesos', type=int, default=os.cpu_count(),
+                        help="procesos para los pedidos grandes (1: todo en el servidor)")
+    args = parser.parse_args(argv)
+    print(f"Escuchando en {args.socket}", file=sys.stderr)
+    asyncio.run(ServidorEnsamblador(args.socket, args.procesos).servir())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping
+
+# Formato binario: cabecera, direcciones (uint32 LE) y nombres UTF-8 separados por '\0'
+MAGICO = b'TSIM'
+VERSION_BINARIO = 1
+CABECERA = struct.Struct('<4sII')
+
+# Nombre del reporte según el formato de exportar()
+ARCHIVOS = {'texto': 'simbolos.txt', 'binario': 'simbolos.bin'}
+
+
+class TablaSimbolos(Mapping):
+    # Tabla de símbolos compacta: los nombres se internan (cada etiqueta
+    # existe una sola vez en memoria aunque se use en millones de saltos) y
+    # las direcciones viven en un array('I') paralelo a la lista de nombres.
+    # Se usa como un dict {simbolo: direccion} de sólo inserción.
+    def __init__(self, nombres=None, direcciones=None):
+        self.nombres = nombres if nombres is not None else []
+        self.direcciones = direcciones if direcciones is not None else array('I')
+        self.indices = {nombre: i for i, nombre in enumerate(self.nombres)}
+        self.orden = None  # Permutación ordenada por dirección, si hace falta
+        self.claves_orden = None  # Direcciones en ese orden, para bisect
+
+    def __getitem__(self, nombre):
+        return self.direcciones[self.indices[nombre]]
+
+    def get(self, nombre, defecto=None):
+        i = self.indices.get(nombre)
+        return defecto if i is None else self.direcciones[i]
+
+    def __contains__(self, nombre):
+        return nombre in self.indices
+
+    def __iter__(self):
+        return iter(self.nombres)
+
+    def __len__(self):
+        return len(self.nombres)
+
+    def __repr__(self):
+        return f"TablaSimbolos({dict(self)!r})"
+
+    def __setitem__(self, nombre, direccion):
+        i = self.indices.get(nombre)
+        if i is not None:
+            self.direcciones[i] = direccion
+            self.orden = None
+            return
+        nombre = sys.intern(nombre)
+        self.indices[nombre] = len(self.nombres)
+        self.nombres.append(nombre)
+        self.direcciones.append(direccion)
+        self.orden = None
+
+    def indice(self, nombre):
+        return self.indices.get(nombre)
+
+    def con_direcciones(self, direcciones):
+        # Misma lista de nombres e índice, otras direcciones (sin copiar nombres)
+        tabla = TablaSimbolos.__new__(TablaSimbolos)
+        tabla.nombres = self.nombres
+        tabla.indices = self.indices
+        tabla.direcciones = direcciones
+        tabla.orden = None
+        tabla.claves_orden = None
+        return tabla
+
+    def ordenados(self):
+        # Índices en orden de dirección. Las etiquetas se definen en orden de
+        # dirección, así que casi siempre no hace falta ordenar nada.
+        if self.orden is None:
+            d = self.direcciones
+            if all(d[i] <= d[i + 1] for i in range(len(d) - 1)):
+                self.orden = range(len(d))
+                self.claves_orden = d
+            else:
+                self.orden = array('I', sorted(range(len(d)), key=d.__getitem__))
+                self.claves_orden = array('I', (d[i] for i in self.orden))
+        return self.orden
+
+    def simbolo_en(self, direccion):
+        # Índice inverso: (simbolo, desplazamiento) de la etiqueta más cercana
+        # en o antes de `direccion`, o None si no hay ninguna
+        orden = self.ordenados()
+        k = bisect_right(self.claves_orden, direccion) - 1
+        if k < 0:
+            return None
+        i = orden[k]
+        return self.nombres[i], direccion - self.direcciones[i]
+
+    def ubicacion(self, direccion):
+        # 'etiqueta+desp' (en hex) para listados, o '' si no hay etiqueta antes
+        encontrado = self.simbolo_en(direccion)
+        if encontrado is None:
+            return ''
+        simbolo, desplazamiento = encontrado
+        return f"{simbolo}+{desplazamiento:X}" if desplazamiento else simbolo
+
+    def __getstate__(self):
+        # El índice se reconstruye al cargar; sólo se guardan nombres y direcciones
+        return self.nombres, self.direcciones
+
+    def __setstate__(self, estado):
+        self.__init__(*estado)
+
+    def exportar(self, ruta, formato='texto', ordenar=False):
+        # Una sola escritura; `ordenar` ordena por dirección en vez de por definición
+        indices = self.ordenados() if ordenar else range(len(self.nombres))
+        nombres, direcciones = self.nombres, self.direcciones
+        if formato == 'binario':
+            if not isinstance(indices, range):
+                nombres = [nombres[i] for i in indices]
+                direcciones = array('I', (direcciones[i] for i in indices))
+            if sys.byteorder != 'little':
+                direcciones = array('I', direcciones)
+                direcciones.byteswap()
+            with open(ruta, 'wb') as f:
+                f.write(b''.join((CABECERA.pack(MAGICO, VERSION_BINARIO, len(nombres)),
+                                  direcciones.tobytes(), '\0'.join(nombres).encode())))
+        else:
+            with open(ruta, 'w') as f:
+                f.write(''.join([f"{nombres[i]}: {direcciones[i]:04X}\n" for i in indices]))
+
+    @classmethod
+    def cargar(cls, ruta):
+        # Lee el formato binario de exportar()
+        with open(ruta, 'rb') as f:
+            datos = f.read()
+        magico, version, n = CABECERA.unpack_from(datos)
+        if magico != MAGICO or version != VERSION_BINARIO:
+            raise ValueError(f"'{ruta}' no es una tabla de símbolos binaria")
+        fin = CABECERA.size + 4 * n
+        direcciones = array('I')
+        direcciones.frombytes(datos[CABECERA.size:fin])
+        if sys.byteorder != 'little':
+            direcciones.byteswap()
+        nombres = [sys.intern(nombre) for nombre in datos[fin:].decode().split('\0')] if n else []
+        return cls(nombres, direcciones)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Muestra una tabla de símbolos binaria (simbolos.bin)")
+    parser.add_argument('tabla', nargs='?', default=ARCHIVOS['binario'])
+    parser.add_argument('--ordenar', action='store_true', help="ordenar por dirección")
+    parser.add_argument('-a', '--direccion', action='append', default=[], metavar='DIRECCION',
+                        help="mostrar la etiqueta más cercana a DIRECCION (hex), como etiqueta+desp")
+    args = parser.parse_args(argv)
+
+    try:
+        tabla = TablaSimbolos.cargar(args.tabla)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"{args.tabla}: error: {e}", file=sys.stderr)
+        return 1
+    if args.direccion:
+        for direccion in args.direccion:
+            print(f"{int(direccion, 16):08X} {tabla.ubicacion(int(direccion, 16)) or '?'}")
+        return 0
+    indices = tabla.ordenados() if args.ordenar else range(len(tabla))
+    for i in indices:
+        print(f"{tabla.nombres[i]}: {tabla.direcciones[i]:04X}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())